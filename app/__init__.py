@@ -1,3 +1,5 @@
+import sys
+
 from flask import Flask
 from flask_restful import reqparse, abort, Api, Resource
 
@@ -5,13 +7,52 @@ from flask_restful import reqparse, abort, Api, Resource
 app = Flask(__name__, instance_relative_config=True)
 app.secret_key = 'kja;sf;kj;aksdf()*&908)(*)'
 
+# Load the config file
+from config import app_config, config_name
+
+app.config.from_object(app_config[config_name])
+
+# Time requests if INSTRUMENTATION is on
+from app.instrumentation import init_instrumentation
+
+init_instrumentation(app)
+
+# Send the reads of GET requests to the replicas of DATABASE_REPLICA_URLS, if any
+from app.replicas import init_replicas
+
+init_replicas(app)
+
 # Load the views
 from app import api_v1
 
-# Load the config file
-app.config.from_object('config')
-
 # Load DB
 from app.database import init_db
 
 init_db()
+
+# Full-text index for /api/v1/search, kept in sync by triggers
+from app.search import init_search_index
+
+init_search_index()
+
+# Log of the changes to artists, tracks and albums for /api/v1/changes, written by triggers
+from app.changes import init_change_log
+from app.cache import response_cache
+
+if not init_change_log() and app.config["PREFORK"]:
+    # The workers of app.server could not tell what the others changed, each would serve its own stale copies
+    response_cache.enabled = False
+
+# Make sure every store exists and is cached before the first album comes in
+from app.stores import store_cache
+
+store_cache.load()
+
+# Run the background jobs in worker threads, starting with those left over by a previous process. Threads
+# do not survive a fork, the workers of app.server start their own. Neither do the tools run with
+# `python -m app.<tool>`, such as app.jobs: sys.argv[0] is "-m" while their package is imported
+from app.jobs import job_queue
+
+job_queue.init_app(app)
+if not app.config["PREFORK"] and sys.argv[:1] != ["-m"] and job_queue.pending():
+    job_queue.start()
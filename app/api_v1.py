@@ -1,33 +1,33 @@
 import datetime
-
-from flask import render_template, request, jsonify
+import hashlib
+import json
+import warnings
+from functools import partial, wraps
+
+from flask import render_template, request, url_for, Response, stream_with_context
+from werkzeug.http import http_date
+from sqlalchemy import func, tuple_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.orm.exc import NoResultFound
 
 from app import app
 from app.database import db_session
 from app.models.all import Track, Artist, Album, ArtistToTrackAssociation, TrackToAlbumAssociation, \
-    AlbumToStoresAssociation, StoreEnum, Store
-from flask_restful import fields, marshal_with, abort, Api, Resource
-
-
-@app.route('/api/v1/resources/tracks', methods=['GET'])
-def index():
-    # form = ScrapeForm()
-    #
-    # if request.method == 'POST':
-    #     if form.validate() == False:
-    #         return render_template("index.html", form=form)
-    #     # scrape using posted data as input
-    #     result = scrape(request.form["url"], request.form["keyword"])
-    #     new_result = Result(**result)
-    #     # save to DB
-    #     db_session.add(new_result)
-    #     db_session.commit()
-    #
-    # # retrieve all Results
-    results = Track.query.order_by(Track.track_id.desc()).all()
-
-    return jsonify(results)
+    AlbumToStoresAssociation, StoreEnum, Job, JobItem, Change
+from app.artists import ArtistLookup
+from app.cache import response_cache
+from app.changes import head as change_log_head
+from app.fieldsets import loader_options, marshal_with_selected, selected_options
+from app.filters import Filter, FullScanError, apply_conditions, boolean, check_plan, date, parse_conditions, \
+    requested_order
+from app.idempotency import idempotency_keys
+from app.jobs import job_queue
+from app.orphans import delete_cascade
+from app.search import SEARCH_KINDS, search, search_available
+from app.serializers import compile_fields, orjson, output_fast_json, serialize_with
+from app.stores import store_cache
+from flask_restful import fields, abort, Api, Resource, reqparse
+from flask_restful.utils import unpack
 
 
 @app.route('/')
@@ -43,6 +43,12 @@ def help():
 
 api = Api(app)
 
+if app.config.get('FAST_JSON'):
+    if orjson is None:
+        warnings.warn("FAST_JSON is set but orjson is not installed, using the default JSON encoder")
+    else:
+        api.representations['application/json'] = output_fast_json
+
 artist_fields = {
     'artist_id': fields.Integer,
     'uri': fields.Url('artist_ep'),
@@ -78,67 +84,443 @@ album_fields = {
     'error': fields.String
 }
 
+# Eager loading of the relationships marshalled by the fields above, with selectin loading (one
+# extra query per relationship level, and no row multiplication under LIMIT). GET handlers derive
+# the same options from the fields selected by the request instead, see app.fieldsets.
+track_list_options = loader_options(Track, track_fields)
+album_list_options = loader_options(Album, album_fields)
+
+# Keyset pagination for the "all" listings
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+page_parser = reqparse.RequestParser()
+page_parser.add_argument('limit', type=int, location='args', default=DEFAULT_PAGE_SIZE)
+page_parser.add_argument('after', type=str, location='args')
+
+
+def paginate(query, id_column, order=None, conditions=()):
+    """
+    Return one page of ``query`` ordered by ``id_column`` descending, or by the SortOrder ``order``
+    and then ``id_column``, plus the response headers pointing at the next page. The cursor is the
+    sort value and ID of the last row on the page, so every page costs the same index range scan
+    no matter how deep into the catalog it is. Rows without a sort value are left out.
+    """
+    args = page_parser.parse_args()
+    limit = max(1, min(args['limit'], MAX_PAGE_SIZE))
+    if order is None or order.column is id_column:
+        descending = order is None or order.descending
+        columns, parsers = [id_column], [int]
+    else:
+        descending = order.descending
+        columns, parsers = [order.column, id_column], [order.parse, int]
+        query = query.filter(order.column.isnot(None))
+    if args['after'] is not None:
+        try:
+            # Sort values may contain commas, IDs do not
+            cursor = [parse(value) for parse, value in zip(parsers, args['after'].rsplit(',', len(columns) - 1))]
+        except ValueError:
+            abort(400, message="Invalid cursor '{}'".format(args['after']))
+        if len(cursor) != len(columns):
+            abort(400, message="Invalid cursor '{}'".format(args['after']))
+        key, bound = (columns[0], cursor[0]) if len(columns) == 1 else (tuple_(*columns), tuple_(*cursor))
+        query = query.filter(key < bound if descending else key > bound)
+    query = query.order_by(*(c.desc() if descending else c.asc() for c in columns))
+    shape = (request.endpoint, tuple(sorted((name, op) for name, op, _ in conditions)),
+             tuple(c.key for c in columns), descending, args['after'] is not None)
+    try:
+        check_plan(query, bool(conditions), shape)
+    except FullScanError as e:
+        abort(400, message=str(e))
+    # Fetch one extra row to find out whether there is a next page
+    results = query.limit(limit + 1).all()
+    headers = {}
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = ",".join(str(getattr(results[-1], c.key)) for c in columns)
+        headers['X-Next-Cursor'] = next_cursor
+        url_args = dict(request.args.items(), after=next_cursor, limit=limit, **request.view_args)
+        headers['Link'] = '<{}>; rel="next"'.format(url_for(request.endpoint, **url_args))
+    return results, headers
+
+
+# Filters of the listings, on indexed columns only
+artist_filters = {
+    'name': Filter(Artist.name, sortable=True),
+    'track_id': Filter(Artist.artist_id, int,
+                       through=(ArtistToTrackAssociation.artist_id, ArtistToTrackAssociation.track_id)),
+}
+track_filters = {
+    'isrc': Filter(Track.isrc, sortable=True),
+    'explicit': Filter(Track.explicit, boolean),
+    'artist_id': Filter(Track.track_id, int,
+                        through=(ArtistToTrackAssociation.track_id, ArtistToTrackAssociation.artist_id)),
+    'album_id': Filter(Track.track_id, int,
+                       through=(TrackToAlbumAssociation.track_id, TrackToAlbumAssociation.album_id)),
+}
+album_filters = {
+    'upc': Filter(Album.upc, sortable=True),
+    'release_date': Filter(Album.release_date, date, ranges=True, sortable=True),
+    'store': Filter(Album.album_id, store_cache.store_id,
+                    through=(AlbumToStoresAssociation.album_id, AlbumToStoresAssociation.store_id)),
+    'track_id': Filter(Album.album_id, int,
+                       through=(TrackToAlbumAssociation.album_id, TrackToAlbumAssociation.track_id)),
+}
+
+
+def listing(query, id_column, filters):
+    """
+    Return one page of ``query`` narrowed down by the ``filters`` given as query string arguments,
+    e.g. ?explicit=true or ?release_date>=2020-01-01, and sorted by ?sort=, plus its headers.
+    """
+    try:
+        conditions = parse_conditions(filters)
+        order = requested_order(filters, conditions, id_column)
+    except ValueError as e:
+        abort(400, message=str(e))
+    return paginate(apply_conditions(query, filters, conditions), id_column, order, conditions)
+
+
+def cached_dependents(artist_ids=(), track_ids=(), album_ids=()):
+    """
+    Map each kind of resource to the IDs of those showing any of the given artists, tracks or
+    albums, which are included as well. Call it before deleting anything.
+    """
+    artist_ids = {str(i) for i in artist_ids}
+    track_ids = {str(i) for i in track_ids}
+    album_ids = {str(i) for i in album_ids}
+    if artist_ids:
+        track_ids.update(str(i) for (i,) in db_session.query(ArtistToTrackAssociation.track_id)
+                         .filter(ArtistToTrackAssociation.artist_id.in_(artist_ids)))
+    if track_ids:
+        album_ids.update(str(i) for (i,) in db_session.query(TrackToAlbumAssociation.album_id)
+                         .filter(TrackToAlbumAssociation.track_id.in_(track_ids)))
+    return {"artist": artist_ids, "track": track_ids, "album": album_ids}
+
+
+def touch(dependents):
+    """
+    Bump the version of the tracks and albums in ``dependents``, whose representation embeds a
+    changed artist or track. Call it within the transaction making the change.
+    """
+    now = datetime.datetime.utcnow()
+    for model, id_column, kind in ((Track, Track.track_id, "track"), (Album, Album.album_id, "album")):
+        if dependents[kind]:
+            model.query.filter(id_column.in_(dependents[kind])) \
+                .update({model.updated_at: now}, synchronize_session=False)
+
+
+def invalidate_cached(dependents):
+    """
+    Drop the cached resources in ``dependents`` and the listings they may appear in.
+    """
+    for kind, resource_ids in dependents.items():
+        response_cache.invalidate(kind, *resource_ids)
+    response_cache.invalidate_lists(*(kind for kind, resource_ids in dependents.items() if resource_ids))
+
+
+def delete_with_dependents(artist_ids=(), track_ids=(), album_ids=()):
+    """
+    Delete artists, tracks and albums along with their association rows, and the orphans they leave if
+    DELETE_ORPHANS is on, bump the version of the tracks and albums that showed them and drop them all
+    from the cache.
+    """
+    dependents = cached_dependents(artist_ids, track_ids, album_ids)
+    deleted = delete_cascade(artist_ids, track_ids, album_ids, orphans=app.config["DELETE_ORPHANS"])
+    touch(dependents)
+    db_session.commit()
+    for kind, resource_ids in deleted.items():
+        dependents[kind].update(str(i) for i in resource_ids)
+    invalidate_cached(dependents)
+
+
+# Batch updates
+BATCH_UPDATE_CHUNK_SIZE = 1000
+
+patch_parser = reqparse.RequestParser()
+patch_parser.add_argument('chunk_size', type=int, location='args', default=BATCH_UPDATE_CHUNK_SIZE)
+
+
+def column_parser(column):
+    """
+    Function checking a JSON value for ``column`` and turning it into the column's Python type.
+    Raises TypeError or ValueError for values that do not fit.
+    """
+    python_type = column.type.python_type
+
+    def parse(value):
+        if value is None:
+            if not column.nullable:
+                raise ValueError("{} cannot be null".format(column.key))
+            return None
+        if python_type is bool:
+            return value if isinstance(value, bool) else boolean(value)
+        if python_type is datetime.date:
+            return date(value)
+        if not isinstance(value, python_type) or isinstance(value, bool):
+            raise TypeError("{} must be a {}".format(column.key, python_type.__name__))
+        if python_type is str and column.type.length and len(value) > column.type.length:
+            raise ValueError("{} is longer than {} characters".format(column.key, column.type.length))
+        return value
+    return parse
+
+
+def updatable_columns(model):
+    """
+    Parsers of the columns of ``model`` that clients may change, by name.
+    """
+    return {column.key: column_parser(column) for column in model.__table__.columns
+            if not column.primary_key and column.key != 'updated_at'}
+
+
+def parse_change(item, parsers):
+    """
+    The ID and the parsed changes of a batch update ``item``, ``{"id": 1, "changes": {...}}``.
+    """
+    if not isinstance(item, dict) or not isinstance(item.get("changes"), dict):
+        raise TypeError("expected {\"id\": <id>, \"changes\": {<column>: <value>}}")
+    if isinstance(item.get("id"), bool) or not isinstance(item.get("id"), int):
+        raise TypeError("id must be an integer")
+    if not item["changes"]:
+        raise ValueError("no changes")
+    unknown = sorted(set(item["changes"]) - set(parsers))
+    if unknown:
+        raise ValueError("unknown columns {}, use {}".format(", ".join(unknown), ", ".join(sorted(parsers))))
+    return item["id"], {key: parsers[key](value) for key, value in item["changes"].items()}
+
+
+def batch_update(model, id_column, kind, items, chunk_size):
+    """
+    Apply ``{"id", "changes"}`` items to ``kind`` resources. Items making the same changes are grouped
+    into one UPDATE of all their IDs, and the updates are committed in transactions of ``chunk_size``
+    rows. Returns one result per item with the number of rows it ``affected``: items that are invalid
+    fail on their own, a transaction that fails fails all of its items.
+    """
+    parsers = updatable_columns(model)
+    results = []
+    groups = {}
+    changed_by = {}
+    for index, item in enumerate(items):
+        try:
+            resource_id, changes = parse_change(item, parsers)
+            if resource_id in changed_by:
+                raise ValueError("{} {} is changed by item {} already".format(kind, resource_id,
+                                                                              changed_by[resource_id]))
+        except (TypeError, ValueError, AttributeError) as e:
+            results.append(dict(index=index, status="failed", affected=0,
+                                error="{}: {}".format(type(e).__name__, e)))
+            continue
+        changed_by[resource_id] = index
+        groups.setdefault(frozenset(changes.items()), []).append((index, resource_id))
+
+    # (changes, [(index, ID)]) updates of the next transaction, and how many rows they change
+    updates = []
+    size = 0
+    chunk_size = chunk_size if chunk_size > 0 else max(len(items), 1)
+    for changes, group in groups.items():
+        # A group that does not fit is split, its rest starts the next transaction
+        start = 0
+        while start < len(group):
+            ids = group[start:start + chunk_size - size]
+            updates.append((dict(changes), ids))
+            size += len(ids)
+            start += len(ids)
+            if size == chunk_size:
+                results.extend(commit_updates(model, id_column, kind, updates))
+                updates = []
+                size = 0
+    if updates:
+        results.extend(commit_updates(model, id_column, kind, updates))
+    return sorted(results, key=lambda r: r["index"])
+
+
+def commit_updates(model, id_column, kind, updates):
+    resource_ids = [resource_id for changes, ids in updates for index, resource_id in ids]
+    try:
+        existing = {i for (i,) in db_session.query(id_column).filter(id_column.in_(resource_ids))}
+        dependents = cached_dependents(**{"{}_ids".format(kind): existing})
+        for changes, ids in updates:
+            model.query.filter(id_column.in_([resource_id for index, resource_id in ids])) \
+                .update(changes, synchronize_session=False)
+        touch(dependents)
+        db_session.commit()
+    except SQLAlchemyError as e:
+        db_session.rollback()
+        return [dict(index=index, id=resource_id, status="failed", affected=0, error=str(e))
+                for changes, ids in updates for index, resource_id in ids]
+    invalidate_cached(dependents)
+    return [dict(index=index, id=resource_id, status="updated" if resource_id in existing else "not found",
+                 affected=int(resource_id in existing), error=None)
+            for changes, ids in updates for index, resource_id in ids]
+
+
+def patch_listing(model, id_column, kind):
+    """
+    Answer a batch PATCH of ``kind`` resources: 200 if every item was valid, 207 otherwise.
+    """
+    items = request.get_json()
+    if not isinstance(items, list):
+        abort(400, message="Expected a list of {\"id\": <id>, \"changes\": {<column>: <value>}}")
+    results = batch_update(model, id_column, kind, items, patch_parser.parse_args()['chunk_size'])
+    return results, 207 if any(r["status"] == "failed" for r in results) else 200
+
+
+def conditional(kind, model, id_column, id_arg):
+    """
+    Decorate the GET handler of single ``kind`` resources, identified by keyword argument ``id_arg``,
+    with ETag and Last-Modified headers taken from ``model.updated_at``. Requests whose
+    If-None-Match or If-Modified-Since show that they already have the current version get an
+    empty 304 response without anything being loaded or marshalled.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            resource_id = kwargs.get(id_arg)
+            if resource_id == "all":
+                return f(*args, **kwargs)
+            updated_at = response_cache.version(
+                kind, resource_id,
+                lambda: db_session.query(model.updated_at).filter(id_column == resource_id).scalar())
+            if updated_at is None:
+                # Not found, or not changed since versions were introduced
+                return f(*args, **kwargs)
+
+            # The representation depends on the fields= and expand= arguments as well
+            etag = hashlib.sha1("{}:{}:{}:{}".format(kind, resource_id, updated_at.isoformat(),
+                                                     request.query_string.decode()).encode()).hexdigest()
+            headers = {'ETag': '"{}"'.format(etag), 'Last-Modified': http_date(updated_at)}
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = (since is not None and
+                                updated_at.replace(microsecond=0) <= since.replace(tzinfo=None))
+            if not_modified:
+                return Response(status=304, headers=headers)
+
+            resp = f(*args, **kwargs)
+            if isinstance(resp, tuple):
+                data, code, resp_headers = unpack(resp)
+                return data, code, dict(resp_headers or {}, **headers)
+            return resp, 200, headers
+        return wrapper
+    return decorator
+
 
 class Artists(Resource):
-    @marshal_with(artist_fields)
+    @conditional('artist', Artist, Artist.artist_id, 'artist_id')
+    @response_cache.cached('artist', 'artist_id')
+    @marshal_with_selected(Artist, artist_fields)
     def get(self, artist_id=0):
         if artist_id == "all":
-            results = Artist.query.order_by(Artist.artist_id.desc()).all()
-        else:
-            try:
-                results = Artist.query.filter_by(artist_id=artist_id).one()
-            except NoResultFound as e:
-                results = {"error": "{}, Artist with ID '{}' not found".format(str(e), artist_id)}
+            query = Artist.query.options(*selected_options(Artist, artist_fields))
+            results, headers = listing(query, Artist.artist_id, artist_filters)
+            return results, 200, headers
+        try:
+            results = Artist.query.options(*selected_options(Artist, artist_fields)) \
+                .filter_by(artist_id=artist_id).one()
+        except NoResultFound as e:
+            results = {"error": "{}, Artist with ID '{}' not found".format(str(e), artist_id)}
         return results
 
     def delete(self, artist_id=0):
-        to_delete = Artist.query.filter_by(artist_id=artist_id).delete()
-        if to_delete:
-            # TODO: do it the ORM way
-            ArtistToTrackAssociation.query.filter_by(artist_id=artist_id).delete()
-            db_session.commit()
+        delete_with_dependents(artist_ids=[artist_id])
         return "", 204
 
     def put(self, artist_id=0):
         to_update = Artist.query.filter_by(artist_id=artist_id)
         if to_update:
             json = request.get_json()
-            to_update.update(json)
+            try:
+                to_update.update(json)
+            except IntegrityError:
+                db_session.rollback()
+                abort(409, message="There is an artist called '{}' already".format(json.get("name")))
+            dependents = cached_dependents(artist_ids=[artist_id])
+            touch(dependents)
             db_session.commit()
+            invalidate_cached(dependents)
         return "", 201
 
-    @marshal_with(artist_fields)
+    @idempotency_keys.idempotent
+    @serialize_with(artist_fields)
     def post(self, artist_id=0):
         json = request.get_json()
-        artist = Artist(**json)
-        db_session.add(artist)
+        try:
+            name = artist_name(json)
+        except ValueError as e:
+            abort(400, message=str(e))
+        # Artists are unique by name: answer with the existing one, if any
+        artists = ArtistLookup()
+        artist = artists.get(name)
         db_session.commit()
+        if name not in artists.created:
+            return artist, 200
+        response_cache.invalidate_lists('artist')
 
         return artist, 201
 
 
+class ArtistList(Resource):
+    @response_cache.cached('artist')
+    @marshal_with_selected(Artist, artist_fields)
+    def get(self):
+        query = Artist.query.options(*selected_options(Artist, artist_fields))
+        results, headers = listing(query, Artist.artist_id, artist_filters)
+        return results, 200, headers
+
+    def patch(self):
+        return patch_listing(Artist, Artist.artist_id, 'artist')
+
+
 # Artists resource routing
 api.add_resource(Artists, '/api/v1/resources/artists/<artist_id>', endpoint='artist_ep')
+api.add_resource(ArtistList, '/api/v1/resources/artists', endpoint='artists_ep')
+
+
+def artist_name(json):
+    """
+    Name of an artist JSON. Raises ValueError if it has none.
+    """
+    name = json.get("name") if isinstance(json, dict) else None
+    if not isinstance(name, str) or not name:
+        raise ValueError("Artists need a name")
+    return name
+
+
+def credited_artist_names(json):
+    """
+    Names of the artists credited on the tracks of a track or album JSON. Raises ValueError for
+    artists without a name.
+    """
+    return [artist_name(a) for t in json.get("tracks", [json]) for a in t.get("artists", [])]
+
+
+def build_track(json, artists):
+    """
+    Build a new Track from the request JSON, crediting the artists from the ``artists`` lookup.
+    """
+    return Track(**dict(json, artists=[artists.get(artist_name(a)) for a in json.get("artists", [])]))
 
 
 class Tracks(Resource):
-    @marshal_with(track_fields)
+    @conditional('track', Track, Track.track_id, 'track_id')
+    @response_cache.cached('track', 'track_id')
+    @marshal_with_selected(Track, track_fields)
     def get(self, track_id):
         if track_id == "all":
-            results = Track.query.order_by(Track.track_id.desc()).all()
-        else:
-            try:
-                results = Track.query.filter_by(track_id=track_id).one()
-            except NoResultFound as e:
-                results = {"error": "{}, Track with ID '{}' not found".format(str(e), track_id)}
+            query = Track.query.options(*selected_options(Track, track_fields))
+            results, headers = listing(query, Track.track_id, track_filters)
+            return results, 200, headers
+        try:
+            results = Track.query.options(*selected_options(Track, track_fields)) \
+                .filter_by(track_id=track_id).one()
+        except NoResultFound as e:
+            results = {"error": "{}, Track with ID '{}' not found".format(str(e), track_id)}
         return results
 
     def delete(self, track_id):
-        to_delete = Track.query.filter_by(track_id=track_id).delete()
-        if to_delete:
-            # TODO: do it the ORM way
-            ArtistToTrackAssociation.query.filter_by(track_id=track_id).delete()
-            db_session.commit()
+        delete_with_dependents(track_ids=[track_id])
         return "", 204
 
     def put(self, track_id):
@@ -146,42 +528,82 @@ class Tracks(Resource):
         if to_update:
             json = request.get_json()
             to_update.update(json)
+            dependents = cached_dependents(track_ids=[track_id])
+            touch(dependents)
             db_session.commit()
+            invalidate_cached(dependents)
         return "", 201
 
-    @marshal_with(track_fields)
+    @idempotency_keys.idempotent
+    @serialize_with(track_fields)
     def post(self, track_id):
         json = request.get_json()
-        track = Track(**json)
+        artists = ArtistLookup()
+        try:
+            artists.want(credited_artist_names(json))
+            track = build_track(json, artists)
+        except ValueError as e:
+            abort(400, message=str(e))
         db_session.add(track)
         db_session.commit()
+        response_cache.invalidate_lists('track', 'artist')
 
         return track, 201
 
 
+class TrackList(Resource):
+    @response_cache.cached('track')
+    @marshal_with_selected(Track, track_fields)
+    def get(self):
+        query = Track.query.options(*selected_options(Track, track_fields))
+        results, headers = listing(query, Track.track_id, track_filters)
+        return results, 200, headers
+
+    def patch(self):
+        return patch_listing(Track, Track.track_id, 'track')
+
+
 # Tracks resource routing
 api.add_resource(Tracks, '/api/v1/resources/tracks/<track_id>', endpoint='track_ep')
+api.add_resource(TrackList, '/api/v1/resources/tracks', endpoint='tracks_ep')
+
+
+def build_album(json, artists):
+    """
+    Build a new Album with its stores and tracks from the request JSON, without committing it.
+    Raises ValueError for unknown stores.
+    """
+    # Build everything before associating, so that an invalid item never ends up in the session
+    # through the stores' backref cascade
+    try:
+        album_stores = [store_cache.get(s) for s in json.get("stores", [])]
+    except KeyError as e:
+        raise ValueError("Unknown store {}".format(e))
+    album_tracks = [build_track(t, artists) for t in json.get("tracks", [])]
+    album = Album(**json)
+    album.stores = album_stores
+    album.tracks = album_tracks
+    return album
 
 
 class Albums(Resource):
-    @marshal_with(album_fields)
+    @conditional('album', Album, Album.album_id, 'album_id')
+    @response_cache.cached('album', 'album_id')
+    @marshal_with_selected(Album, album_fields)
     def get(self, album_id):
         if album_id == "all":
-            results = Album.query.order_by(Album.album_id.desc()).all()
-        else:
-            try:
-                results = Album.query.filter_by(album_id=album_id).one()
-            except NoResultFound as e:
-                results = {"error": "{}, Album with ID '{}' not found".format(str(e), album_id)}
+            query = Album.query.options(*selected_options(Album, album_fields))
+            results, headers = listing(query, Album.album_id, album_filters)
+            return results, 200, headers
+        try:
+            results = Album.query.options(*selected_options(Album, album_fields)) \
+                .filter_by(album_id=album_id).one()
+        except NoResultFound as e:
+            results = {"error": "{}, Album with ID '{}' not found".format(str(e), album_id)}
         return results
 
     def delete(self, album_id):
-        to_delete = Album.query.filter_by(album_id=album_id).delete()
-        if to_delete:
-            # TODO: do it the ORM way
-            TrackToAlbumAssociation.query.filter_by(album_id=album_id).delete()
-            AlbumToStoresAssociation.query.filter_by(album_id=album_id).delete()
-            db_session.commit()
+        delete_with_dependents(album_ids=[album_id])
         return "", 204
 
     def put(self, album_id):
@@ -192,33 +614,368 @@ class Albums(Resource):
                 json["release_date"] = datetime.date.fromisoformat(json["release_date"])
             album_to_update.update(json)
             db_session.commit()
+            invalidate_cached(cached_dependents(album_ids=[album_id]))
         return "", 201
 
-    @marshal_with(album_fields)
+    @idempotency_keys.idempotent
     def post(self, album_id):
         json = request.get_json()
-        album = Album(**json)
+        if async_parser.parse_args()['async']:
+            return enqueue_ingestion({"albums": [json]}, chunk_size=1)
+        return self.create(json)
+
+    @serialize_with(album_fields)
+    def create(self, json):
+        artists = ArtistLookup()
+        try:
+            artists.want(credited_artist_names(json))
+            album = build_album(json, artists)
+        except ValueError as e:
+            abort(400, message=str(e))
         db_session.add(album)
         db_session.commit()
-        if "stores" in json:
-            for s in json["stores"]:
-                store = Store.query.filter_by(name=s).first()
-                if not store:
-                    store = Store(name=s)
-                    db_session.add(store)
-                    db_session.commit()
-                album.stores.append(store)
-            db_session.add(album)
-            db_session.commit()
-        if "tracks" in json:
-            for t in json["tracks"]:
-                track = Track(**t)
-                album.tracks.append(track)
-            db_session.add(album)
-            db_session.commit()
+        response_cache.invalidate_lists('album', 'track', 'artist')
 
+        # Reload the committed album graph in one go instead of lazily while marshalling
+        album = Album.query.options(*album_list_options).filter_by(album_id=album.album_id).one()
         return album, 201
 
 
+class AlbumList(Resource):
+    @response_cache.cached('album')
+    @marshal_with_selected(Album, album_fields)
+    def get(self):
+        query = Album.query.options(*selected_options(Album, album_fields))
+        results, headers = listing(query, Album.album_id, album_filters)
+        return results, 200, headers
+
+    def patch(self):
+        return patch_listing(Album, Album.album_id, 'album')
+
+
 # Albums resource routing
 api.add_resource(Albums, '/api/v1/resources/albums/<album_id>', endpoint='album_ep')
+api.add_resource(AlbumList, '/api/v1/resources/albums', endpoint='albums_ep')
+
+
+# Bulk creation
+BULK_CHUNK_SIZE = 1000
+
+async_parser = reqparse.RequestParser()
+async_parser.add_argument('async', type=boolean, location='args', default=False)
+
+bulk_parser = async_parser.copy()
+bulk_parser.add_argument('chunk_size', type=int, location='args', default=BULK_CHUNK_SIZE)
+
+
+def bulk_create(items, build, id_attr, names, chunk_size, start=0, record=None):
+    """
+    Create one object per item with ``build(item, artists)``, where ``artists`` has looked up the artist
+    ``names(item)`` of the whole chunk, and insert them in transactions of ``chunk_size``
+    items (all of them in one transaction if ``chunk_size`` is 0). Returns one result per item, numbered from
+    ``start``: items that cannot be built or inserted fail on their own, leaving nothing behind, not even
+    the new artists they credit. A chunk that fails to commit fails as a whole.
+
+    ``record(results)`` is called with the results of each chunk before it is committed, whatever it adds to
+    the session is committed with the chunk.
+    """
+    results = []
+    chunk_size = chunk_size if chunk_size > 0 else max(len(items), 1)
+    for offset in range(0, len(items), chunk_size):
+        chunk_items = items[offset:offset + chunk_size]
+        # Look up the existing artists credited anywhere in the chunk with one query
+        artists = ArtistLookup()
+        for item in chunk_items:
+            try:
+                artists.want(names(item))
+            except (TypeError, ValueError, KeyError, AttributeError):
+                pass  # reported when the item is built
+        artists.load()
+        chunk = []
+        failed = []
+        for index, item in enumerate(chunk_items, start + offset):
+            created = set(artists.created)
+            # The new artists of the item are inserted in its savepoint, and rolled back with it if it fails
+            savepoint = db_session.begin_nested()
+            try:
+                obj = build(item, artists)
+                db_session.add(obj)
+                # Collect the new IDs before committing, reading them afterwards would reload every row
+                db_session.flush()
+            except (TypeError, ValueError, KeyError, AttributeError, IntegrityError) as e:
+                savepoint.rollback()
+                artists.forget(artists.created - created)
+                failed.append(dict(index=index, status="failed", error="{}: {}".format(type(e).__name__, e)))
+                continue
+            savepoint.commit()
+            chunk.append((index, obj))
+        try:
+            chunk_results = failed + [dict(index=index, status="created", error=None,
+                                           **{id_attr: getattr(obj, id_attr)})
+                                      for index, obj in chunk]
+            if record:
+                record(chunk_results)
+            db_session.commit()
+        except SQLAlchemyError as e:
+            db_session.rollback()
+            chunk_results = failed + [dict(index=index, status="failed", error=str(e)) for index, obj in chunk]
+            if record:
+                record(chunk_results)
+                db_session.commit()
+        results.extend(chunk_results)
+    return sorted(results, key=lambda r: r["index"])
+
+
+# (key of the payload, build(item, artists), ID attribute, endpoint, artist names(item)), in the order
+# they are created. Artists are unique by name, existing ones are reported as created
+BULK_RESOURCES = [
+    ("artists", lambda a, artists: artists.get(artist_name(a)), "artist_id", "artist_ep",
+     lambda a: [artist_name(a)]),
+    ("tracks", build_track, "track_id", "track_ep", credited_artist_names),
+    ("albums", build_album, "album_id", "album_ep", credited_artist_names),
+]
+resource_ids = {resource: id_attr for resource, build, id_attr, endpoint, names in BULK_RESOURCES}
+resource_endpoints = {resource: endpoint for resource, build, id_attr, endpoint, names in BULK_RESOURCES}
+
+
+def with_uri(resource, result):
+    """
+    The ``result`` of a bulk item with the URI of what it created, if anything.
+    """
+    id_attr = resource_ids[resource]
+    if result.get(id_attr) is None:
+        return result
+    return dict(result, uri=url_for(resource_endpoints[resource], **{id_attr: result[id_attr]}))
+
+
+def check_bulk_payload(payload):
+    """
+    Answer 400 unless the bulk ``payload`` is an object of lists of artists, tracks and albums.
+    """
+    if not isinstance(payload, dict) or not all(isinstance(payload.get(r, []), list) for r in resource_ids):
+        abort(400, message="Expected lists of {}".format(", ".join(resource_ids)))
+
+
+class Bulk(Resource):
+    @idempotency_keys.idempotent
+    def post(self):
+        json = request.get_json()
+        args = bulk_parser.parse_args()
+        check_bulk_payload(json)
+        if args['async']:
+            return enqueue_ingestion(json, args['chunk_size'])
+        results = {resource: [with_uri(resource, r) for r in bulk_create(json.get(resource, []), build, id_attr,
+                                                                          names, args['chunk_size'])]
+                   for resource, build, id_attr, endpoint, names in BULK_RESOURCES}
+        response_cache.invalidate_lists('album', 'track', 'artist')
+        failed = any(r["status"] == "failed" for items in results.values() for r in items)
+        return results, 207 if failed else 201
+
+
+# Bulk resource routing
+api.add_resource(Bulk, '/api/v1/resources/bulk', endpoint='bulk_ep')
+
+
+# Asynchronous ingestion
+def record_job_items(job, resource, results):
+    db_session.add_all(JobItem(job_id=job.job_id, resource=resource, item_index=r["index"], status=r["status"],
+                               error=r["error"], resource_id=r.get(resource_ids[resource]))
+                       for r in results)
+    job.updated_at = datetime.datetime.utcnow()
+
+
+@job_queue.handler('ingest')
+def ingest(job, payload, chunk_size):
+    """
+    Create the artists, tracks and albums of the job's payload like the bulk endpoint, recording the
+    result of each item with the chunk that wrote it. Items recorded by an interrupted run are skipped.
+    """
+    for resource, build, id_attr, endpoint, names in BULK_RESOURCES:
+        # Chunks are committed in order, so the recorded items are the first ones
+        done = JobItem.query.filter_by(job_id=job.job_id, resource=resource).count()
+        bulk_create(payload.get(resource, [])[done:], build, id_attr, names, chunk_size, start=done,
+                    record=partial(record_job_items, job, resource))
+        response_cache.invalidate_lists('album', 'track', 'artist')
+
+
+def enqueue_ingestion(payload, chunk_size):
+    """
+    Queue the creation of the artists, tracks and albums of a bulk ``payload``, answering 202 with the
+    job's status and its URI in the Location header.
+    """
+    check_bulk_payload(payload)
+    total = sum(len(payload.get(resource, [])) for resource in resource_ids)
+    job = job_queue.enqueue('ingest', payload, total, chunk_size)
+    return job_status(job, results=False), 202, {'Location': url_for('job_ep', job_id=job.job_id)}
+
+
+job_parser = reqparse.RequestParser()
+job_parser.add_argument('results', type=boolean, location='args', default=True)
+
+
+def job_status(job, results=True):
+    """
+    Progress of an ingestion job, with the result of each processed item if ``results``, in the
+    format of the bulk endpoint's response.
+    """
+    counts = dict(db_session.query(JobItem.status, func.count()).filter(JobItem.job_id == job.job_id)
+                  .group_by(JobItem.status))
+    status = dict(job_id=job.job_id, status=job.status.name, uri=url_for('job_ep', job_id=job.job_id),
+                  total=job.total, processed=sum(counts.values()), created=counts.get("created", 0),
+                  failed=counts.get("failed", 0), error=job.error)
+    for key in ('created_at', 'started_at', 'finished_at'):
+        value = getattr(job, key)
+        status[key] = value.isoformat() if value else None
+    if results:
+        status["results"] = {resource: [] for resource in resource_ids}
+        items = JobItem.query.filter_by(job_id=job.job_id).order_by(JobItem.resource, JobItem.item_index)
+        for item in items:
+            result = dict(index=item.item_index, status=item.status, error=item.error)
+            if item.resource_id is not None:
+                result[resource_ids[item.resource]] = item.resource_id
+            status["results"][item.resource].append(with_uri(item.resource, result))
+    return status
+
+
+class Jobs(Resource):
+    def get(self, job_id):
+        job = Job.query.filter_by(job_id=job_id).first()
+        if job is None:
+            abort(404, message="Job with ID '{}' not found".format(job_id))
+        return job_status(job, job_parser.parse_args()['results'])
+
+
+# Jobs resource routing
+api.add_resource(Jobs, '/api/v1/jobs/<job_id>', endpoint='job_ep')
+
+
+# Full-text search
+search_fields = {
+    'artist': {'type': fields.String, 'artist_id': fields.Integer, 'name': fields.String,
+               'uri': fields.Url('artist_ep')},
+    'track': {'type': fields.String, 'track_id': fields.Integer, 'title': fields.String, 'version': fields.String,
+              'uri': fields.Url('track_ep')},
+    'album': {'type': fields.String, 'album_id': fields.Integer, 'title': fields.String,
+              'uri': fields.Url('album_ep')},
+}
+search_serializers = {kind: compile_fields(kind_fields) for kind, kind_fields in search_fields.items()}
+
+search_parser = reqparse.RequestParser()
+search_parser.add_argument('q', type=str, location='args', required=True, help="q is the text to search for")
+search_parser.add_argument('type', type=str, location='args')
+search_parser.add_argument('limit', type=int, location='args', default=DEFAULT_PAGE_SIZE)
+search_parser.add_argument('offset', type=int, location='args', default=0)
+
+
+class Search(Resource):
+    def get(self):
+        """
+        Artists, tracks and albums whose name, title or version contain words starting with every
+        word of ?q=, best matches first. ?type=track,album restricts the kinds of results. Results
+        are ranked rather than ordered by ID, so pages are addressed with ?offset=.
+        """
+        if not search_available():
+            abort(501, message="Full-text search needs SQLite FTS5, it is not available on this database")
+        args = search_parser.parse_args()
+        kinds = [k.strip() for k in args['type'].split(',')] if args['type'] else None
+        unknown = set(kinds or ()) - set(SEARCH_KINDS)
+        if unknown:
+            abort(400, message="Unknown type '{}'".format("', '".join(sorted(unknown))))
+        limit = max(1, min(args['limit'], MAX_PAGE_SIZE))
+        offset = max(0, args['offset'])
+        hits = search(db_session, args['q'], kinds, limit + 1, offset)
+        headers = {}
+        if len(hits) > limit:
+            hits = hits[:limit]
+            headers['X-Next-Cursor'] = str(offset + limit)
+            url_args = dict(request.args.items(), offset=offset + limit, limit=limit)
+            headers['Link'] = '<{}>; rel="next"'.format(url_for(request.endpoint, **url_args))
+        return [search_serializers[hit['type']](hit) for hit in hits], 200, headers
+
+
+api.add_resource(Search, '/api/v1/search', endpoint='search_ep')
+
+
+# Streaming full-catalog exports
+EXPORT_BATCH_SIZE = 1000
+
+export_resources = {
+    'artists': (Artist, Artist.artist_id, artist_fields, ()),
+    'tracks': (Track, Track.track_id, track_fields, track_list_options),
+    'albums': (Album, Album.album_id, album_fields, album_list_options),
+}
+
+
+def export_rows(query, row_fields, ndjson=False):
+    """
+    Marshal and serialise ``query`` one row at a time, as a JSON array or as newline-delimited JSON.
+    """
+    serialize = compile_fields(row_fields)
+    if ndjson:
+        for row in query:
+            yield json.dumps(serialize(row)) + "\n"
+        return
+    yield "["
+    for i, row in enumerate(query):
+        yield ("," if i else "") + json.dumps(serialize(row))
+    yield "]"
+
+
+class Export(Resource):
+    def get(self, resource):
+        if resource not in export_resources:
+            abort(404, message="Unknown resource '{}'".format(resource))
+        model, id_column, row_fields, options = export_resources[resource]
+        # Rows are fetched from the cursor in batches and are not referenced any more once serialised,
+        # so memory stays flat however large the catalog is
+        query = model.query.options(*options).order_by(id_column).yield_per(EXPORT_BATCH_SIZE)
+        ndjson = request.args.get('format') == 'ndjson'
+        mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+        # The export is read in the transaction of this query, so it includes every change up to it
+        headers = {'X-Change-Seq': str(change_log_head(db_session))}
+        return Response(stream_with_context(export_rows(query, row_fields, ndjson)), mimetype=mimetype,
+                        headers=headers)
+
+
+# Export resource routing
+api.add_resource(Export, '/api/v1/export/<resource>', endpoint='export_ep')
+
+
+# Change feed
+change_fields = {
+    'seq': fields.Integer,
+    'type': fields.String(attribute='kind'),
+    'id': fields.Integer(attribute='resource_id'),
+    'operation': fields.String,
+    'changed_at': fields.DateTime(dt_format='iso8601'),
+}
+
+changes_parser = reqparse.RequestParser()
+changes_parser.add_argument('since', type=int, location='args', default=0)
+changes_parser.add_argument('limit', type=int, location='args')
+
+
+class Changes(Resource):
+    def get(self):
+        """
+        Stream the changes logged after sequence number ``since`` in sequence order, at most ``limit`` of
+        them. X-Change-Seq is the last change streamed, to pass as ``since`` next time.
+        """
+        args = changes_parser.parse_args()
+        latest = change_log_head(db_session)
+        if args['limit'] is not None and args['limit'] < 1:
+            abort(400, message="limit must be at least 1")
+        if args['limit']:
+            # The header goes out before the rows, so find where the limit cuts the changes first
+            last = db_session.query(Change.seq).filter(Change.seq > args['since'], Change.seq <= latest) \
+                .order_by(Change.seq).offset(args['limit'] - 1).limit(1).scalar()
+            latest = latest if last is None else last
+        query = Change.query.filter(Change.seq > args['since'], Change.seq <= latest).order_by(Change.seq)
+        ndjson = request.args.get('format') == 'ndjson'
+        mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+        rows = export_rows(query.yield_per(EXPORT_BATCH_SIZE), change_fields, ndjson)
+        return Response(stream_with_context(rows), mimetype=mimetype, headers={'X-Change-Seq': str(latest)})
+
+
+# Changes resource routing
+api.add_resource(Changes, '/api/v1/changes', endpoint='changes_ep')
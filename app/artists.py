@@ -0,0 +1,93 @@
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.database import db_session
+from app.models.all import Artist
+
+# Stay well below SQLite's limit on bound parameters per statement
+LOOKUP_CHUNK_SIZE = 500
+
+# INSERT constructs of the backends that can skip the rows conflicting with a unique index
+_ON_CONFLICT_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+class ArtistLookup(object):
+    """
+    Per-request map from artist name to Artist.
+
+    Tracks credit existing artists by name instead of inserting a new artist row for every credit.
+    The names wanted by a whole batch of tracks are looked up together in a single query. The
+    artists that do not exist yet are inserted with INSERT ... ON CONFLICT DO NOTHING and read back,
+    so that concurrent requests crediting the same new artist share one row, given the unique index
+    on artist names.
+    """
+
+    def __init__(self):
+        self._artists = {}
+        self._wanted = set()
+        # Names known not to exist by the last query
+        self._absent = set()
+        # Names of the artists that did not exist when they were looked up
+        self.created = set()
+
+    def want(self, names):
+        """
+        Note artist ``names`` to be looked up by the next query.
+        """
+        self._wanted.update(name for name in names if name not in self._artists)
+
+    def load(self):
+        """
+        Look up the wanted artists that exist, leaving the others to be inserted when they are got.
+        """
+        wanted = list(self._wanted)
+        self._wanted.clear()
+        self._select(wanted)
+        self._absent.update(name for name in wanted if name not in self._artists)
+
+    def forget(self, names):
+        """
+        Forget the artists ``names``, inserted in a savepoint that was rolled back since.
+        """
+        for name in names:
+            artist = self._artists.pop(name, None)
+            if artist is not None and artist in db_session:
+                db_session.expunge(artist)
+            self.created.discard(name)
+            self._absent.add(name)
+
+    def get(self, name):
+        """
+        Return the Artist called ``name``, inserting it if there is no such artist yet.
+        """
+        if name not in self._artists:
+            self._wanted.add(name)
+            self._fetch()
+        return self._artists[name]
+
+    def _fetch(self):
+        wanted = list(self._wanted)
+        self._wanted.clear()
+        self._select([name for name in wanted if name not in self._absent])
+        missing = [name for name in wanted if name not in self._artists]
+        self._absent.difference_update(missing)
+        if missing:
+            self.created.update(missing)
+            self._insert(missing)
+            # Read back those inserted by a concurrent request as well
+            self._select(missing)
+
+    def _select(self, names):
+        for start in range(0, len(names), LOOKUP_CHUNK_SIZE):
+            # Older databases may hold duplicate artists, reuse the first one
+            for artist in Artist.query.filter(Artist.name.in_(names[start:start + LOOKUP_CHUNK_SIZE])) \
+                    .order_by(Artist.artist_id.desc()):
+                self._artists[artist.name] = artist
+
+    @staticmethod
+    def _insert(names):
+        statement = insert(Artist.__table__)
+        on_conflict_insert = _ON_CONFLICT_INSERTS.get(db_session.get_bind(clause=statement).dialect.name)
+        if on_conflict_insert is not None:
+            statement = on_conflict_insert(Artist.__table__).on_conflict_do_nothing()
+        db_session.execute(statement, [dict(name=name) for name in names])
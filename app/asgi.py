@@ -0,0 +1,131 @@
+"""
+ASGI entry point serving the app with SQLAlchemy's asyncio engine, see asgi.py.
+
+Every request runs the same Flask handlers as the WSGI server, in AsyncSession.run_sync(): db_session
+and the query properties of the models use the request's session, whose statements are awaited on
+the event loop (by aiosqlite for SQLite) instead of blocking a worker thread.
+"""
+import io
+import sys
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import app
+from app.database import create_configured_async_engine, use_session
+from app.instrumentation import instrument_engine, instrumented
+from config import app_config, config_name
+
+config = app_config[config_name]
+
+async_engine = create_configured_async_engine(config)
+if instrumented(app.config):
+    instrument_engine(async_engine.sync_engine)
+
+
+def wsgi_environ(scope, body):
+    """
+    The WSGI environ of the ASGI HTTP ``scope`` of a request with ``body``.
+    """
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": "HTTP/{}".format(scope.get("http_version", "1.1")),
+        "REMOTE_ADDR": (scope.get("client") or ("127.0.0.1", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": False,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name, value = name.decode("latin-1").upper().replace("-", "_"), value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+        elif "HTTP_" + name in environ:
+            environ["HTTP_" + name] += "," + value
+        else:
+            environ["HTTP_" + name] = value
+    return environ
+
+
+def _start(sync_session, environ):
+    """
+    Run the WSGI app up to its response headers, with db_session using ``sync_session``.
+    """
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(" ", 1)[0]), headers]
+
+    with use_session(sync_session):
+        body = app.wsgi_app(environ, start_response)
+    return started, body
+
+
+def _next_chunk(sync_session, chunks):
+    # Streamed responses run queries while they are iterated, e.g. the exports
+    with use_session(sync_session):
+        return next(chunks, None)
+
+
+def _close(sync_session, body):
+    with use_session(sync_session):
+        if hasattr(body, "close"):
+            body.close()
+
+
+async def _read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    return bytes(body)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await async_engine.dispose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    """
+    The ASGI application, e.g. for ``uvicorn asgi:application``.
+    """
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        raise ValueError("Unsupported ASGI scope type '{}'".format(scope["type"]))
+
+    environ = wsgi_environ(scope, await _read_body(receive))
+    async with AsyncSession(async_engine, autoflush=False) as session:
+        (status, headers), body = await session.run_sync(_start, environ)
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]})
+        try:
+            chunks = iter(body)
+            while True:
+                chunk = await session.run_sync(_next_chunk, chunks)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await session.run_sync(_close, body)
@@ -0,0 +1,227 @@
+import abc
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, request
+
+from app.changes import changes_after, head
+from app.database import db_session, primary_reads, reading_from_replica
+from config import app_config, config_name
+
+config = app_config[config_name]
+
+# Changes read from the change log per sync, after more than that the whole cache is dropped instead
+SYNC_BATCH_SIZE = 1000
+
+
+class CacheBackend(abc.ABC):
+    """
+    Storage of the response cache. LRUCache keeps it in the process, a backend shared by the
+    processes, e.g. on Redis, can implement these methods instead.
+    """
+
+    @abc.abstractmethod
+    def get(self, key):
+        """
+        Return the value stored under ``key``, None if there is none or it has expired.
+        """
+
+    @abc.abstractmethod
+    def set(self, key, value):
+        """
+        Store ``value`` under ``key``, replacing what was stored there.
+        """
+
+    @abc.abstractmethod
+    def delete(self, *keys):
+        """
+        Drop the values stored under ``keys``, if any.
+        """
+
+    @abc.abstractmethod
+    def clear(self):
+        """
+        Drop every value.
+        """
+
+
+class LRUCache(CacheBackend):
+    """
+    In-process cache keeping the ``max_size`` most recently used entries for ``ttl`` seconds.
+    """
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResponseCache(object):
+    """
+    Read-through cache of marshalled GET responses, stored in a CacheBackend, by default an LRUCache
+    of RESPONSE_CACHE_SIZE entries kept for RESPONSE_CACHE_TTL seconds.
+
+    Single resources are cached under their kind and ID and are invalidated one by one by the
+    handlers that change them. Listings are cached under their full request path plus a generation
+    token per kind; invalidating the listings of a kind just replaces its token. A token that gets
+    evicted is replaced by a new one too, so eviction can never bring stale listings back. Responses
+    read from a replica are served but not cached.
+
+    The cache is per process, so before a request reads it, what any process changed since is
+    dropped too, going by the change log of app.changes (see sync()). Where there is no change log,
+    processes sharing the database must not cache: set ``enabled`` to False.
+    """
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = LRUCache(config.RESPONSE_CACHE_SIZE, config.RESPONSE_CACHE_TTL)
+        self.backend = backend
+        self.enabled = True
+        # Sequence number of the last change dropped from the cache, None before the first sync
+        self._seq = None
+        self._lock = threading.Lock()
+
+    def cached(self, kind, id_arg=None):
+        """
+        Decorate a marshalled GET handler of resources of ``kind``, identified by keyword argument
+        ``id_arg``. Handlers without ``id_arg``, or called with the ID "all", return listings.
+        """
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return f(*args, **kwargs)
+                resource_id = kwargs.get(id_arg) if id_arg else None
+                self.sync()
+                if resource_id is None or resource_id == "all":
+                    key = "{}s:{}:{}".format(kind, self._generation(kind), request.full_path)
+                elif request.query_string:
+                    # Only the full representation of single resources is cached and invalidated
+                    return f(*args, **kwargs)
+                else:
+                    key = self._key(kind, resource_id)
+                resp = self.backend.get(key)
+                if resp is None:
+                    resp = f(*args, **kwargs)
+                    # Do not cache "not found" errors, nor what a replica read: it may not have caught
+                    # up with the write that invalidated the entry yet
+                    if not (isinstance(resp, dict) and resp.get("error")) and not reading_from_replica():
+                        self.backend.set(key, resp)
+                return resp
+            return wrapper
+        return decorator
+
+    def version(self, kind, resource_id, load):
+        """
+        Return the version of the ``kind`` resource with ``resource_id``, calling ``load`` to find it
+        out when it is not cached yet. It is invalidated together with the resource.
+        """
+        if not self.enabled:
+            return load()
+        key = "{}:version".format(self._key(kind, resource_id))
+        self.sync()
+        version = self.backend.get(key)
+        if version is None:
+            version = load()
+            if version is not None and not reading_from_replica():
+                self.backend.set(key, version)
+        return version
+
+    def invalidate(self, kind, *resource_ids):
+        """
+        Drop the cached ``kind`` resources with ``resource_ids``.
+        """
+        self.backend.delete(*(k for i in resource_ids
+                              for k in (self._key(kind, i), "{}:version".format(self._key(kind, i)))))
+
+    def invalidate_lists(self, *kinds):
+        """
+        Drop every cached listing of ``kinds``.
+        """
+        for kind in kinds:
+            self.backend.set(self._generation_key(kind), uuid.uuid4().hex)
+
+    def clear(self):
+        self.backend.clear()
+
+    def sync(self):
+        """
+        Drop the resources changed since the last sync, by this process or any other, and the
+        listings of their kinds, going by the change log. Runs once per request, before the cache is
+        read: what the request caches afterwards is read after the change log, so any later change
+        is dropped by a later sync.
+        """
+        if g.get("response_cache_synced"):
+            return
+        g.response_cache_synced = True
+        # Replicas may not have caught up with the change log
+        with primary_reads():
+            if self._seq is None:
+                changes = None
+            else:
+                changes = changes_after(db_session, self._seq, SYNC_BATCH_SIZE + 1)
+            if changes is None or len(changes) > SYNC_BATCH_SIZE:
+                seq = head(db_session)
+                self.clear()
+            else:
+                seq = changes[-1].seq if changes else self._seq
+                for change in changes:
+                    self.invalidate(change.kind, change.resource_id)
+                self.invalidate_lists(*{change.kind for change in changes})
+        with self._lock:
+            self._seq = seq if self._seq is None else max(self._seq, seq)
+
+    def _generation(self, kind):
+        generation = self.backend.get(self._generation_key(kind))
+        if generation is None:
+            generation = uuid.uuid4().hex
+            self.backend.set(self._generation_key(kind), generation)
+        return generation
+
+    @staticmethod
+    def _key(kind, resource_id):
+        return "{}:{}".format(kind, resource_id)
+
+    @staticmethod
+    def _generation_key(kind):
+        return "{}s:generation".format(kind)
+
+
+response_cache = ResponseCache()
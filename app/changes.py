@@ -0,0 +1,58 @@
+import warnings
+
+from sqlalchemy import func
+
+from app.database import engine
+from app.models.all import Change
+
+# (kind, table, ID column) of the resources whose changes are logged
+_LOGGED_TABLES = [
+    ('artist', 'artists', 'artist_id'),
+    ('track', 'tracks', 'track_id'),
+    ('album', 'albums', 'album_id'),
+]
+
+# Microseconds, the way SQLAlchemy stores DateTime columns in SQLite
+_NOW = "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
+def _statements():
+    for kind, table, id_column in _LOGGED_TABLES:
+        for event, operation, row in (('INSERT', 'created', 'new'), ('UPDATE', 'updated', 'new'),
+                                      ('DELETE', 'deleted', 'old')):
+            yield ("CREATE TRIGGER IF NOT EXISTS {table}_change_{event} AFTER {EVENT} ON {table} BEGIN "
+                   "INSERT INTO changes(kind, resource_id, operation, changed_at) "
+                   "VALUES ('{kind}', {row}.{id_column}, '{operation}', {now}); END").format(
+                table=table, event=event.lower(), EVENT=event, kind=kind, row=row, id_column=id_column,
+                operation=operation, now=_NOW)
+
+
+def init_change_log():
+    """
+    Log every insert, update and delete of artists, tracks and albums to the changes table with
+    triggers, so that changes made by bulk statements and cascades are logged too. Returns whether
+    the change log is kept.
+    """
+    if engine.dialect.name != 'sqlite':
+        warnings.warn("The change log is kept by SQLite triggers, /api/v1/changes stays empty")
+        return False
+    with engine.begin() as connection:
+        for statement in _statements():
+            connection.exec_driver_sql(statement)
+    return True
+
+
+def head(session):
+    """
+    Sequence number of the latest change, 0 if there is none. Read in the transaction of an export,
+    it is where to start following the changes after the export.
+    """
+    return session.query(func.coalesce(func.max(Change.seq), 0)).scalar()
+
+
+def changes_after(session, seq, limit):
+    """
+    (seq, kind, resource ID) of the first ``limit`` changes after sequence number ``seq``.
+    """
+    return session.query(Change.seq, Change.kind, Change.resource_id).filter(Change.seq > seq) \
+        .order_by(Change.seq).limit(limit).all()
@@ -1,14 +1,199 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
+import warnings
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.util import ThreadLocalRegistry
+from sqlalchemy.sql.dml import UpdateBase
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app.instrumentation import instrument_engine, instrumented
+from config import app_config, config_name
+
+config = app_config[config_name]
+
+
+# Async drivers of the backends app.asgi can serve from
+ASYNC_DRIVERS = {'sqlite': 'aiosqlite', 'postgresql': 'asyncpg', 'mysql': 'aiomysql'}
+
+
+def _engine_options(config, url, pool_class):
+    options = dict(echo=config.SQLALCHEMY_ECHO,
+                   pool_pre_ping=config.DATABASE_POOL_PRE_PING,
+                   pool_recycle=config.DATABASE_POOL_RECYCLE)
+    in_memory = url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+    if not in_memory:
+        options.update(poolclass=pool_class,
+                       pool_size=config.DATABASE_POOL_SIZE,
+                       max_overflow=config.DATABASE_MAX_OVERFLOW)
+    if url.get_backend_name() == 'sqlite' and not in_memory:
+        # Pooled SQLite connections are handed from thread to thread
+        options.update(connect_args=dict(check_same_thread=False))
+    return options
+
+
+def _set_sqlite_pragmas(config, sync_engine):
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode={}".format(config.SQLITE_JOURNAL_MODE))
+        cursor.execute("PRAGMA synchronous={}".format(config.SQLITE_SYNCHRONOUS))
+        cursor.execute("PRAGMA busy_timeout={:d}".format(config.SQLITE_BUSY_TIMEOUT))
+        cursor.execute("PRAGMA mmap_size={:d}".format(config.SQLITE_MMAP_SIZE))
+        cursor.execute("PRAGMA foreign_keys={}".format("ON" if config.SQLITE_FOREIGN_KEYS else "OFF"))
+        cursor.close()
+
+    @event.listens_for(sync_engine, "savepoint")
+    def begin_before_savepoint(conn, name):
+        # pysqlite only begins a transaction before an INSERT, UPDATE or DELETE, a savepoint taken before
+        # any would begin one of its own, committed as soon as the savepoint is released
+        dbapi_connection = conn.connection.dbapi_connection
+        # aiosqlite's adapter does not tell, the aiosqlite connection it wraps does
+        if not getattr(dbapi_connection, "_connection", dbapi_connection).in_transaction:
+            conn.exec_driver_sql("BEGIN")
+
+
+def create_configured_engine(config, url=None):
+    """
+    Create the engine described by ``config``, or the one of ``url`` with the settings of ``config``,
+    with a connection pool and, for SQLite, the pragmas that let readers carry on while a writer commits
+    and savepoints that nest in the session's transaction.
+    """
+    url = make_url(url or config.DATABASE_URL)
+    new_engine = create_engine(url, **_engine_options(config, url, QueuePool))
+    if url.get_backend_name() == 'sqlite':
+        _set_sqlite_pragmas(config, new_engine)
+    return new_engine
+
+
+def create_configured_async_engine(config, url=None):
+    """
+    Create an asyncio engine like create_configured_engine() does, for ASYNC_DATABASE_URL or else
+    DATABASE_URL with the async driver of its backend, e.g. aiosqlite for SQLite.
+    """
+    # Imported here, the async drivers are only needed to serve with app.asgi
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = make_url(url or config.ASYNC_DATABASE_URL or config.DATABASE_URL)
+    if url.get_backend_name() in ASYNC_DRIVERS and url.get_driver_name() != ASYNC_DRIVERS[url.get_backend_name()]:
+        url = url.set(drivername="{}+{}".format(url.get_backend_name(), ASYNC_DRIVERS[url.get_backend_name()]))
+    new_engine = create_async_engine(url, **_engine_options(config, url, AsyncAdaptedQueuePool))
+    if url.get_backend_name() == 'sqlite':
+        _set_sqlite_pragmas(config, new_engine.sync_engine)
+    return new_engine
+
+
+# The engine of the current context's reads, None to read from the primary engine
+_read_replica = ContextVar("read_replica", default=None)
+
+
+def read_from(replica):
+    """
+    Send the reads of the current context (thread or request) to the ``replica`` engine, or back to
+    the primary engine if None.
+    """
+    _read_replica.set(replica)
+
+
+def reading_from_replica():
+    return _read_replica.get() is not None
+
+
+@contextmanager
+def primary_reads():
+    """
+    Read from the primary engine within the block, whichever replica read_from() picked.
+    """
+    token = _read_replica.set(None)
+    try:
+        yield
+    finally:
+        _read_replica.reset(token)
+
+
+class RoutingSession(Session):
+    """
+    Session reading from the replica chosen with read_from(), if any. Flushes and INSERT, UPDATE and
+    DELETE statements always go to the primary engine.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = _read_replica.get()
+        if replica is not None and not self._flushing and not isinstance(clause, UpdateBase):
+            return replica
+        return super(RoutingSession, self).get_bind(mapper=mapper, clause=clause, **kw)
+
+
+engine = create_configured_engine(config)
+# Read-only copies of the database, GET requests are sent to them by app.replicas
+replica_engines = [create_configured_engine(config, url) for url in config.DATABASE_REPLICA_URLS]
+if instrumented({key: getattr(config, key) for key in dir(config) if key.isupper()}):
+    for configured_engine in [engine] + replica_engines:
+        instrument_engine(configured_engine)
+# The session of the current context (asyncio task) given to use_session(), see app.asgi
+_context_session = ContextVar("context_session", default=None)
+
+
+class ContextOrThreadRegistry(ThreadLocalRegistry):
+    """
+    Registry of db_session: the session given to use_session() in the current context, if any,
+    otherwise one session per thread.
+    """
+
+    def __call__(self):
+        session = _context_session.get()
+        return super(ContextOrThreadRegistry, self).__call__() if session is None else session
+
+
+@contextmanager
+def use_session(session):
+    """
+    Make db_session, and the query properties of the models, use ``session`` in the current context.
+    """
+    token = _context_session.set(session)
+    try:
+        yield session
+    finally:
+        _context_session.reset(token)
+
+
+session_factory = sessionmaker(class_=RoutingSession,
+                               autocommit=False,
+                               autoflush=False,
+                               bind=engine)
+db_session = scoped_session(session_factory)
+db_session.registry = ContextOrThreadRegistry(session_factory)
+
+
+def dispose_engines(close=True):
+    """
+    Drop the pooled connections of the engine and the replica engines. In a forked process, pass
+    ``close=False`` to leave the connections inherited from the parent to the parent.
+    """
+    for configured_engine in [engine] + replica_engines:
+        configured_engine.dispose(close=close)
+
 
-engine = create_engine('sqlite:////tmp/music_service_api.db', convert_unicode=True)
-db_session = scoped_session(sessionmaker(autocommit=False,
-                                         autoflush=False,
-                                         bind=engine))
 Base = declarative_base()
 Base.query = db_session.query_property()
 
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    # create_all() skips tables that already exist, add the nullable columns and the indexes they are missing
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {c["name"] for c in inspect(engine).get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns and column.nullable and not column.primary_key:
+                with engine.begin() as connection:
+                    connection.exec_driver_sql("ALTER TABLE {} ADD COLUMN {} {}".format(
+                        table.name, column.name, column.type.compile(dialect=engine.dialect)))
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except IntegrityError as e:
+                warnings.warn("Could not create unique index {}: {}".format(index.name, e.orig))
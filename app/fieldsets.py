@@ -0,0 +1,106 @@
+from functools import wraps
+
+from flask import request
+from flask_restful import fields
+from sqlalchemy import inspect
+from sqlalchemy.orm import load_only, selectinload
+
+from app.serializers import compile_fields, serialize_response
+
+
+def requested_paths(arg):
+    """
+    The comma separated field paths given in query string argument ``arg``, None if it is absent.
+    """
+    value = request.args.get(arg)
+    if value is None:
+        return None
+    return {path.strip() for path in value.split(",") if path.strip()}
+
+
+def _wanted(path, paths):
+    # A path is wanted if it is listed, if one of its children is, or if one of its parents is
+    return paths is None or any(p == path or p.startswith(path + ".") or path.startswith(p + ".") for p in paths)
+
+
+def prune_fields(model, field_map, selected=None, expanded=None, prefix=""):
+    """
+    Return the part of ``field_map`` (the marshalling fields of ``model``) that is in ``selected``,
+    keeping only the relationships in ``expanded``. Both are sets of dotted paths such as
+    "tracks.artists.name", None selects or expands everything.
+    """
+    relationships = inspect(model).relationships
+    pruned = {}
+    for key, field in field_map.items():
+        path = prefix + key
+        if not _wanted(path, selected):
+            continue
+        if key in relationships:
+            if not (expanded is None or any(e == path or e.startswith(path + ".") for e in expanded)):
+                continue
+            if isinstance(field, fields.Nested):
+                target = relationships[key].mapper.class_
+                field = fields.Nested(prune_fields(target, field.nested, selected, expanded, path + "."),
+                                      allow_null=field.allow_null)
+        pruned[key] = field
+    return pruned
+
+
+def loader_options(model, field_map):
+    """
+    Loader options fetching exactly what marshalling ``field_map`` needs: its columns and, with
+    selectin loading, its relationships. Relationships are never joined in: they all go through an
+    association table, which nests the join, and SQLite can only run that by materialising the
+    whole association table.
+    """
+    mapper = inspect(model)
+    columns = [getattr(model, key) for key in field_map if key in mapper.column_attrs]
+    options = [load_only(*(columns or [getattr(model, mapper.primary_key[0].key)]))]
+    for key in field_map:
+        if key not in mapper.relationships:
+            continue
+        target = mapper.relationships[key].mapper.class_
+        if isinstance(field_map[key], fields.Nested):
+            nested_options = loader_options(target, field_map[key].nested)
+        else:
+            # Marshalled as a whole, e.g. stores as their names
+            nested_options = ()
+        options.append(selectinload(getattr(model, key)).options(*nested_options))
+    return tuple(options)
+
+
+def selected_fields(model, field_map):
+    """
+    The part of ``field_map`` selected by the fields= and expand= arguments of the current request.
+    """
+    return prune_fields(model, field_map, requested_paths("fields"), requested_paths("expand"))
+
+
+def selected_options(model, field_map):
+    """
+    Loader options for the part of ``field_map`` selected by the current request.
+    """
+    return loader_options(model, selected_fields(model, field_map))
+
+
+def marshal_with_selected(model, field_map):
+    """
+    Like flask_restful's marshal_with, marshalling only the part of ``field_map`` selected by the
+    current request. The full field map is compiled once, selections are compiled per request.
+    Error dicts, e.g. for resources that are not found, are returned as they are.
+    """
+    serialize_all = compile_fields(field_map)
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            resp = f(*args, **kwargs)
+            if isinstance(resp, dict) and resp.get("error"):
+                return resp
+            if requested_paths("fields") is None and requested_paths("expand") is None:
+                serialize = serialize_all
+            else:
+                serialize = compile_fields(selected_fields(model, field_map))
+            return serialize_response(serialize, resp)
+        return wrapper
+    return decorator
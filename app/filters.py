@@ -0,0 +1,164 @@
+import datetime
+import logging
+import operator
+import re
+from collections import namedtuple
+
+from flask import current_app, request
+from sqlalchemy import select
+
+logger = logging.getLogger(__name__)
+
+OPERATORS = {'=': operator.eq, '>=': operator.ge, '<=': operator.le, '>': operator.gt, '<': operator.lt}
+RANGE_OPERATORS = ('>=', '<=', '>', '<')
+
+# Query string arguments that are not filters
+RESERVED_ARGS = {'limit', 'after', 'sort', 'fields', 'expand'}
+
+# "release_date>2020-01-01" has no "=", so it is parsed as an argument name without a value
+_CONDITION = re.compile(r"^(\w+)(>|<)(.+)$")
+# A step of an SQLite query plan reading a whole table rather than a range of an index
+_FULL_SCAN = re.compile(r"^SCAN (TABLE )?\w+( AS \w+)?$")
+_SORTED_IN_MEMORY = re.compile(r"^USE TEMP B-TREE FOR (.* )?ORDER BY$")
+
+_plan_verdicts = {}
+
+SortOrder = namedtuple('SortOrder', ['column', 'parse', 'descending'])
+
+
+class FullScanError(Exception):
+    """
+    Raised for listings the database can only serve by reading whole tables, if REFUSE_FULL_SCANS is on.
+    """
+
+
+def boolean(value):
+    if value.lower() in ('true', '1'):
+        return True
+    if value.lower() in ('false', '0'):
+        return False
+    raise ValueError("expected true or false")
+
+
+def date(value):
+    return datetime.date.fromisoformat(value)
+
+
+class Filter(object):
+    """
+    A query string filter of a listing, turning ``name=value`` into a predicate on ``column``.
+
+    ``through`` is a pair of association table columns: the one joined to ``column`` and the one
+    compared with the value, so that e.g. tracks can be filtered on the ID of one of their albums.
+    Only filters on indexed columns should be defined, and only those that can be ``sortable``.
+    """
+
+    def __init__(self, column, parse=str, ranges=False, through=None, sortable=False):
+        self.column = column
+        self.parse = parse
+        self.operators = ('=',) + (RANGE_OPERATORS if ranges else ())
+        self.through = through
+        self.sortable = sortable
+
+    def predicate(self, op, value):
+        if self.through is None:
+            return OPERATORS[op](self.column, value)
+        joined, compared = self.through
+        # An IN subquery lets SQLite drive the listing from the association table's index
+        return self.column.in_(select(joined).where(OPERATORS[op](compared, value)))
+
+
+def requested_conditions():
+    """
+    (name, operator, value) of each filter argument of the current request, values unparsed.
+    """
+    for key, value in request.args.items(multi=True):
+        if key in RESERVED_ARGS:
+            continue
+        if key[-1:] in ('>', '<'):
+            yield key[:-1], key[-1] + '=', value
+            continue
+        match = _CONDITION.match(key)
+        if match and not value:
+            yield match.groups()
+        else:
+            yield key, '=', value
+
+
+def parse_conditions(filters):
+    """
+    The filter arguments of the current request as (name, operator, value) with parsed values.
+    Raises ValueError for unknown filters, operators and values.
+    """
+    conditions = []
+    for name, op, value in requested_conditions():
+        if name not in filters:
+            raise ValueError("Unknown filter '{}', use one of {}".format(name, ", ".join(sorted(filters))))
+        if op not in filters[name].operators:
+            raise ValueError("Filter '{}' does not support '{}'".format(name, op))
+        try:
+            conditions.append((name, op, filters[name].parse(value)))
+        except (KeyError, ValueError):
+            raise ValueError("Invalid value '{}' for filter '{}'".format(value, name))
+    return conditions
+
+
+def apply_conditions(query, filters, conditions):
+    for name, op, value in conditions:
+        query = query.filter(filters[name].predicate(op, value))
+    return query
+
+
+def requested_order(filters, conditions, id_column):
+    """
+    The SortOrder asked for with ?sort=name (ascending) or ?sort=-name (descending), None for the
+    default order of IDs descending. Listings filtered on a range of a sortable column are sorted
+    by that column by default, so that the range is read from its index. Raises ValueError for
+    columns that cannot be sorted on.
+    """
+    value = request.args.get('sort')
+    if value is None:
+        ranged = [name for name, op, _ in conditions if op != '=' and filters[name].sortable]
+        if not ranged:
+            return None
+        return SortOrder(filters[ranged[0]].column, filters[ranged[0]].parse, True)
+    descending = value.startswith('-')
+    name = value.lstrip('-')
+    if name == id_column.key:
+        return SortOrder(id_column, int, descending)
+    if name not in filters or not filters[name].sortable:
+        sortable = [id_column.key] + sorted(n for n, f in filters.items() if f.sortable)
+        raise ValueError("Cannot sort on '{}', use one of {}".format(name, ", ".join(sortable)))
+    return SortOrder(filters[name].column, filters[name].parse, descending)
+
+
+def full_scans(plan, filtered):
+    """
+    The steps of the SQLite query ``plan`` (EXPLAIN QUERY PLAN details) that read every row of a
+    table: sorting in memory, or scanning a table outside of any index for a ``filtered`` listing.
+    Unfiltered listings stop scanning the table in ID order once the page is full.
+    """
+    return [step for step in plan if _SORTED_IN_MEMORY.match(step) or (filtered and _FULL_SCAN.match(step))]
+
+
+def check_plan(query, filtered, shape):
+    """
+    Refuse with FullScanError, or log if REFUSE_FULL_SCANS is off, listing queries that SQLite
+    would serve by reading whole tables. Plans depend on which filters and which order are used,
+    not on the values, so the verdict is kept per ``shape`` of the request.
+    """
+    bind = query.session.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+    if shape not in _plan_verdicts:
+        statement = query.statement.compile(dialect=bind.dialect, compile_kwargs={"literal_binds": True})
+        connection = query.session.connection()
+        plan = [row[-1] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN {}".format(statement))]
+        _plan_verdicts[shape] = full_scans(plan, filtered)
+    scans = _plan_verdicts[shape]
+    if not scans:
+        return
+    message = "{} cannot be served from an index ({})".format(request.full_path, "; ".join(scans))
+    if current_app.config.get("REFUSE_FULL_SCANS"):
+        raise FullScanError(message)
+    logger.warning(message)
@@ -0,0 +1,139 @@
+import datetime
+import hashlib
+import json
+import threading
+import time
+from functools import wraps
+
+from flask import request
+from flask_restful import abort
+from flask_restful.utils import unpack
+from sqlalchemy.exc import IntegrityError
+
+from app.database import db_session
+from app.models.all import IdempotencyKey
+from config import app_config, config_name
+
+MAX_KEY_LENGTH = 255
+# Seconds between two deletions of the expired keys by one process
+PURGE_INTERVAL = 60
+
+
+def request_fingerprint():
+    """
+    Hash of what makes the current request: a key reused for another request is an error.
+    """
+    digest = hashlib.sha256()
+    for part in (request.method.encode(), request.full_path.encode(), request.get_data()):
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class IdempotencyKeys(object):
+    """
+    Responses to writes sent with an Idempotency-Key header, kept for ``ttl`` seconds so that a
+    retried request gets the response of the first one instead of being run again.
+
+    A key is reserved in a transaction of its own before the request runs, so a concurrent retry
+    finds it reserved and gets 409 Conflict rather than running in parallel. Requests that fail
+    with an exception or a 5xx response release their key; they can be retried with it.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+
+    def idempotent(self, f):
+        """
+        Decorate a resource's POST handler, whose return value must be JSON-serialisable.
+        """
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get("Idempotency-Key")
+            if key is None:
+                return f(*args, **kwargs)
+            if not key or len(key) > MAX_KEY_LENGTH:
+                abort(400, message="Idempotency-Key must be 1 to {} characters".format(MAX_KEY_LENGTH))
+
+            fingerprint = request_fingerprint()
+            stored = self.reserve(key, fingerprint)
+            if stored is not None:
+                return self.replay(stored, fingerprint)
+            try:
+                resp = f(*args, **kwargs)
+            except Exception:
+                db_session.rollback()
+                self.release(key)
+                raise
+            data, code, headers = unpack(resp)
+            if code >= 500:
+                self.release(key)
+            else:
+                self.complete(key, data, code, headers)
+            return data, code, headers
+        return wrapper
+
+    def reserve(self, key, fingerprint):
+        """
+        Reserve ``key`` for the current request. Returns None once reserved, or the IdempotencyKey
+        stored by an earlier request with the same key.
+        """
+        self.purge_expired()
+        while True:
+            db_session.add(IdempotencyKey(key=key, fingerprint=fingerprint))
+            try:
+                db_session.commit()
+                return None
+            except IntegrityError:
+                db_session.rollback()
+            stored = IdempotencyKey.query.filter_by(key=key).first()
+            if stored is None:
+                # Released by the request that had it in the meantime, try again
+                continue
+            if stored.created_at >= self._expired_before():
+                return stored
+            # Expired but not purged yet, take it over
+            IdempotencyKey.query.filter_by(key=key, created_at=stored.created_at).delete()
+            db_session.commit()
+
+    @staticmethod
+    def replay(stored, fingerprint):
+        if stored.fingerprint != fingerprint:
+            abort(422, message="Idempotency-Key '{}' was used for another request".format(stored.key))
+        if stored.status_code is None:
+            abort(409, message="A request with Idempotency-Key '{}' is in progress".format(stored.key))
+        headers = dict(json.loads(stored.headers), **{"Idempotent-Replayed": "true"})
+        return json.loads(stored.response), stored.status_code, headers
+
+    @staticmethod
+    def complete(key, data, code, headers):
+        IdempotencyKey.query.filter_by(key=key).update(dict(
+            status_code=code,
+            response=json.dumps(data, separators=(",", ":")),
+            headers=json.dumps(dict(headers or {}), separators=(",", ":"))), synchronize_session=False)
+        db_session.commit()
+
+    @staticmethod
+    def release(key):
+        IdempotencyKey.query.filter_by(key=key).delete()
+        db_session.commit()
+
+    def purge_expired(self, force=False):
+        """
+        Delete the expired keys, at most every PURGE_INTERVAL seconds unless ``force``.
+        """
+        with self._lock:
+            if not force and time.monotonic() - self._last_purge < PURGE_INTERVAL:
+                return
+            self._last_purge = time.monotonic()
+        IdempotencyKey.query.filter(IdempotencyKey.created_at < self._expired_before()).delete()
+        db_session.commit()
+
+    def _expired_before(self):
+        return datetime.datetime.utcnow() - datetime.timedelta(seconds=self.ttl)
+
+
+config = app_config[config_name]
+idempotency_keys = IdempotencyKeys(ttl=config.IDEMPOTENCY_KEY_TTL)
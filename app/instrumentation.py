@@ -0,0 +1,276 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import Response, abort, current_app, g, has_app_context, request
+from sqlalchemy import event
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+STATEMENT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+_IN_LIST = re.compile(r"IN \((?:\?|:\w+|%\(\w+\)s)(?:, (?:\?|:\w+|%\(\w+\)s))*\)")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_WHITESPACE = re.compile(r"\s+")
+
+logger = logging.getLogger(__name__)
+
+
+class NPlusOneError(Exception):
+    """
+    Raised at the end of a request that ran the same SELECT too many times, if N_PLUS_ONE_RAISE is on.
+    """
+
+
+def normalize_statement(statement):
+    """
+    ``statement`` with its literals and the length of its IN lists left out, so that statements
+    differing only in their parameters compare equal.
+    """
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    return _IN_LIST.sub("IN (?)", _LITERAL.sub("?", statement))
+
+
+class RequestTimings(object):
+    """
+    Where one request spent its time. Statements run while serialising are lazy loads, they are
+    counted apart from the other statements and their time is not counted as serialisation.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # SELECTs counted per transaction: one repeated in separate transactions, e.g. once per chunk
+        # of a bulk request, is not an N+1
+        self.selects = Counter()
+        self.transactions = 0
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.lazy_statements = 0
+        self.lazy_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.serializing = False
+
+    def add_statement(self, statement, seconds):
+        if statement.lstrip()[:6].upper() == "SELECT":
+            self.selects[self.transactions, normalize_statement(statement)] += 1
+        if self.serializing:
+            self.lazy_statements += 1
+            self.lazy_seconds += seconds
+        else:
+            self.statements += 1
+            self.db_seconds += seconds
+
+    def end_transaction(self):
+        self.transactions += 1
+
+    def server_timing(self, total_seconds):
+        """
+        The value of the Server-Timing header, durations are in milliseconds.
+        """
+        return ", ".join([
+            'db;dur={:.3f};desc="{} statements"'.format(self.db_seconds * 1000, self.statements),
+            'lazy;dur={:.3f};desc="{} statements"'.format(self.lazy_seconds * 1000, self.lazy_statements),
+            'serialize;dur={:.3f}'.format(self.serialize_seconds * 1000),
+            'total;dur={:.3f}'.format(total_seconds * 1000),
+        ])
+
+
+def current_timings():
+    """
+    The RequestTimings of the current request, None if it is not instrumented.
+    """
+    return g.get("request_timings") if has_app_context() else None
+
+
+@contextmanager
+def timed_serialization():
+    """
+    Count the time spent in the block as serialisation time of the current request.
+    """
+    timings = current_timings()
+    if timings is None or timings.serializing:
+        yield
+        return
+    lazy_seconds = timings.lazy_seconds
+    started = time.perf_counter()
+    timings.serializing = True
+    try:
+        yield
+    finally:
+        timings.serializing = False
+        timings.serialize_seconds += time.perf_counter() - started - (timings.lazy_seconds - lazy_seconds)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_timings() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = current_timings()
+    started = conn.info.get("query_started")
+    if timings is None or not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    timings.add_statement(statement, seconds)
+    slow_query_ms = current_app.config.get("SLOW_QUERY_MS")
+    if slow_query_ms is not None and seconds * 1000 >= slow_query_ms:
+        logger.warning("Slow query (%.1f ms) for %s %s: %s %r", seconds * 1000, request.method, request.full_path,
+                       statement, parameters)
+
+
+def _end_transaction(conn):
+    timings = current_timings()
+    if timings is not None:
+        timings.end_transaction()
+
+
+def check_repeated_selects(timings):
+    """
+    Log the SELECTs the request of ``timings`` ran more than N_PLUS_ONE_THRESHOLD times in one
+    transaction, typically a relationship lazy loaded for every object of a listing, and raise
+    NPlusOneError for them if N_PLUS_ONE_RAISE is on.
+    """
+    threshold = current_app.config.get("N_PLUS_ONE_THRESHOLD")
+    if not threshold:
+        return
+    counts = {}
+    for (transaction, statement), count in timings.selects.items():
+        if count > threshold:
+            counts[statement] = max(count, counts.get(statement, 0))
+    repeated = list(counts.items())
+    for statement, count in repeated:
+        logger.warning("N+1 queries for %s %s, ran %d times: %s", request.method, request.full_path, count, statement)
+    if repeated and current_app.config.get("N_PLUS_ONE_RAISE"):
+        raise NPlusOneError("{} {} ran {} {} times".format(request.method, request.full_path, *repeated[0]))
+
+
+def instrument_engine(engine):
+    """
+    Time the statements ``engine`` runs for instrumented requests. Instrumenting twice is harmless.
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "commit", _end_transaction)
+        event.listen(engine, "rollback", _end_transaction)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class Histogram(object):
+    """
+    Prometheus histogram, with a series of cumulative buckets for each combination of labels.
+    """
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(key, dict(buckets=[0] * len(self.buckets), sum=0.0, count=0))
+            for i, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def count(self, **labels):
+        with self._lock:
+            series = self._series.get(tuple(sorted(labels.items())))
+            return 0 if series is None else series["count"]
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.description), "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            snapshot = [(key, dict(series, buckets=list(series["buckets"]))) for key, series in self._series.items()]
+        for key, series in sorted(snapshot, key=lambda item: item[0]):
+            labels = "".join('{}="{}",'.format(k, _escape(v)) for k, v in key)
+            for bucket, count in zip(self.buckets, series["buckets"]):
+                lines.append('{}_bucket{{{}le="{}"}} {}'.format(self.name, labels, bucket, count))
+            lines.append('{}_bucket{{{}le="+Inf"}} {}'.format(self.name, labels, series["count"]))
+            lines.append("{}_sum{{{}}} {}".format(self.name, labels.rstrip(","), series["sum"]))
+            lines.append("{}_count{{{}}} {}".format(self.name, labels.rstrip(","), series["count"]))
+        return lines
+
+
+class Metrics(object):
+    """
+    Histograms of the instrumented requests, per endpoint and method.
+    """
+
+    def __init__(self, prefix="music_service_api"):
+        self.request_seconds = Histogram(prefix + "_request_duration_seconds",
+                                         "Time spent handling requests.", DURATION_BUCKETS)
+        self.db_seconds = Histogram(prefix + "_db_duration_seconds",
+                                    "Time spent running SQL statements per request, lazy loads included.",
+                                    DURATION_BUCKETS)
+        self.serialize_seconds = Histogram(prefix + "_serialize_duration_seconds",
+                                           "Time spent serialising responses, lazy loads excluded.", DURATION_BUCKETS)
+        self.statements = Histogram(prefix + "_statements_per_request",
+                                    "SQL statements run per request, lazy loads included.", STATEMENT_BUCKETS)
+
+    def histograms(self):
+        return [self.request_seconds, self.db_seconds, self.serialize_seconds, self.statements]
+
+    def record(self, timings, total_seconds, **labels):
+        self.request_seconds.observe(total_seconds, **labels)
+        self.db_seconds.observe(timings.db_seconds + timings.lazy_seconds, **labels)
+        self.serialize_seconds.observe(timings.serialize_seconds, **labels)
+        self.statements.observe(timings.statements + timings.lazy_statements, **labels)
+
+    def render(self):
+        """
+        The histograms in the Prometheus text exposition format.
+        """
+        return "\n".join(line for histogram in self.histograms() for line in histogram.render()) + "\n"
+
+
+metrics = Metrics()
+
+
+def instrumented(settings):
+    """
+    Whether the app configuration ``settings`` needs requests and statements to be tracked.
+    """
+    return bool(settings.get("INSTRUMENTATION") or settings.get("SLOW_QUERY_MS") is not None
+                or settings.get("N_PLUS_ONE_THRESHOLD"))
+
+
+def init_instrumentation(app):
+    """
+    Time the requests of ``app`` when its INSTRUMENTATION setting is on: add a Server-Timing header
+    to every response and serve the aggregated histograms at /metrics. Log slow queries and repeated
+    SELECTs when SLOW_QUERY_MS and N_PLUS_ONE_THRESHOLD are set.
+    """
+    @app.before_request
+    def start_timings():
+        if instrumented(current_app.config):
+            g.request_timings = RequestTimings()
+
+    @app.after_request
+    def record_timings(response):
+        timings = g.pop("request_timings", None)
+        if timings is None:
+            return response
+        check_repeated_selects(timings)
+        if current_app.config.get("INSTRUMENTATION"):
+            total_seconds = time.perf_counter() - timings.started
+            response.headers["Server-Timing"] = timings.server_timing(total_seconds)
+            metrics.record(timings, total_seconds, endpoint=request.endpoint or "unmatched", method=request.method)
+        return response
+
+    @app.route("/metrics")
+    def prometheus_metrics():
+        if not current_app.config.get("INSTRUMENTATION"):
+            abort(404)
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,185 @@
+import argparse
+import datetime
+import json
+import logging
+import threading
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.database import db_session
+from app.models.all import Job, JobStatus
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue(object):
+    """
+    Background jobs queued in the ``jobs`` table and run by a pool of worker threads. Any process
+    sharing the database can run a job, the first worker to mark it running gets it.
+
+    Handlers are registered per kind of job and called in an app context with the Job, its decoded
+    payload and its chunk size. They commit their work in batches, bumping ``Job.updated_at`` with each
+    batch: a running job that is not bumped for JOB_STALE_AFTER seconds has lost its worker and is
+    run again, so handlers resume from what was committed before.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._handlers = {}
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+
+    def handler(self, kind):
+        """
+        Register the decorated function as the handler of the jobs of ``kind``.
+        """
+        def decorator(f):
+            self._handlers[kind] = f
+            return f
+        return decorator
+
+    def enqueue(self, kind, payload, total, chunk_size):
+        """
+        Queue a job of ``kind`` for the JSON-serialisable ``payload`` of ``total`` items and wake
+        up a worker. Returns the committed Job.
+        """
+        job = Job(kind=kind, payload=json.dumps(payload), total=total, chunk_size=chunk_size)
+        db_session.add(job)
+        db_session.commit()
+        self.start()
+        self._wakeup.set()
+        return job
+
+    def pending(self):
+        """
+        Whether there are jobs queued or running, possibly left over by a process that stopped.
+        """
+        running = [JobStatus.queued, JobStatus.running]
+        pending = db_session.query(Job.job_id).filter(Job.status.in_(running)).first() is not None
+        db_session.remove()
+        return pending
+
+    def claim(self):
+        """
+        Mark the oldest queued job, or a running job that lost its worker, as running and return its
+        ID. Returns None if there is no such job.
+        """
+        while True:
+            now = datetime.datetime.utcnow()
+            stale = now - datetime.timedelta(seconds=self.app.config["JOB_STALE_AFTER"])
+            candidate = db_session.query(Job.job_id, Job.updated_at) \
+                .filter(or_(Job.status == JobStatus.queued,
+                            and_(Job.status == JobStatus.running, Job.updated_at < stale))) \
+                .order_by(Job.job_id).first()
+            if candidate is None:
+                db_session.rollback()
+                return None
+            # Only one of the workers that picked the same candidate finds it unchanged
+            claimed = db_session.query(Job) \
+                .filter(Job.job_id == candidate.job_id, Job.updated_at == candidate.updated_at) \
+                .update(dict(status=JobStatus.running, started_at=func.coalesce(Job.started_at, now),
+                             updated_at=now), synchronize_session=False)
+            db_session.commit()
+            if claimed:
+                return candidate.job_id
+
+    def run(self, job_id):
+        """
+        Run the handler of the job, then mark it done, or failed with the error it raised.
+        """
+        with self.app.app_context():
+            job = db_session.get(Job, job_id)
+            try:
+                self._handlers[job.kind](job, json.loads(job.payload), job.chunk_size)
+            except Exception as e:
+                logger.exception("Job %s failed", job_id)
+                db_session.rollback()
+                job = db_session.get(Job, job_id)
+                job.status = JobStatus.failed
+                job.error = "{}: {}".format(type(e).__name__, e)
+            else:
+                job.status = JobStatus.done
+            job.finished_at = job.updated_at = datetime.datetime.utcnow()
+            db_session.commit()
+            db_session.remove()
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                job_id = self.claim()
+            except SQLAlchemyError:
+                logger.exception("Could not claim a job")
+                db_session.remove()
+                job_id = None
+            if job_id is None:
+                self._wakeup.wait(self.app.config["JOB_POLL_INTERVAL"] or None)
+                self._wakeup.clear()
+                continue
+            self.run(job_id)
+
+    def start(self, workers=None):
+        """
+        Start ``workers`` (by default JOB_WORKERS) worker threads, unless they are running already.
+        """
+        with self._lock:
+            if self._threads:
+                return
+            workers = self.app.config["JOB_WORKERS"] if workers is None else workers
+            self._stopping.clear()
+            self._threads = [threading.Thread(target=self._work, name="job-worker-{}".format(i), daemon=True)
+                             for i in range(workers)]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self):
+        """
+        Stop the worker threads once they are done with their current job.
+        """
+        with self._lock:
+            self._stopping.set()
+            self._wakeup.set()
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+
+    def join(self):
+        """
+        Wait until the worker threads are stopped.
+        """
+        for thread in list(self._threads):
+            thread.join()
+
+
+job_queue = JobQueue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the queued jobs, e.g. next to web processes "
+                                                 "started with JOB_WORKERS=0")
+    parser.add_argument("--workers", type=int, default=2, help="number of worker threads")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    # The app package was imported before this module ran, with the JOB_WORKERS of the environment
+    from app import app
+    # Run as a script, this module is not the app.jobs the handlers are registered with
+    from app.jobs import job_queue
+
+    if not app.config["JOB_POLL_INTERVAL"]:
+        parser.error("JOB_POLL_INTERVAL must be set to pick up the jobs queued by other processes")
+    job_queue.start(workers=args.workers)
+    try:
+        job_queue.join()
+    except KeyboardInterrupt:
+        job_queue.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 import datetime
 import enum
 
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Enum, Date
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Enum, Date, DateTime, Text, Index
 from sqlalchemy.orm import relationship
 
 from app.database import Base
@@ -15,8 +15,9 @@ class ArtistRole(enum.Enum):
 class ArtistToTrackAssociation(Base):
     __tablename__ = "assoc_artist_to_track"
 
-    artist_id = Column(Integer, ForeignKey("artists.artist_id"), primary_key=True)
-    track_id = Column(Integer, ForeignKey("tracks.track_id"), primary_key=True)
+    artist_id = Column(Integer, ForeignKey("artists.artist_id", ondelete="CASCADE"), primary_key=True)
+    # The primary key only covers lookups by artist, index the other way round as well
+    track_id = Column(Integer, ForeignKey("tracks.track_id", ondelete="CASCADE"), primary_key=True, index=True)
 
     role = Column(Enum(ArtistRole), default=ArtistRole.primary_artist.name)
 
@@ -27,8 +28,8 @@ class ArtistToTrackAssociation(Base):
 class TrackToAlbumAssociation(Base):
     __tablename__ = "assoc_track_to_album"
 
-    track_id = Column(Integer, ForeignKey("tracks.track_id"), primary_key=True)
-    album_id = Column(Integer, ForeignKey("albums.album_id"), primary_key=True)
+    track_id = Column(Integer, ForeignKey("tracks.track_id", ondelete="CASCADE"), primary_key=True)
+    album_id = Column(Integer, ForeignKey("albums.album_id", ondelete="CASCADE"), primary_key=True, index=True)
 
     track = relationship("Track")
     album = relationship("Album")
@@ -44,7 +45,7 @@ class Store(Base):
     __tablename__ = 'stores'
 
     store_id = Column(Integer, primary_key=True)
-    name = Column(Enum(StoreEnum), default=StoreEnum.spotify.name)
+    name = Column(Enum(StoreEnum), default=StoreEnum.spotify.name, unique=True, index=True)
 
     def __init__(self, name=None):
         self.name = name
@@ -56,8 +57,8 @@ class Store(Base):
 class AlbumToStoresAssociation(Base):
     __tablename__ = "assoc_album_to_stores"
 
-    album_id = Column(Integer, ForeignKey("albums.album_id"), primary_key=True)
-    store_id = Column(Integer, ForeignKey("stores.store_id"), primary_key=True)
+    album_id = Column(Integer, ForeignKey("albums.album_id", ondelete="CASCADE"), primary_key=True)
+    store_id = Column(Integer, ForeignKey("stores.store_id", ondelete="CASCADE"), primary_key=True, index=True)
 
     album = relationship("Album")
     store = relationship("Store")
@@ -65,9 +66,13 @@ class AlbumToStoresAssociation(Base):
 
 class Artist(Base):
     __tablename__ = 'artists'
+    # Artists are resolved by name, see app.artists. Named apart from the plain index of older
+    # databases so that init_db() adds it to them, unless they already hold duplicate names
+    __table_args__ = (Index('ux_artists_name', 'name', unique=True),)
 
     artist_id = Column(Integer, primary_key=True)
     name = Column(String(1024))
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     tracks = relationship("Track", secondary=ArtistToTrackAssociation.__tablename__, back_populates="artists",
                           uselist=True)
@@ -85,9 +90,12 @@ class Track(Base):
     track_id = Column(Integer, primary_key=True)
     title = Column(String(128))
     version = Column(String(128))
-    explicit = Column(Boolean)
-    isrc = Column(String(128))
+    explicit = Column(Boolean, index=True)
+    # Not unique: tracks are stored per album, so the same recording shows up once per album
+    isrc = Column(String(128), index=True)
     audio_file = Column(String(1024))
+    # Also bumped when a credited artist changes
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     artists = relationship(Artist, secondary=ArtistToTrackAssociation.__tablename__, cascade="all",
                            back_populates="tracks", uselist=True)
@@ -98,7 +106,7 @@ class Track(Base):
         self.explicit = True if str(explicit).lower() == 'true' else False
         self.isrc = isrc
         self.audio_file = audio_file
-        self.artists = [Artist(**a) for a in artists]
+        self.artists = [a if isinstance(a, Artist) else Artist(**a) for a in artists]
 
     def __repr__(self):
         return '<Track {}>'.format(self.__dict__)
@@ -109,9 +117,12 @@ class Album(Base):
 
     album_id = Column(Integer, primary_key=True)
     title = Column(String(128))
-    upc = Column(String(128))
+    # Not unique: re-deliveries of a product are stored as new albums
+    upc = Column(String(128), index=True)
     artwork_file = Column(String(1024))
-    release_date = Column(Date)
+    release_date = Column(Date, index=True)
+    # Also bumped when one of the tracks changes
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     stores = relationship(Store, secondary=AlbumToStoresAssociation.__tablename__, backref="albums", uselist=True)
     tracks = relationship(Track, secondary=TrackToAlbumAssociation.__tablename__, backref="albums", uselist=True)
@@ -124,3 +135,89 @@ class Album(Base):
 
     def __repr__(self):
         return "<Album {}>".format(self.__dict__)
+
+
+class JobStatus(enum.Enum):
+    queued = 1
+    running = 2
+    done = 3
+    failed = 4
+
+
+class Job(Base):
+    """
+    A unit of background work, queued in the database so that any worker process can run it.
+    """
+    __tablename__ = 'jobs'
+
+    job_id = Column(Integer, primary_key=True)
+    kind = Column(String(32))
+    status = Column(Enum(JobStatus), default=JobStatus.queued.name, index=True)
+    # JSON document handed to the handler of the kind
+    payload = Column(Text)
+    chunk_size = Column(Integer)
+    total = Column(Integer)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime)
+    # Bumped by the worker after every batch, a running job that stops being bumped has lost its worker
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime)
+
+    def __repr__(self):
+        return "<Job {}>".format(self.__dict__)
+
+
+class JobItem(Base):
+    """
+    The outcome of one item of a job, committed together with the batch that wrote it.
+    """
+    __tablename__ = 'job_items'
+
+    job_id = Column(Integer, ForeignKey("jobs.job_id"), primary_key=True)
+    resource = Column(String(32), primary_key=True)
+    item_index = Column(Integer, primary_key=True)
+    status = Column(String(16))
+    error = Column(Text)
+    resource_id = Column(Integer)
+
+    def __repr__(self):
+        return "<JobItem {}>".format(self.__dict__)
+
+
+class IdempotencyKey(Base):
+    """
+    The response to a write sent with an Idempotency-Key header, NULL while it is being processed.
+    """
+    __tablename__ = 'idempotency_keys'
+
+    key = Column(String(255), primary_key=True)
+    # SHA-256 of the method, path and body of the request
+    fingerprint = Column(String(64))
+    status_code = Column(Integer)
+    # Compact JSON of the response body and headers
+    response = Column(Text)
+    headers = Column(Text)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return "<IdempotencyKey {}>".format(self.__dict__)
+
+
+class Change(Base):
+    """
+    One entry of the append-only log of the changes to artists, tracks and albums, written by the
+    triggers of app.changes. AUTOINCREMENT keeps sequence numbers from ever being reused.
+    """
+    __tablename__ = 'changes'
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    seq = Column(Integer, primary_key=True)
+    kind = Column(String(16))
+    resource_id = Column(Integer)
+    # created, updated or deleted
+    operation = Column(String(16))
+    changed_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return "<Change {}>".format(self.__dict__)
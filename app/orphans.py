@@ -0,0 +1,191 @@
+import argparse
+import time
+
+from sqlalchemy import exists, select, tuple_
+
+from app.database import db_session
+from app.models.all import Artist, Track, Album, ArtistToTrackAssociation, TrackToAlbumAssociation, \
+    AlbumToStoresAssociation, Store
+from config import app_config, config_name
+
+config = app_config[config_name]
+
+GC_CHUNK_SIZE = 1000
+
+# (association table, [(column, referenced ID column)]) of the rows the garbage collection checks
+_ASSOCIATIONS = [
+    (ArtistToTrackAssociation.__table__, [(ArtistToTrackAssociation.artist_id, Artist.artist_id),
+                                          (ArtistToTrackAssociation.track_id, Track.track_id)]),
+    (TrackToAlbumAssociation.__table__, [(TrackToAlbumAssociation.track_id, Track.track_id),
+                                         (TrackToAlbumAssociation.album_id, Album.album_id)]),
+    (AlbumToStoresAssociation.__table__, [(AlbumToStoresAssociation.album_id, Album.album_id),
+                                          (AlbumToStoresAssociation.store_id, Store.store_id)]),
+]
+
+
+def _ids(column, condition):
+    return {i for (i,) in db_session.query(column).filter(condition)}
+
+
+def _uncredited(track_ids):
+    return set(track_ids) - _ids(ArtistToTrackAssociation.track_id, ArtistToTrackAssociation.track_id.in_(track_ids))
+
+
+def _on_no_album(track_ids):
+    return set(track_ids) - _ids(TrackToAlbumAssociation.track_id, TrackToAlbumAssociation.track_id.in_(track_ids))
+
+
+def _on_no_track(artist_ids):
+    return set(artist_ids) - _ids(ArtistToTrackAssociation.artist_id,
+                                  ArtistToTrackAssociation.artist_id.in_(artist_ids))
+
+
+def delete_cascade(artist_ids=(), track_ids=(), album_ids=(), orphans=None):
+    """
+    Delete the given artists, tracks and albums with every association row pointing at them, without
+    committing. If ``orphans`` (by default DELETE_ORPHANS) is on, also delete what they leave behind:
+    the tracks of the albums that are on no album any more, the tracks of the artists that are left
+    with no artist and on no album, and the artists of the tracks that are credited on no track any
+    more. Returns the IDs of everything deleted per kind, to invalidate them.
+    """
+    orphans = config.DELETE_ORPHANS if orphans is None else orphans
+    # IDs come from URLs, those that are not numbers match nothing
+    deleted = {kind: {int(i) for i in ids if str(i).isdigit()}
+               for kind, ids in (("artist", artist_ids), ("track", track_ids), ("album", album_ids))}
+
+    if deleted["album"]:
+        album_tracks = _ids(TrackToAlbumAssociation.track_id, TrackToAlbumAssociation.album_id.in_(deleted["album"]))
+        TrackToAlbumAssociation.query.filter(TrackToAlbumAssociation.album_id.in_(deleted["album"])) \
+            .delete(synchronize_session=False)
+        AlbumToStoresAssociation.query.filter(AlbumToStoresAssociation.album_id.in_(deleted["album"])) \
+            .delete(synchronize_session=False)
+        Album.query.filter(Album.album_id.in_(deleted["album"])).delete(synchronize_session=False)
+        if orphans and album_tracks:
+            deleted["track"] |= _on_no_album(album_tracks)
+
+    if deleted["artist"]:
+        artist_tracks = _ids(ArtistToTrackAssociation.track_id,
+                             ArtistToTrackAssociation.artist_id.in_(deleted["artist"]))
+        ArtistToTrackAssociation.query.filter(ArtistToTrackAssociation.artist_id.in_(deleted["artist"])) \
+            .delete(synchronize_session=False)
+        Artist.query.filter(Artist.artist_id.in_(deleted["artist"])).delete(synchronize_session=False)
+        if orphans and artist_tracks:
+            # Tracks of albums keep their place on the album even without credits
+            deleted["track"] |= _on_no_album(_uncredited(artist_tracks))
+
+    if deleted["track"]:
+        track_artists = _ids(ArtistToTrackAssociation.artist_id,
+                             ArtistToTrackAssociation.track_id.in_(deleted["track"]))
+        ArtistToTrackAssociation.query.filter(ArtistToTrackAssociation.track_id.in_(deleted["track"])) \
+            .delete(synchronize_session=False)
+        TrackToAlbumAssociation.query.filter(TrackToAlbumAssociation.track_id.in_(deleted["track"])) \
+            .delete(synchronize_session=False)
+        Track.query.filter(Track.track_id.in_(deleted["track"])).delete(synchronize_session=False)
+        if orphans and track_artists:
+            orphaned_artists = _on_no_track(track_artists - deleted["artist"])
+            Artist.query.filter(Artist.artist_id.in_(orphaned_artists)).delete(synchronize_session=False)
+            deleted["artist"] |= orphaned_artists
+
+    return deleted
+
+
+def _missing(references):
+    """
+    Condition matching the rows pointing at a missing row through any of the (column, referenced
+    ID column) ``references``.
+    """
+    missing = [~exists().where(referenced == column) for column, referenced in references]
+    condition = missing[0]
+    for other in missing[1:]:
+        condition = condition | other
+    return condition
+
+
+def _delete_in_chunks(key_columns, condition, delete, chunk_size, pause):
+    """
+    Walk the table of ``key_columns`` in key order, ``chunk_size`` rows at a time, and call
+    ``delete(keys, first, last)`` with the keys of the rows of each chunk matching ``condition`` and
+    the first and last key of the chunk. Every chunk is committed on its own, so that the write lock
+    is released in between, and the table is read once however many rows are deleted. Returns the
+    number of rows deleted.
+    """
+    total = 0
+    last = None
+    while True:
+        query = select(*key_columns, condition).order_by(*key_columns).limit(chunk_size)
+        if last is not None:
+            query = query.where(tuple_(*key_columns) > tuple_(*last))
+        rows = db_session.execute(query).fetchall()
+        if not rows:
+            db_session.commit()
+            return total
+        first, last = rows[0][:-1], rows[-1][:-1]
+        keys = [tuple(row[:-1]) for row in rows if row[-1]]
+        if keys:
+            delete(keys, first, last)
+            total += len(keys)
+        db_session.commit()
+        if pause and keys:
+            time.sleep(pause)
+
+
+def collect_garbage(tracks=False, artists=False, chunk_size=GC_CHUNK_SIZE, pause=0.0):
+    """
+    Delete the association rows pointing at deleted artists, tracks, albums or stores, in transactions
+    of ``chunk_size`` rows. With ``tracks``, delete the tracks on no album as well, and with ``artists``
+    the artists credited on no track: only for catalogues where every track comes with an album, as
+    tracks and artists created on their own are on no album or track either. Returns the number of
+    rows deleted per table.
+
+    The response caches of running processes drop the deleted tracks and artists when they next read
+    the change log.
+    """
+    counts = {}
+    for table, references in _ASSOCIATIONS:
+        key_columns = [table.c[column.key] for column, referenced in references]
+        condition = _missing(references)
+
+        def delete(keys, first, last):
+            # A range of the primary key, SQLite does not search it for a list of row values
+            key = tuple_(*key_columns)
+            db_session.execute(table.delete().where(key >= tuple_(*first), key <= tuple_(*last), condition))
+
+        counts[table.name] = _delete_in_chunks(key_columns, condition, delete, chunk_size, pause)
+
+    if tracks:
+        def delete_tracks(keys, first, last):
+            track_ids = [k for (k,) in keys]
+            ArtistToTrackAssociation.query.filter(ArtistToTrackAssociation.track_id.in_(track_ids)) \
+                .delete(synchronize_session=False)
+            Track.query.filter(Track.track_id.in_(track_ids)).delete(synchronize_session=False)
+
+        on_no_album = _missing([(TrackToAlbumAssociation.track_id, Track.track_id)])
+        counts["tracks"] = _delete_in_chunks([Track.track_id], on_no_album, delete_tracks, chunk_size, pause)
+
+    if artists:
+        def delete_artists(keys, first, last):
+            Artist.query.filter(Artist.artist_id.in_([k for (k,) in keys])).delete(synchronize_session=False)
+
+        on_no_track = _missing([(ArtistToTrackAssociation.artist_id, Artist.artist_id)])
+        counts["artists"] = _delete_in_chunks([Artist.artist_id], on_no_track, delete_artists, chunk_size, pause)
+
+    db_session.remove()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete orphaned rows in small transactions, e.g. from cron")
+    parser.add_argument("--tracks", action="store_true", help="also delete the tracks on no album")
+    parser.add_argument("--artists", action="store_true", help="also delete the artists credited on no track")
+    parser.add_argument("--chunk-size", type=int, default=GC_CHUNK_SIZE, help="rows deleted per transaction")
+    parser.add_argument("--pause", type=float, default=0.0,
+                        help="seconds to wait between transactions, to let other writers in")
+    args = parser.parse_args()
+
+    counts = collect_garbage(args.tracks, args.artists, args.chunk_size, args.pause)
+    for table, count in counts.items():
+        print("{:<24} {:>10} rows deleted".format(table, count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import random
+import time
+
+from flask import request
+
+from app.cache import LRUCache
+from app.database import RoutingSession, db_session, read_from, replica_engines
+from config import app_config, config_name
+
+config = app_config[config_name]
+
+READ_METHODS = ("GET", "HEAD")
+# Cookie holding the time until which the client that wrote something reads from the primary database
+STICKY_COOKIE = "read_primary_until"
+
+
+class ReplicaRouter(object):
+    """
+    Send the reads of GET and HEAD requests to a random replica, and everything else to the primary
+    database. A client that wrote something keeps reading from the primary database for ``sticky``
+    seconds, so that it reads its writes whatever the replicas lag behind. Clients are recognised by
+    a cookie or, for those that drop cookies, by their address.
+    """
+
+    def __init__(self, replicas, sticky):
+        self.replicas = replicas
+        self.sticky = sticky
+        self._writers = LRUCache(max_size=10000, ttl=sticky)
+
+    def init_app(self, app):
+        app.before_request(self.route)
+        app.after_request(self.remember_writer)
+        app.teardown_request(self.reset)
+
+    def route(self):
+        # The sessions of app.asgi read from its own engine
+        if not self.replicas or not isinstance(db_session(), RoutingSession):
+            return
+        if request.method in READ_METHODS and not self.wrote_recently():
+            read_from(random.choice(self.replicas))
+
+    def wrote_recently(self):
+        try:
+            if float(request.cookies.get(STICKY_COOKIE, 0)) > time.time():
+                return True
+        except ValueError:
+            pass
+        return self._writers.get(request.remote_addr) is not None
+
+    def remember_writer(self, response):
+        if self.replicas and request.method not in READ_METHODS + ("OPTIONS",) and response.status_code < 400:
+            self._writers.set(request.remote_addr, True)
+            response.set_cookie(STICKY_COOKIE, str(time.time() + self.sticky), max_age=int(self.sticky) + 1,
+                                httponly=True)
+        return response
+
+    @staticmethod
+    def reset(exception=None):
+        read_from(None)
+
+
+replica_router = ReplicaRouter(replica_engines, config.REPLICA_STICKY_SECONDS)
+
+
+def init_replicas(app):
+    """
+    Route the reads of the requests of ``app`` to the replicas of DATABASE_REPLICA_URLS, if any.
+    """
+    replica_router.init_app(app)
@@ -0,0 +1,106 @@
+import re
+import warnings
+
+from sqlalchemy import text
+
+from app.database import engine
+
+# Each resource is one row of the index, its rowid encodes the kind and the ID of the resource so
+# that the triggers can update it without scanning the index
+SEARCH_KINDS = {'artist': 1, 'track': 2, 'album': 3}
+_KIND_STRIDE = 4
+
+# (kind, table, ID column, column indexed as title, column indexed as version)
+_INDEXED_TABLES = [
+    ('artist', 'artists', 'artist_id', 'name', 'NULL'),
+    ('track', 'tracks', 'track_id', 'title', 'version'),
+    ('album', 'albums', 'album_id', 'title', 'NULL'),
+]
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def _rowid(kind, prefix, id_column):
+    return "{}.{} * {} + {}".format(prefix, id_column, _KIND_STRIDE, SEARCH_KINDS[kind])
+
+
+def _statements():
+    # prefix='2 3' keeps short prefix queries like "pi*" from scanning every term of the index
+    yield ("CREATE VIRTUAL TABLE search_index USING fts5("
+           "title, version, tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+    for kind, table, id_column, title, version in _INDEXED_TABLES:
+        new_version = version if version == 'NULL' else 'new.' + version
+        insert = "INSERT INTO search_index(rowid, title, version) VALUES ({}, new.{}, {});".format(
+            _rowid(kind, 'new', id_column), title, new_version)
+        delete = "DELETE FROM search_index WHERE rowid = {};".format(_rowid(kind, 'old', id_column))
+        watched = title if version == 'NULL' else '{}, {}'.format(title, version)
+        yield "CREATE TRIGGER {0}_search_insert AFTER INSERT ON {0} BEGIN {1} END".format(table, insert)
+        yield "CREATE TRIGGER {0}_search_update AFTER UPDATE OF {1} ON {0} BEGIN {2} {3} END".format(
+            table, watched, delete, insert)
+        yield "CREATE TRIGGER {0}_search_delete AFTER DELETE ON {0} BEGIN {1} END".format(table, delete)
+        yield "INSERT INTO search_index(rowid, title, version) SELECT {}, {}, {} FROM {}".format(
+            _rowid(kind, table, id_column), title, version, table)
+
+
+def search_available():
+    """
+    Whether there is a full-text index to search, it needs SQLite FTS5.
+    """
+    return engine.dialect.name == 'sqlite'
+
+
+def init_search_index():
+    """
+    Create the full-text index of artist names, track titles and versions and album titles, fill
+    it with the existing rows and keep it in sync with triggers. Does nothing if it exists already.
+    """
+    if not search_available():
+        warnings.warn("Full-text search needs SQLite FTS5, /api/v1/search is disabled")
+        return
+    with engine.begin() as connection:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'").scalar()
+        if exists:
+            return
+        for statement in _statements():
+            connection.exec_driver_sql(statement)
+
+
+def match_expression(query):
+    """
+    The FTS5 query matching every word of the user's ``query`` as a prefix, None if it has no words.
+    Words are quoted, so FTS5 operators in ``query`` are searched for as plain text.
+    """
+    terms = _TERM.findall(query)
+    if not terms:
+        return None
+    return " ".join('"{}"*'.format(term) for term in terms)
+
+
+def search(session, query, kinds=None, limit=100, offset=0):
+    """
+    Return up to ``limit`` dicts ``{"type", "<type>_id", "title"/"name", "version"}`` of the
+    resources of ``kinds`` matching ``query``, best matches first, skipping the first ``offset``.
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    kinds = [SEARCH_KINDS[k] for k in (kinds or SEARCH_KINDS)]
+    statement = text("SELECT rowid, title, version FROM search_index "
+                     "WHERE search_index MATCH :expression AND rowid % {} IN ({}) "
+                     "ORDER BY rank LIMIT :limit OFFSET :offset"
+                     .format(_KIND_STRIDE, ", ".join(str(k) for k in kinds)))
+    names = {code: kind for kind, code in SEARCH_KINDS.items()}
+    hits = []
+    for rowid, title, version in session.execute(statement, dict(expression=expression, limit=limit,
+                                                                 offset=offset)):
+        kind = names[rowid % _KIND_STRIDE]
+        hit = {"type": kind, "{}_id".format(kind): rowid // _KIND_STRIDE}
+        if kind == 'artist':
+            hit["name"] = title
+        else:
+            hit["title"] = title
+        if kind == 'track':
+            hit["version"] = version
+        hits.append(hit)
+    return hits
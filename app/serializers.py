@@ -0,0 +1,182 @@
+from functools import wraps
+from urllib.parse import quote, urlparse
+
+from flask import current_app, request, url_for
+from flask_restful import fields
+from flask_restful.utils import unpack
+
+from app.instrumentation import timed_serialization
+
+try:
+    import orjson
+except ImportError:  # optional, only needed for FAST_JSON
+    orjson = None
+
+# Same characters werkzeug leaves unquoted when building URLs
+URL_SAFE_CHARACTERS = "!$&'()*+,/:;=@"
+
+_url_templates = {}
+
+
+def _field_instance(field):
+    return field() if isinstance(field, type) else field
+
+
+def _getter(key):
+    """
+    Read ``key`` like flask_restful's get_value does, for plain (not dotted, not callable) keys.
+    """
+    def get(obj):
+        if isinstance(obj, dict):
+            return obj.get(key)
+        return getattr(obj, key, None)
+    return get
+
+
+def url_template(endpoint):
+    """
+    Return the path of ``endpoint`` with a placeholder for each rule argument, and the arguments.
+    Built with url_for once per endpoint and script root, instead of once per object.
+    """
+    key = (endpoint, request.script_root)
+    if key not in _url_templates:
+        rule = next(current_app.url_map.iter_rules(endpoint))
+        arguments = sorted(rule.arguments)
+        placeholders = {a: "URLTEMPLATEARG{}X".format(i) for i, a in enumerate(arguments)}
+        template = urlparse(url_for(endpoint, **placeholders)).path
+        _url_templates[key] = (template, [(a, placeholders[a]) for a in arguments])
+    return _url_templates[key]
+
+
+def compile_field(key, field):
+    """
+    Turn ``field`` of a flask_restful field map into a function of the marshalled object returning
+    exactly what ``field.output(key, obj)`` would.
+    """
+    if isinstance(field, dict):
+        return compile_fields(field)
+
+    field = _field_instance(field)
+    attribute = key if field.attribute is None else field.attribute
+    generic = lambda obj: field.output(key, obj)
+    if callable(attribute) or "." in str(attribute):
+        return generic
+    get = _getter(attribute)
+
+    if type(field) is fields.Integer:
+        default = field.default
+
+        def integer(obj):
+            value = get(obj)
+            return default if value is None else int(value)
+        return integer
+
+    if type(field) is fields.String:
+        default = field.default
+
+        def string(obj):
+            value = get(obj)
+            return default if value is None else str(value)
+        return string
+
+    if type(field) is fields.Boolean:
+        default = field.default
+
+        def boolean(obj):
+            value = get(obj)
+            return default if value is None else bool(value)
+        return boolean
+
+    if type(field) is fields.Url and not field.absolute and field.endpoint is not None:
+        endpoint = field.endpoint
+
+        def url(obj):
+            # flask_restful builds the URL from the instance's __dict__, i.e. its loaded attributes
+            values = obj if isinstance(obj, dict) else obj.__dict__
+            template, arguments = url_template(endpoint)
+            for argument, placeholder in arguments:
+                value = values.get(argument)
+                if value is None:
+                    # Let flask_restful raise the usual error
+                    return generic(obj)
+                template = template.replace(placeholder, quote(str(value), safe=URL_SAFE_CHARACTERS))
+            return template
+        return url
+
+    if type(field) is fields.Nested and field.default is None:
+        nested = compile_fields(field.nested)
+        allow_null = field.allow_null
+
+        def nested_field(obj):
+            value = get(obj)
+            if value is None:
+                return None if allow_null else generic(obj)
+            return nested(value)
+        return nested_field
+
+    if type(field) is fields.List and type(_field_instance(field.container)) is fields.String:
+        default = field.default
+        container_default = _field_instance(field.container).default
+
+        def string_list(obj):
+            value = get(obj)
+            if value is None or isinstance(value, (str, dict)) or not hasattr(value, "__getitem__"):
+                return default if value is None else generic(obj)
+            return [container_default if v is None else str(v) for v in value]
+        return string_list
+
+    return generic
+
+
+def compile_fields(field_map):
+    """
+    Turn a flask_restful field map into a function producing the same output as
+    ``marshal(data, field_map)``, for single objects as well as lists of them.
+    """
+    compiled = [(key, compile_field(key, field)) for key, field in field_map.items()]
+
+    def serialize_one(obj):
+        return {key: output(obj) for key, output in compiled}
+
+    def serialize(data):
+        if isinstance(data, (list, tuple)):
+            return [serialize_one(d) for d in data]
+        return serialize_one(data)
+    return serialize
+
+
+def serialize_response(serialize, resp):
+    """
+    Apply ``serialize`` to the data of a resource method's return value, like marshal_with does.
+    """
+    with timed_serialization():
+        if isinstance(resp, tuple):
+            data, code, headers = unpack(resp)
+            return serialize(data), code, headers
+        return serialize(resp)
+
+
+def serialize_with(field_map):
+    """
+    Like flask_restful's marshal_with, with ``field_map`` compiled once.
+    """
+    serialize = compile_fields(field_map)
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            return serialize_response(serialize, f(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def output_fast_json(data, code, headers=None):
+    """
+    flask_restful representation writing JSON with orjson. The output is the same JSON value as
+    the default representation, but with compact separators.
+    """
+    options = orjson.OPT_INDENT_2 if current_app.debug else 0
+    resp = current_app.response_class(orjson.dumps(data, option=options) + b"\n", status=code,
+                                      mimetype="application/json")
+    resp.headers.extend(headers or {})
+    return resp
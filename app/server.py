@@ -0,0 +1,224 @@
+"""
+Production server: a master process that imports and warms up the app once, then forks the workers.
+
+    python server.py --bind 0.0.0.0:8000 --workers 4 --threads 8
+
+Everything app/__init__.py does on import (schema creation, search index and change log triggers,
+store cache) runs once, in the master. Its warm-up requests build what the first requests would
+otherwise build in every worker, and the workers share those pages with the master until they
+write to them. Each worker serves the listening socket of the master with a fixed pool of threads,
+and a worker that dies is replaced. POSIX only, workers are forked.
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Signals that stop the master and its workers
+STOP_SIGNALS = {signal.SIGTERM, signal.SIGINT}
+
+# One GET per kind of resource listing, the first resource of each listing is fetched as well
+WARM_UP_PATHS = [
+    "/api/v1/resources/artists/all?limit=1",
+    "/api/v1/resources/tracks/all?limit=1",
+    "/api/v1/resources/albums/all?limit=1",
+    "/api/v1/search?q=warmup",
+    "/api/v1/changes?limit=1",
+    "/help",
+]
+
+
+def warm_up(app):
+    """
+    Send a request per kind of GET through ``app``, so that the mappers, the compiled SQL
+    statements, the URL templates of the serialisers, the query plan checks and the page templates
+    are ready before any client comes in. The responses are not kept in the response cache.
+    """
+    from app.cache import response_cache
+    from app.database import db_session
+
+    client = app.test_client()
+    for path in WARM_UP_PATHS:
+        response = client.get(path)
+        if response.status_code != 200:
+            logger.warning("Warming up with %s answered %s", path, response.status_code)
+        elif path.endswith("/all?limit=1") and response.get_json():
+            client.get(response.get_json()[0]["uri"])
+    response_cache.clear()
+    db_session.remove()
+
+
+def make_server(app, listener, threads):
+    """
+    A WSGI server answering the connections of the ``listener`` socket with a pool of ``threads`` threads.
+    """
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    from app.database import db_session
+
+    class RequestHandler(WSGIRequestHandler):
+        # One request per connection, an idle kept-alive connection would hold a thread of the pool
+        protocol_version = "HTTP/1.0"
+
+    class ThreadPoolWSGIServer(BaseWSGIServer):
+        multithread = True
+
+        def __init__(self, *args, **kwargs):
+            super(ThreadPoolWSGIServer, self).__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="request")
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self.process_request_thread, request, client_address)
+
+        def process_request_thread(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                db_session.remove()
+
+    host, port = listener.getsockname()[:2]
+    return ThreadPoolWSGIServer(host, port, app, handler=RequestHandler, fd=listener.fileno())
+
+
+def run_worker(app, listener, threads):
+    """
+    Serve ``listener`` in a freshly forked worker until it is told to stop with SIGTERM or SIGINT.
+    """
+    from app.database import dispose_engines
+    from app.jobs import job_queue
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    # Blocked by the master while forking, a signal it got since is delivered now
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+    # Pooled connections must not be shared with the master or the other workers
+    dispose_engines(close=False)
+    if job_queue.pending():
+        job_queue.start()
+
+    server = make_server(app, listener, threads)
+    try:
+        server.serve_forever()
+    finally:
+        # Let the requests in progress finish
+        server.pool.shutdown(wait=True)
+        server.server_close()
+        job_queue.stop()
+
+
+class Master(object):
+    """
+    Fork ``workers`` workers serving ``listener`` and replace those that exit until stopped.
+    """
+
+    def __init__(self, app, listener, workers, threads):
+        self.app = app
+        self.listener = listener
+        self.workers = workers
+        self.threads = threads
+        self.children = set()
+        self.stopping = False
+
+    def spawn(self):
+        # Until it has its own handlers, a worker would stop the master's children instead of itself
+        signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    run_worker(self.app, self.listener, self.threads)
+                except SystemExit as e:
+                    code = e.code or 0
+                except BaseException:
+                    logger.exception("Worker %s failed", os.getpid())
+                    code = 1
+                finally:
+                    os._exit(code)
+            self.children.add(pid)
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        # main() blocked the signals from listening on, until they stop the workers as well
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+        # Leave the objects of the preloaded app out of garbage collection, collecting them would
+        # write to their pages and copy them into every worker
+        gc.freeze()
+        for _ in range(self.workers):
+            if not self.stopping:
+                self.spawn()
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            self.children.discard(pid)
+            if not self.stopping:
+                logger.warning("Worker %s exited with %s, starting another one", pid,
+                               os.waitstatus_to_exitcode(status))
+                # Do not spin if workers die as soon as they start
+                time.sleep(1)
+                if not self.stopping:
+                    self.spawn()
+        self.listener.close()
+
+
+def listen(bind, backlog):
+    host, _, port = bind.rpartition(":")
+    listener = socket.create_server((host or "0.0.0.0", int(port)), backlog=backlog)
+    listener.set_inheritable(True)
+    return listener
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the app from pre-forked worker processes")
+    parser.add_argument("--bind", default="127.0.0.1:8000", help="host:port to listen on")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="request threads per worker")
+    parser.add_argument("--backlog", type=int, default=1024, help="connections waiting to be accepted")
+    parser.add_argument("--no-warm-up", dest="warm_up", action="store_false",
+                        help="do not send the warm-up requests before forking")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(levelname)s %(message)s")
+
+    from app import app
+
+    if not app.config["PREFORK"]:
+        # Threads do not survive a fork, with jobs pending they would run in the master only
+        parser.error("PREFORK must be set before the app is imported, run server.py")
+
+    if args.warm_up:
+        warm_up(app)
+    from app.database import dispose_engines
+    # The workers open their own connections
+    dispose_engines()
+
+    # Clients may connect as soon as the socket listens, a signal before Master.run() waits for it
+    signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+    listener = listen(args.bind, args.backlog)
+    logger.info("Listening on %s with %d workers of %d threads", args.bind, args.workers, args.threads)
+    Master(app, listener, args.workers, args.threads).run()
+
@@ -0,0 +1,89 @@
+import threading
+
+from sqlalchemy import event, exists, func, inspect, literal, select
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.database import db_session, engine
+from app.models.all import Store, StoreEnum
+
+
+class StoreCache(object):
+    """
+    Process-local cache of the Store row IDs keyed by StoreEnum.
+
+    There are only a handful of stores, so once they are known album creation attaches them to the
+    session without running any query. Missing stores are created on demand with a single
+    INSERT ... WHERE NOT EXISTS in a transaction of their own, so a store is never created twice and
+    a cached ID never points at a row that was rolled back with the request that needed it.
+    """
+
+    def __init__(self):
+        self._store_ids = {}
+        self._lock = threading.Lock()
+
+    def store_id(self, name):
+        """
+        Return the ID of the store ``name`` (a StoreEnum or its name). Raises KeyError for unknown stores.
+        """
+        store_enum = name if isinstance(name, StoreEnum) else StoreEnum[name]
+        store_id = self._store_ids.get(store_enum)
+        if store_id is None:
+            store_id = self.load(store_enum)[store_enum]
+        return store_id
+
+    def get(self, name):
+        """
+        Return the Store for ``name`` (a StoreEnum or its name) attached to the current session.
+        Raises KeyError for unknown stores.
+        """
+        store_enum = name if isinstance(name, StoreEnum) else StoreEnum[name]
+        store = Store(name=store_enum)
+        store.store_id = self.store_id(store_enum)
+        make_transient_to_detached(store)
+        # load=False puts the instance in the session as is, or returns the one already there
+        return db_session.merge(store, load=False)
+
+    def load(self, *store_enums):
+        """
+        Fill the cache for ``store_enums`` (all stores if none are given), creating the missing rows.
+        """
+        store_enums = store_enums or tuple(StoreEnum)
+        with self._lock:
+            missing = [s for s in store_enums if s not in self._store_ids]
+            if missing:
+                with engine.begin() as connection:
+                    for store_enum in missing:
+                        new_store = select(literal(store_enum, Store.name.type)) \
+                            .where(~exists().where(Store.name == store_enum))
+                        connection.execute(Store.__table__.insert().from_select([Store.name], new_store))
+                    # Older databases may hold duplicate stores, always pick the first one
+                    rows = connection.execute(select(Store.name, func.min(Store.store_id))
+                                              .where(Store.name.in_(missing))
+                                              .group_by(Store.name))
+                    self._store_ids.update(rows.all())
+            return dict(self._store_ids)
+
+    def invalidate(self, name=None):
+        """
+        Forget the cached ID of store ``name``, or of all stores.
+        """
+        with self._lock:
+            if name is None:
+                self._store_ids.clear()
+            else:
+                self._store_ids.pop(name if isinstance(name, StoreEnum) else StoreEnum[name], None)
+
+
+store_cache = StoreCache()
+
+
+@event.listens_for(Store, "after_delete")
+def invalidate_deleted_store(mapper, connection, target):
+    store_cache.invalidate()
+
+
+@event.listens_for(Store, "after_update")
+def invalidate_renamed_store(mapper, connection, target):
+    # Stores are also flushed as "updated" whenever an album is added to them
+    if inspect(target).attrs.name.history.has_changes():
+        store_cache.invalidate()
@@ -0,0 +1,4 @@
+from app import app
+
+# Fail the tests of requests that lazy load a relationship per object
+app.config["N_PLUS_ONE_RAISE"] = True
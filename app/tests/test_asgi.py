@@ -0,0 +1,138 @@
+import asyncio
+from unittest import TestCase
+from urllib.parse import quote
+
+from sqlalchemy import event
+
+from app import app
+from app.asgi import application, async_engine
+from app.database import db_session, engine
+from app.tests import test_cache, test_filters, test_idempotency, test_routes
+
+# One event loop for every test, the pooled aiosqlite connections belong to the loop they were opened on
+loop = asyncio.new_event_loop()
+
+
+def tearDownModule():
+    loop.run_until_complete(async_engine.dispose())
+    loop.close()
+
+
+class AsgiClient(object):
+    """
+    Enough of Flask's test client to run the functional tests against the ASGI application.
+    """
+
+    def __init__(self, environ_base=None):
+        self.client = (environ_base or {}).get("REMOTE_ADDR", "127.0.0.1")
+
+    def open(self, url, method="GET", headers=None, data=None):
+        path, _, query_string = url.partition("?")
+        body = data.encode("utf-8") if isinstance(data, str) else data or b""
+        headers = dict(headers or {}, **({"Content-Length": str(len(body))} if body else {}))
+        scope = {"type": "http", "http_version": "1.1", "method": method, "scheme": "http", "path": path,
+                 "root_path": "", "query_string": quote(query_string, safe="=&%+,:/;!$'()*@?").encode("latin-1"),
+                 "headers": [(k.lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in headers.items()],
+                 "server": ("localhost", 80), "client": (self.client, 12345)}
+        return loop.run_until_complete(self.request(scope, body))
+
+    @staticmethod
+    async def request(scope, body):
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        started = {}
+        chunks = []
+
+        async def receive():
+            return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                started.update(message)
+            else:
+                chunks.append(message.get("body", b""))
+
+        await application(scope, receive, send)
+        return app.response_class(b"".join(chunks), status=started["status"],
+                                  headers=[(k.decode("latin-1"), v.decode("latin-1")) for k, v in started["headers"]])
+
+    def get(self, url, **kwargs):
+        return self.open(url, "GET", **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.open(url, "POST", **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.open(url, "PUT", **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.open(url, "PATCH", **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.open(url, "DELETE", **kwargs)
+
+
+class TestAsgiRoutes(test_routes.TestRoutes):
+    def setUp(self):
+        super(TestAsgiRoutes, self).setUp()
+        self.app = AsgiClient()
+
+
+class TestAsgiResponseCache(test_cache.TestResponseCache):
+    def setUp(self):
+        super(TestAsgiResponseCache, self).setUp()
+        self.app = AsgiClient()
+
+
+class TestAsgiFilters(test_filters.TestFilters):
+    def setUp(self):
+        super(TestAsgiFilters, self).setUp()
+        self.app = AsgiClient()
+
+
+class TestAsgiIdempotency(test_idempotency.TestIdempotency):
+    def setUp(self):
+        super(TestAsgiIdempotency, self).setUp()
+        self.app = AsgiClient()
+
+
+class TestAsgiApplication(TestCase):
+    def setUp(self):
+        self.app = AsgiClient()
+
+    def tearDown(self):
+        db_session.remove()
+
+    def test_statements_run_on_the_async_engine(self):
+        statements = {engine: [], async_engine.sync_engine: []}
+        listeners = {e: lambda conn, cursor, statement, *args, e=e: statements[e].append(statement) for e in statements}
+        for e, listener in listeners.items():
+            event.listen(e, "before_cursor_execute", listener)
+        try:
+            response = self.app.get("/api/v1/resources/albums/all?limit=1&after=999999999")
+        finally:
+            for e, listener in listeners.items():
+                event.remove(e, "before_cursor_execute", listener)
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(any(s.startswith("SELECT") for s in statements[async_engine.sync_engine]))
+        self.assertFalse(statements[engine])
+
+    def test_streamed_export(self):
+        response = self.app.get("/api/v1/export/artists?format=ndjson")
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue("X-Change-Seq" in response.headers)
+
+    def test_lifespan(self):
+        messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message["type"])
+
+        loop.run_until_complete(application({"type": "lifespan"}, receive, send))
+
+        self.assertTrue(sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"])
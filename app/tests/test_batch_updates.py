@@ -0,0 +1,104 @@
+import json
+from unittest import TestCase
+
+from app import app
+from app.database import db_session
+from app.tests.test_queries import count_statements
+
+
+class TestBatchUpdates(TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.url_prefix = "/api/v1/resources"
+        payload = json.dumps(dict(title="Batch Album",
+                                  upc="00000000000444",
+                                  artwork_file="https://cdn.coolcompany.io/test.jpg",
+                                  release_date="2021-01-01",
+                                  stores=["spotify"],
+                                  tracks=[dict(title="Batch Track {}".format(i),
+                                               version="Studio Edit",
+                                               explicit=False,
+                                               isrc="TEST000000444",
+                                               audio_file="https://cdn.coolcompany.io/test.wav",
+                                               artists=[dict(name="Batch Artist")]) for i in range(4)]))
+        self.album = self.app.post("{}/albums/new".format(self.url_prefix),
+                                   headers={"Content-Type": "application/json"}, data=payload).get_json()
+        self.tracks = self.album["tracks"]
+
+    def tearDown(self):
+        self.app.delete(self.album["uri"])
+        db_session.remove()
+
+    def patch(self, resource, items, query_string=""):
+        return self.app.patch("{}/{}{}".format(self.url_prefix, resource, query_string),
+                              headers={"Content-Type": "application/json"}, data=json.dumps(items))
+
+    def test_identical_changes_are_grouped(self):
+        # Cache the album, it shows the tracks
+        self.app.get(self.album["uri"])
+        items = [dict(id=t["track_id"], changes=dict(explicit=True)) for t in self.tracks[:3]]
+        items.append(dict(id=self.tracks[3]["track_id"], changes=dict(title="Batch Track Renamed")))
+
+        with count_statements() as statements:
+            response = self.patch("tracks", items)
+
+        self.assertTrue(response.status_code == 200, response.get_json())
+        self.assertTrue([r["affected"] for r in response.get_json()] == [1, 1, 1, 1])
+        track_updates = [s for s in statements if s.startswith("UPDATE tracks SET explicit")
+                         or s.startswith("UPDATE tracks SET title")]
+        self.assertTrue(len(track_updates) == 2, statements)
+        tracks = self.app.get(self.album["uri"]).get_json()["tracks"]
+        self.assertTrue(sorted(t["explicit"] for t in tracks) == [False, True, True, True])
+        self.assertIn("Batch Track Renamed", [t["title"] for t in tracks])
+
+    def test_chunks(self):
+        items = [dict(id=t["track_id"], changes=dict(version="Radio Edit")) for t in self.tracks]
+
+        with count_statements() as statements:
+            response = self.patch("tracks", items, "?chunk_size=3")
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(len([s for s in statements if s.startswith("UPDATE tracks SET version")]) == 2)
+
+    def test_groups_are_split_across_chunks(self):
+        items = [dict(id=t["track_id"], changes=dict(explicit=True)) for t in self.tracks[:2]]
+        items.extend(dict(id=t["track_id"], changes=dict(version="Radio Edit")) for t in self.tracks[2:])
+
+        with count_statements() as statements:
+            response = self.patch("tracks", items, "?chunk_size=3")
+
+        self.assertTrue(response.status_code == 200)
+        # Two explicit changes and one version change fill the first transaction, the last version change
+        # goes to the second
+        self.assertTrue(len([s for s in statements if s.startswith("UPDATE tracks SET explicit")]) == 1)
+        self.assertTrue(len([s for s in statements if s.startswith("UPDATE tracks SET version")]) == 2)
+
+    def test_invalid_items_fail_on_their_own(self):
+        album_id = self.album["album_id"]
+        response = self.patch("albums", [dict(id=album_id, changes=dict(release_date="2022-02-02")),
+                                         dict(id=album_id, changes=dict(title="Twice")),
+                                         dict(id=album_id, changes=dict(release_date="soon")),
+                                         dict(id=album_id, changes=dict(label="Unknown")),
+                                         dict(id="x", changes=dict(title="Bad ID")),
+                                         dict(id=0, changes=dict(title="Missing"))])
+        results = response.get_json()
+
+        self.assertTrue(response.status_code == 207)
+        self.assertTrue([r["status"] for r in results] == ["updated", "failed", "failed", "failed", "failed",
+                                                           "not found"])
+        self.assertTrue([r["affected"] for r in results] == [1, 0, 0, 0, 0, 0])
+        self.assertIn("label", results[3]["error"])
+        self.assertTrue(self.app.get(self.album["uri"]).get_json()["release_date"] == "2022-02-02")
+        self.assertTrue(self.patch("albums", {"id": album_id}).status_code == 400)
+
+    def test_artist_changes_bump_tracks(self):
+        artist = self.tracks[0]["artists"][0]
+        etag = self.app.get(self.tracks[0]["uri"]).headers["ETag"]
+
+        response = self.patch("artists", [dict(id=artist["artist_id"], changes=dict(name="Batch Artist Renamed"))])
+
+        self.assertTrue(response.status_code == 200)
+        track = self.app.get(self.tracks[0]["uri"])
+        self.assertTrue(track.headers["ETag"] != etag)
+        self.assertTrue(track.get_json()["artists"][0]["name"] == "Batch Artist Renamed")
+
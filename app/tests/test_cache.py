@@ -0,0 +1,211 @@
+import json
+import time
+from unittest import TestCase
+
+from werkzeug.http import http_date
+
+from app import app
+from app.cache import CacheBackend, LRUCache, ResponseCache, response_cache
+from app.database import db_session, engine
+
+
+class TestLRUCache(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertTrue(cache.get("a") == 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertTrue(cache.get("c") == 3)
+
+    def test_expires(self):
+        cache = LRUCache(max_size=2, ttl=0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertFalse(len(cache))
+
+    def test_disabled(self):
+        cache = LRUCache(max_size=0)
+        cache.set("a", 1)
+
+        self.assertIsNone(cache.get("a"))
+
+
+class DictBackend(CacheBackend):
+    """
+    Backend without eviction, standing in for a shared one.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value):
+        self.entries[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class TestCacheBackend(TestCase):
+    def test_incomplete_backend(self):
+        with self.assertRaises(TypeError):
+            type("GetOnly", (CacheBackend,), dict(get=lambda self, key: None))()
+
+    def test_response_cache_backend(self):
+        backend = DictBackend()
+        cache = ResponseCache(backend)
+
+        with app.test_request_context():
+            self.assertTrue(cache.version("artist", 0, lambda: "v1") == "v1")
+            self.assertTrue(cache.version("artist", 0, lambda: "v2") == "v1")
+            self.assertTrue(list(backend.entries) == ["artist:0:version"])
+            cache.invalidate("artist", 0)
+            self.assertTrue(cache.version("artist", 0, lambda: "v2") == "v2")
+        db_session.remove()
+
+    def test_default_backend(self):
+        self.assertTrue(isinstance(ResponseCache().backend, LRUCache))
+
+
+class TestResponseCache(TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.url_prefix = "/api/v1/resources"
+
+    def tearDown(self):
+        db_session.remove()
+
+    def test_track_update_invalidates_track_and_album(self):
+        payload = json.dumps(dict(title="Cached Album",
+                                  upc="00000000000444",
+                                  artwork_file="https://cdn.coolcompany.io/test.jpg",
+                                  release_date="2021-01-01",
+                                  stores=["spotify"],
+                                  tracks=[dict(title="Cached Track",
+                                               version="Studio Edit",
+                                               explicit=False,
+                                               isrc="TEST000000001",
+                                               audio_file="https://cdn.coolcompany.io/test.wav",
+                                               artists=[dict(name="Cached Artist")])]))
+        album = self.app.post("{}/albums/new".format(self.url_prefix),
+                              headers={"Content-Type": "application/json"},
+                              data=payload).get_json()
+        track_uri = album["tracks"][0]["uri"]
+        artist_uri = album["tracks"][0]["artists"][0]["uri"]
+
+        # Fill the cache
+        self.app.get(album["uri"])
+        self.app.get(track_uri)
+
+        self.app.put(track_uri, headers={"Content-Type": "application/json"},
+                     data=json.dumps(dict(title="Cached Track UPDATED")))
+
+        self.assertTrue(self.app.get(track_uri).get_json()["title"] == "Cached Track UPDATED")
+        self.assertTrue(self.app.get(album["uri"]).get_json()["tracks"][0]["title"] == "Cached Track UPDATED")
+
+        # Renaming the artist reaches the album through the track
+        self.app.put(artist_uri, headers={"Content-Type": "application/json"},
+                     data=json.dumps(dict(name="Cached Artist UPDATED")))
+
+        response_json = self.app.get(album["uri"]).get_json()
+        self.assertTrue(response_json["tracks"][0]["artists"][0]["name"] == "Cached Artist UPDATED")
+
+        # Deleting the album drops it from the cached listings
+        lookup_uri = "{}/albums?upc=00000000000444".format(self.url_prefix)
+        self.assertIn(album["album_id"], [a["album_id"] for a in self.app.get(lookup_uri).get_json()])
+        self.app.delete(album["uri"])
+        self.app.delete(track_uri)
+        self.app.delete(artist_uri)
+        self.assertNotIn(album["album_id"], [a["album_id"] for a in self.app.get(lookup_uri).get_json()])
+
+    def test_conditional_get(self):
+        payload = json.dumps(dict(title="Conditional Album",
+                                  upc="00000000000555",
+                                  artwork_file="https://cdn.coolcompany.io/test.jpg",
+                                  release_date="2021-01-01",
+                                  stores=["spotify"],
+                                  tracks=[dict(title="Conditional Track",
+                                               version="Studio Edit",
+                                               explicit=False,
+                                               isrc="TEST000000001",
+                                               audio_file="https://cdn.coolcompany.io/test.wav",
+                                               artists=[dict(name="Conditional Artist")])]))
+        album = self.app.post("{}/albums/new".format(self.url_prefix),
+                              headers={"Content-Type": "application/json"},
+                              data=payload).get_json()
+        track_uri = album["tracks"][0]["uri"]
+
+        response = self.app.get(album["uri"])
+        etag = response.headers["ETag"]
+        self.assertTrue(response.status_code == 200)
+        self.assertIn("Last-Modified", response.headers)
+
+        # Unchanged album
+        response = self.app.get(album["uri"], headers={"If-None-Match": etag})
+        self.assertTrue(response.status_code == 304)
+        self.assertFalse(response.get_data())
+        self.assertTrue(response.headers["ETag"] == etag)
+
+        response = self.app.get(album["uri"], headers={"If-Modified-Since": http_date(time.time() + 60)})
+        self.assertTrue(response.status_code == 304)
+
+        # Changing one of its tracks changes the album too
+        self.app.put(track_uri, headers={"Content-Type": "application/json"},
+                     data=json.dumps(dict(title="Conditional Track UPDATED")))
+
+        response = self.app.get(album["uri"], headers={"If-None-Match": etag})
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.headers["ETag"] != etag)
+        self.assertTrue(response.get_json()["tracks"][0]["title"] == "Conditional Track UPDATED")
+
+        self.app.delete(album["uri"])
+        self.app.delete(track_uri)
+
+    def test_changes_by_other_processes(self):
+        artist = self.app.post("{}/artists/new".format(self.url_prefix),
+                               headers={"Content-Type": "application/json"},
+                               data=json.dumps(dict(name="Cached Elsewhere"))).get_json()
+        lookup_uri = "{}/artists?name=Cached Elsewhere".format(self.url_prefix)
+        # Fill the cache
+        etag = self.app.get(artist["uri"]).headers["ETag"]
+        self.assertTrue(len(self.app.get(lookup_uri).get_json()) == 1)
+
+        # Another process renames the artist, the change log is all this one learns about it
+        with engine.begin() as connection:
+            connection.exec_driver_sql("UPDATE artists SET name = 'Cached Elsewhere UPDATED', updated_at = "
+                                       "strftime('%Y-%m-%d %H:%M:%f000', 'now', '+1 second') "
+                                       "WHERE artist_id = {}".format(artist["artist_id"]))
+
+        response = self.app.get(artist["uri"], headers={"If-None-Match": etag})
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.get_json()["name"] == "Cached Elsewhere UPDATED")
+        self.assertFalse(self.app.get(lookup_uri).get_json())
+
+        self.app.delete(artist["uri"])
+
+    def test_disabled_response_cache(self):
+        artist = self.app.post("{}/artists/new".format(self.url_prefix),
+                               headers={"Content-Type": "application/json"},
+                               data=json.dumps(dict(name="Never Cached"))).get_json()
+        response_cache.enabled = False
+        try:
+            response_cache.clear()
+            self.app.get(artist["uri"])
+            self.app.get("{}/artists?name=Never Cached".format(self.url_prefix))
+
+            self.assertFalse(len(response_cache.backend))
+        finally:
+            response_cache.enabled = True
+            self.app.delete(artist["uri"])
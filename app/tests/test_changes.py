@@ -0,0 +1,109 @@
+import json
+from unittest import TestCase
+
+from app import app
+from app.changes import head
+from app.database import db_session
+
+
+class TestChanges(TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.url_prefix = "/api/v1/resources"
+        self.since = head(db_session)
+        db_session.remove()
+        payload = json.dumps(dict(title="Changed Album",
+                                  upc="00000000000333",
+                                  artwork_file="https://cdn.coolcompany.io/test.jpg",
+                                  release_date="2021-01-01",
+                                  stores=["spotify"],
+                                  tracks=[dict(title="Changed Track",
+                                               version="Studio Edit",
+                                               explicit=False,
+                                               isrc="TEST000000333",
+                                               audio_file="https://cdn.coolcompany.io/test.wav",
+                                               artists=[dict(name="Changed Artist")])]))
+        self.album = self.app.post("{}/albums/new".format(self.url_prefix),
+                                   headers={"Content-Type": "application/json"}, data=payload).get_json()
+        self.track = self.album["tracks"][0]
+        self.artist = self.track["artists"][0]
+
+    def tearDown(self):
+        self.app.delete(self.album["uri"])
+        self.app.delete(self.track["uri"])
+        self.app.delete(self.artist["uri"])
+        db_session.remove()
+
+    def changes(self, since, query_string=""):
+        response = self.app.get("/api/v1/changes?since={}{}".format(since, query_string))
+        self.assertTrue(response.status_code == 200)
+        return response
+
+    def test_created_then_updated_then_deleted(self):
+        created = self.changes(self.since).get_json()
+
+        self.assertTrue({(c["type"], c["id"], c["operation"]) for c in created} == {
+            ("album", self.album["album_id"], "created"),
+            ("track", self.track["track_id"], "created"),
+            ("artist", self.artist["artist_id"], "created")})
+        self.assertTrue([c["seq"] for c in created] == sorted(c["seq"] for c in created))
+
+        self.app.put(self.track["uri"], headers={"Content-Type": "application/json"},
+                     data=json.dumps(dict(title="Changed Track Renamed")))
+        updated = self.changes(created[-1]["seq"]).get_json()
+
+        # The album shows the track, it changed as well
+        self.assertIn(("track", self.track["track_id"], "updated"), [(c["type"], c["id"], c["operation"])
+                                                                      for c in updated])
+        self.assertIn(("album", self.album["album_id"], "updated"), [(c["type"], c["id"], c["operation"])
+                                                                      for c in updated])
+
+        self.app.delete(self.album["uri"])
+        deleted = self.changes(updated[-1]["seq"]).get_json()
+
+        # Its track and artist stay, DELETE_ORPHANS is off
+        self.assertTrue({(c["type"], c["operation"]) for c in deleted} == {("album", "deleted")})
+
+    def test_nothing_new(self):
+        response = self.changes(self.since)
+        latest = response.headers["X-Change-Seq"]
+
+        self.assertTrue(int(latest) == response.get_json()[-1]["seq"])
+        self.assertTrue(self.changes(latest).get_json() == [])
+
+    def test_limit_and_ndjson(self):
+        lines = self.changes(self.since, "&limit=2&format=ndjson").get_data(as_text=True).splitlines()
+
+        self.assertTrue(len(lines) == 2)
+        self.assertTrue(json.loads(lines[0])["seq"] == self.since + 1)
+
+    def test_follow_with_limit(self):
+        expected = [c["seq"] for c in self.changes(self.since).get_json()]
+        followed = []
+        since = self.since
+        for _ in range(len(expected) + 1):
+            response = self.changes(since, "&limit=1")
+            page = response.get_json()
+            if not page:
+                break
+            followed.extend(c["seq"] for c in page)
+            since = int(response.headers["X-Change-Seq"])
+            self.assertTrue(since == page[-1]["seq"])
+
+        self.assertTrue(followed == expected)
+        self.assertTrue(len(expected) >= 3)
+
+    def test_invalid_arguments(self):
+        response = self.app.get("/api/v1/changes?limit=0")
+        self.assertTrue(response.status_code == 400)
+        self.assertTrue(response.get_json() == {"message": "limit must be at least 1"})
+
+        response = self.app.get("/api/v1/changes?since=abc")
+        self.assertTrue(response.status_code == 400)
+        self.assertIn("since", response.get_json()["message"])
+
+    def test_export_reports_where_to_start(self):
+        response = self.app.get("/api/v1/export/albums?format=ndjson")
+        response.get_data()
+
+        self.assertTrue(int(response.headers["X-Change-Seq"]) >= self.since + 3)
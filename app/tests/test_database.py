@@ -0,0 +1,68 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+from app.database import create_configured_engine
+from config import Config
+
+
+class TestDatabase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+        class TestConfig(Config):
+            DATABASE_URL = "sqlite:///{}".format(os.path.join(self.tmp_dir.name, "test.db"))
+            DATABASE_POOL_SIZE = 3
+            SQLITE_BUSY_TIMEOUT = 1234
+
+        self.config = TestConfig
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_sqlite_pragmas(self):
+        engine = create_configured_engine(self.config)
+        with engine.connect() as connection:
+            pragma = lambda name: connection.exec_driver_sql("PRAGMA {}".format(name)).scalar()
+
+            self.assertTrue(pragma("journal_mode") == "wal")
+            # NORMAL
+            self.assertTrue(pragma("synchronous") == 1)
+            self.assertTrue(pragma("busy_timeout") == 1234)
+            self.assertTrue(pragma("foreign_keys") == 1)
+        engine.dispose()
+
+    def test_sqlite_savepoints_nest(self):
+        engine = create_configured_engine(self.config)
+        with engine.begin() as connection:
+            connection.exec_driver_sql("CREATE TABLE items (name TEXT)")
+
+        with Session(engine) as session:
+            session.connection().exec_driver_sql("SELECT 1")
+            with session.begin_nested():
+                session.connection().exec_driver_sql("INSERT INTO items VALUES ('released')")
+            # Releasing the savepoint did not commit it
+            session.rollback()
+
+        with engine.connect() as connection:
+            self.assertTrue(connection.exec_driver_sql("SELECT COUNT(*) FROM items").scalar() == 0)
+        engine.dispose()
+
+    def test_pool(self):
+        engine = create_configured_engine(self.config)
+
+        self.assertTrue(isinstance(engine.pool, QueuePool))
+        self.assertTrue(engine.pool.size() == 3)
+        engine.dispose()
+
+    def test_in_memory_database_is_not_pooled(self):
+        class MemoryConfig(self.config):
+            DATABASE_URL = "sqlite://"
+
+        engine = create_configured_engine(MemoryConfig)
+
+        self.assertFalse(isinstance(engine.pool, QueuePool))
+        engine.dispose()
@@ -0,0 +1,108 @@
+import json
+from unittest import TestCase
+
+from app import app
+from app.database import db_session
+from app.filters import full_scans
+
+
+class TestFullScans(TestCase):
+    def test_full_scans(self):
+        self.assertFalse(full_scans(["SCAN tracks"], filtered=False))
+        self.assertTrue(full_scans(["SCAN tracks"], filtered=True) == ["SCAN tracks"])
+        self.assertFalse(full_scans(["SEARCH tracks USING INDEX ix_tracks_explicit (explicit=?)",
+                                     "SCAN albums USING INDEX ix_albums_release_date"], filtered=True))
+        self.assertTrue(full_scans(["SEARCH tracks USING INDEX ix_tracks_explicit (explicit=?)",
+                                    "USE TEMP B-TREE FOR ORDER BY"], filtered=False))
+
+
+class TestFilters(TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.url_prefix = "/api/v1/resources"
+        self.albums = [self.create_album("Filtered Album {}".format(i), "1971-0{}-01".format(i),
+                                         ["spotify"] if i % 2 else ["apple"], explicit=i % 2 == 0)
+                       for i in range(1, 5)]
+
+    def tearDown(self):
+        app.config["REFUSE_FULL_SCANS"] = False
+        for album in self.albums:
+            self.app.delete(album["uri"])
+            for track in album["tracks"]:
+                self.app.delete(track["uri"])
+        db_session.remove()
+
+    def create_album(self, title, release_date, stores, explicit):
+        payload = json.dumps(dict(title=title,
+                                  upc="00000000000777",
+                                  artwork_file="https://cdn.coolcompany.io/test.jpg",
+                                  release_date=release_date,
+                                  stores=stores,
+                                  tracks=[dict(title="{} Track".format(title),
+                                               version="Studio Edit",
+                                               explicit=explicit,
+                                               isrc="TEST000000777",
+                                               audio_file="https://cdn.coolcompany.io/test.wav",
+                                               artists=[dict(name="Filtered Artist")])]))
+        return self.app.post("{}/albums/new".format(self.url_prefix),
+                             headers={"Content-Type": "application/json"}, data=payload).get_json()
+
+    def get(self, url):
+        response = self.app.get("{}/{}".format(self.url_prefix, url))
+        self.assertTrue(response.status_code == 200, response.get_json())
+        return response.get_json()
+
+    def titles(self, url):
+        return [r["title"] for r in self.get(url)]
+
+    def test_filter_tracks(self):
+        explicit = self.titles("tracks/all?isrc=TEST000000777&explicit=true")
+        by_album = self.titles("tracks?album_id={}".format(self.albums[0]["album_id"]))
+        by_artist = self.get("tracks?artist_id={}".format(self.albums[0]["tracks"][0]["artists"][0]["artist_id"]))
+
+        self.assertTrue(explicit == ["Filtered Album 4 Track", "Filtered Album 2 Track"])
+        self.assertTrue(by_album == ["Filtered Album 1 Track"])
+        self.assertTrue(len(by_artist) == 4)
+
+    def test_filter_albums(self):
+        by_store = self.titles("albums?upc=00000000000777&store=spotify")
+        by_track = self.titles("albums?track_id={}".format(self.albums[1]["tracks"][0]["track_id"]))
+
+        self.assertTrue(by_store == ["Filtered Album 3", "Filtered Album 1"])
+        self.assertTrue(by_track == ["Filtered Album 2"])
+
+    def test_date_ranges(self):
+        # Ranges are sorted on the filtered column, latest first
+        self.assertTrue(self.titles("albums?release_date>=1971-03-01&release_date<=1971-12-31")
+                        == ["Filtered Album 4", "Filtered Album 3"])
+        self.assertTrue(self.titles("albums?release_date>1971-01-01&release_date<1971-03-01")
+                        == ["Filtered Album 2"])
+
+    def test_sort_and_paginate(self):
+        response = self.app.get("{}/albums?upc=00000000000777&sort=release_date&limit=3".format(self.url_prefix))
+        next_page = response.headers["Link"].split(";")[0].strip("<>")
+
+        self.assertTrue([a["title"] for a in response.get_json()]
+                        == ["Filtered Album 1", "Filtered Album 2", "Filtered Album 3"])
+        self.assertTrue(response.headers["X-Next-Cursor"]
+                        == "1971-03-01,{}".format(self.albums[2]["album_id"]))
+        self.assertTrue([a["title"] for a in self.app.get(next_page).get_json()] == ["Filtered Album 4"])
+        self.assertTrue(self.titles("albums?upc=00000000000777&sort=-release_date&limit=1") == ["Filtered Album 4"])
+
+    def test_invalid_filters(self):
+        for url in ("tracks/all?title=Filtered", "tracks/all?explicit=maybe", "albums/all?store=napster",
+                    "albums/all?upc>=1", "albums/all?sort=title", "albums/all?sort=release_date&after=yesterday"):
+            response = self.app.get("{}/{}".format(self.url_prefix, url))
+            self.assertTrue(response.status_code == 400, url)
+            self.assertIn("message", response.get_json())
+
+    def test_refuse_full_scans(self):
+        # Sorting the explicit tracks on their ISRC needs every explicit track
+        url = "{}/tracks/all?explicit=true&sort=isrc&limit={}"
+        self.assertTrue(self.app.get(url.format(self.url_prefix, 10)).status_code == 200)
+
+        app.config["REFUSE_FULL_SCANS"] = True
+
+        # Another page size, not to be answered from the response cache
+        self.assertTrue(self.app.get(url.format(self.url_prefix, 11)).status_code == 400)
+        self.assertTrue(self.app.get("{}/tracks/all?explicit=true".format(self.url_prefix)).status_code == 200)
@@ -0,0 +1,101 @@
+import datetime
+import json
+import uuid
+from unittest import TestCase
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import app
+from app.database import db_session, engine
+from app.models.all import Album, IdempotencyKey
+
+
+class TestIdempotency(TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.url_prefix = "/api/v1/resources"
+        self.key = str(uuid.uuid4())
+        self.created_uris = []
+
+    def tearDown(self):
+        for uri in self.created_uris:
+            self.app.delete(uri)
+        IdempotencyKey.query.filter_by(key=self.key).delete()
+        db_session.commit()
+        db_session.remove()
+
+    def post_album(self, title="Idempotent Album", key=None):
+        payload = json.dumps(dict(title=title,
+                                  upc="00000000000999",
+                                  artwork_file="https://cdn.coolcompany.io/test.jpg",
+                                  release_date="2021-01-01",
+                                  stores=["spotify"],
+                                  tracks=[dict(title="Idempotent Track",
+                                               version="Studio Edit",
+                                               explicit=False,
+                                               isrc="TEST000000999",
+                                               audio_file="https://cdn.coolcompany.io/test.wav",
+                                               artists=[dict(name="Idempotent Artist")])]))
+        response = self.app.post("{}/albums/new".format(self.url_prefix), data=payload,
+                                 headers={"Content-Type": "application/json", "Idempotency-Key": key or self.key})
+        if response.status_code == 201:
+            album = response.get_json()
+            self.created_uris.extend([album["uri"], album["tracks"][0]["uri"],
+                                      album["tracks"][0]["artists"][0]["uri"]])
+        return response
+
+    def test_retry_returns_the_stored_response(self):
+        first = self.post_album()
+        retry = self.post_album()
+
+        self.assertTrue(first.status_code == retry.status_code == 201)
+        self.assertTrue(retry.get_json() == first.get_json())
+        self.assertTrue(retry.headers["Idempotent-Replayed"] == "true")
+        self.assertNotIn("Idempotent-Replayed", first.headers)
+        self.assertTrue(Album.query.filter_by(title="Idempotent Album").count() == 1)
+
+    def test_key_reused_for_another_request(self):
+        self.post_album()
+
+        self.assertTrue(self.post_album(title="Another Album").status_code == 422)
+
+    def test_request_in_progress(self):
+        self.post_album()
+        # As if the first request had not finished yet
+        IdempotencyKey.query.filter_by(key=self.key).update(dict(status_code=None))
+        db_session.commit()
+
+        self.assertTrue(self.post_album().status_code == 409)
+
+    def test_expired_key_is_reused(self):
+        db_session.add(IdempotencyKey(key=self.key, fingerprint="expired", status_code=201, response="{}",
+                                      headers="{}", created_at=datetime.datetime(2000, 1, 1)))
+        db_session.commit()
+
+        response = self.post_album()
+
+        self.assertTrue(response.status_code == 201)
+        self.assertNotIn("Idempotent-Replayed", response.headers)
+
+    def test_failed_request_releases_key(self):
+        response = self.app.post("{}/bulk?async=true".format(self.url_prefix), data=json.dumps(dict(albums={})),
+                                 headers={"Content-Type": "application/json", "Idempotency-Key": self.key})
+
+        self.assertTrue(response.status_code == 400)
+        self.assertIsNone(IdempotencyKey.query.filter_by(key=self.key).first())
+
+    def test_key_released_by_a_concurrent_request(self):
+        # Another request holds the key, and releases it once this one failed to insert it
+        db_session.add(IdempotencyKey(key=self.key, fingerprint="concurrent"))
+        db_session.commit()
+
+        def release(session):
+            with engine.begin() as connection:
+                connection.execute(IdempotencyKey.__table__.delete().where(IdempotencyKey.key == self.key))
+        event.listen(Session, "after_rollback", release, once=True)
+
+        response = self.post_album()
+
+        self.assertTrue(response.status_code == 201)
+        self.assertTrue(IdempotencyKey.query.filter_by(key=self.key).one().status_code == 201)
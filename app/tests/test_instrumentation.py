@@ -0,0 +1,118 @@
+import json
+from unittest import TestCase
+
+from flask import g
+
+from app import app
+from app.cache import response_cache
+from app.database import db_session, engine
+from app.instrumentation import Histogram, NPlusOneError, RequestTimings, check_repeated_selects, \
+    instrument_engine, metrics, normalize_statement
+from app.models.all import Artist
+
+
+class TestHistogram(TestCase):
+    def test_render(self):
+        histogram = Histogram("test_seconds", "Test durations.", (0.1, 1.0))
+        histogram.observe(0.05, endpoint="albums", method="GET")
+        histogram.observe(0.5, endpoint="albums", method="GET")
+        histogram.observe(5, endpoint="albums", method="GET")
+
+        self.assertTrue(histogram.render() == [
+            '# HELP test_seconds Test durations.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{endpoint="albums",method="GET",le="0.1"} 1',
+            'test_seconds_bucket{endpoint="albums",method="GET",le="1.0"} 2',
+            'test_seconds_bucket{endpoint="albums",method="GET",le="+Inf"} 3',
+            'test_seconds_sum{endpoint="albums",method="GET"} 5.55',
+            'test_seconds_count{endpoint="albums",method="GET"} 3',
+        ])
+
+
+class TestInstrumentation(TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.url_prefix = "/api/v1/resources"
+        app.config["INSTRUMENTATION"] = True
+        instrument_engine(engine)
+        response_cache.clear()
+
+    def tearDown(self):
+        app.config["INSTRUMENTATION"] = False
+        db_session.remove()
+
+    def test_server_timing(self):
+        payload = json.dumps(dict(title="Timed Track", version="Studio Edit", explicit=False,
+                                  isrc="TEST000000001", audio_file="https://cdn.coolcompany.io/test.wav",
+                                  artists=[dict(name="Timed Artist")]))
+        track = self.app.post("{}/tracks/new".format(self.url_prefix),
+                              headers={"Content-Type": "application/json"}, data=payload).get_json()
+        count = metrics.statements.count(endpoint="track_ep", method="GET")
+
+        response = self.app.get(track["uri"])
+        timings = {t.split(";")[0]: t for t in response.headers["Server-Timing"].split(", ")}
+
+        self.assertTrue(set(timings) == {"db", "lazy", "serialize", "total"})
+        self.assertIn('desc="0 statements"', timings["lazy"])
+        self.assertNotIn('desc="0 statements"', timings["db"])
+        self.assertTrue(metrics.statements.count(endpoint="track_ep", method="GET") == count + 1)
+
+        self.app.delete(track["uri"])
+
+    def test_metrics(self):
+        self.app.get("{}/artists/all".format(self.url_prefix))
+        response = self.app.get("/metrics")
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.mimetype == "text/plain")
+        self.assertIn('music_service_api_request_duration_seconds_count{endpoint="artist_ep",method="GET"}',
+                      response.get_data(as_text=True))
+
+    def test_disabled(self):
+        app.config["INSTRUMENTATION"] = False
+
+        self.assertNotIn("Server-Timing", self.app.get("{}/artists/all".format(self.url_prefix)).headers)
+        self.assertTrue(self.app.get("/metrics").status_code == 404)
+
+
+class TestQueryDebugging(TestCase):
+    def setUp(self):
+        instrument_engine(engine)
+        self.context = app.test_request_context("/api/v1/resources/artists/all")
+        self.context.push()
+        g.request_timings = RequestTimings()
+
+    def tearDown(self):
+        app.config["SLOW_QUERY_MS"] = None
+        db_session.remove()
+        self.context.pop()
+
+    def test_normalize_statement(self):
+        self.assertTrue(normalize_statement("SELECT * FROM artists\nWHERE name = 'Pink' AND artist_id IN (?, ?, ?)")
+                        == "SELECT * FROM artists WHERE name = ? AND artist_id IN (?)")
+        self.assertTrue(normalize_statement("SELECT * FROM artists WHERE artist_id IN (?)")
+                        == normalize_statement("SELECT * FROM artists WHERE artist_id IN (?, ?)"))
+
+    def test_repeated_selects(self):
+        for artist_id in range(app.config["N_PLUS_ONE_THRESHOLD"] + 1):
+            db_session.query(Artist).filter(Artist.artist_id == artist_id).all()
+
+        with self.assertLogs("app.instrumentation", "WARNING"), self.assertRaises(NPlusOneError):
+            check_repeated_selects(g.request_timings)
+
+    def test_selects_repeated_in_separate_transactions(self):
+        # Like the artist lookup of every chunk of a bulk request
+        for artist_id in range(app.config["N_PLUS_ONE_THRESHOLD"] + 1):
+            db_session.query(Artist).filter(Artist.artist_id == artist_id).all()
+            db_session.commit()
+
+        check_repeated_selects(g.request_timings)
+
+    def test_slow_query(self):
+        app.config["SLOW_QUERY_MS"] = 0
+
+        with self.assertLogs("app.instrumentation", "WARNING") as logs:
+            db_session.query(Artist).filter(Artist.name == "Slow Artist").all()
+
+        self.assertIn("/api/v1/resources/artists/all", logs.output[0])
+        self.assertIn("Slow Artist", logs.output[0])
@@ -0,0 +1,156 @@
+import datetime
+import json
+import threading
+import time
+from unittest import TestCase
+
+from flask import has_app_context, has_request_context
+
+from app import app
+from app.database import db_session
+from app.jobs import job_queue, main
+from app.models.all import Job, JobItem, JobStatus
+
+
+class TestJobs(TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.url_prefix = "/api/v1/resources"
+        self.created_uris = []
+
+    def tearDown(self):
+        for uri in self.created_uris:
+            self.app.delete(uri)
+        db_session.remove()
+
+    @classmethod
+    def tearDownClass(cls):
+        # Idle workers would look for jobs while other tests count statements
+        job_queue.stop()
+
+    @staticmethod
+    def album(title, track_count=2):
+        return dict(title=title,
+                    upc="00000000000888",
+                    artwork_file="https://cdn.coolcompany.io/test.jpg",
+                    release_date="2021-01-01",
+                    stores=["spotify"],
+                    tracks=[dict(title="{} Track {}".format(title, i),
+                                 version="Studio Edit",
+                                 explicit=False,
+                                 isrc="TEST000000888",
+                                 audio_file="https://cdn.coolcompany.io/test.wav",
+                                 artists=[dict(name="Job Artist")]) for i in range(track_count)])
+
+    def post(self, url, payload):
+        response = self.app.post(url, headers={"Content-Type": "application/json"}, data=json.dumps(payload))
+        self.assertTrue(response.status_code == 202, response.get_json())
+        self.assertTrue(response.headers["Location"] == response.get_json()["uri"])
+        return response.get_json()
+
+    def wait_for(self, job_uri, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status = self.app.get(job_uri).get_json()
+            if status["status"] in ("done", "failed"):
+                for results in status["results"].values():
+                    self.created_uris.extend(r["uri"] for r in results if "uri" in r)
+                return status
+            time.sleep(0.05)
+        self.fail("Job {} did not finish".format(job_uri))
+
+    def test_async_bulk(self):
+        albums = [self.album("Async Album {}".format(i)) for i in range(3)]
+        albums[1]["release_date"] = "not a date"
+        accepted = self.post("{}/bulk?async=true&chunk_size=2".format(self.url_prefix), dict(albums=albums))
+
+        self.assertTrue(accepted["total"] == 3)
+        self.assertIn(accepted["status"], ("queued", "running", "done"))
+
+        status = self.wait_for(accepted["uri"])
+
+        self.assertTrue(status["status"] == "done", status)
+        self.assertTrue((status["processed"], status["created"], status["failed"]) == (3, 2, 1))
+        self.assertTrue([r["status"] for r in status["results"]["albums"]] == ["created", "failed", "created"])
+        self.assertIn("ValueError", status["results"]["albums"][1]["error"])
+        album = self.app.get(status["results"]["albums"][2]["uri"]).get_json()
+        self.assertTrue(album["title"] == "Async Album 2")
+        self.assertTrue(len(album["tracks"]) == 2)
+        self.assertNotIn("results", self.app.get(accepted["uri"] + "?results=false").get_json())
+
+    def test_async_album(self):
+        accepted = self.post("{}/albums/new?async=true".format(self.url_prefix), self.album("Async Single"))
+        status = self.wait_for(accepted["uri"])
+
+        self.assertTrue(status["status"] == "done", status)
+        self.assertTrue(self.app.get(status["results"]["albums"][0]["uri"]).get_json()["title"] == "Async Single")
+
+    def test_unknown_job(self):
+        self.assertTrue(self.app.get("/api/v1/jobs/0").status_code == 404)
+
+    def test_invalid_payload(self):
+        response = self.app.post("{}/bulk?async=true".format(self.url_prefix),
+                                 headers={"Content-Type": "application/json"}, data=json.dumps(dict(albums={})))
+        self.assertTrue(response.status_code == 400)
+
+    def test_lost_job_resumes(self):
+        # Claimed and run here rather than by the workers
+        job_queue.stop()
+        # A job whose worker stopped after committing the first of its two albums
+        stale = datetime.datetime.utcnow() - datetime.timedelta(seconds=app.config["JOB_STALE_AFTER"] + 1)
+        job = Job(kind="ingest", status=JobStatus.running, chunk_size=1, total=2, updated_at=stale,
+                  payload=json.dumps(dict(albums=[self.album("Lost Album 0"), self.album("Lost Album 1")])))
+        db_session.add(job)
+        db_session.flush()
+        db_session.add(JobItem(job_id=job.job_id, resource="albums", item_index=0, status="created"))
+        db_session.commit()
+        job_id = job.job_id
+
+        self.assertTrue(job_queue.claim() == job_id)
+        self.assertIsNone(job_queue.claim())
+
+        job_queue.run(job_id)
+        status = self.wait_for("/api/v1/jobs/{}".format(job_id))
+
+        self.assertTrue(status["status"] == "done", status)
+        self.assertTrue([r["index"] for r in status["results"]["albums"]] == [0, 1])
+        self.assertTrue(self.app.get(status["results"]["albums"][1]["uri"]).get_json()["title"] == "Lost Album 1")
+
+    def test_handlers_get_the_job_arguments(self):
+        job_queue.stop()
+        calls = []
+
+        @job_queue.handler("probe")
+        def probe(job, payload, chunk_size):
+            calls.append((job.kind, payload, chunk_size, has_app_context(), has_request_context()))
+
+        job = Job(kind="probe", status=JobStatus.running, chunk_size=3, total=1, payload=json.dumps(dict(n=1)))
+        db_session.add(job)
+        db_session.commit()
+        job_id = job.job_id
+        db_session.remove()
+
+        job_queue.run(job_id)
+
+        # Run outside of any request, like the worker threads do
+        self.assertTrue(calls == [("probe", dict(n=1), 3, True, False)])
+        self.assertTrue(db_session.get(Job, job_id).status == JobStatus.done)
+        db_session.delete(db_session.get(Job, job_id))
+        db_session.commit()
+
+    def test_main_starts_the_workers_asked_for(self):
+        job_queue.stop()
+        runner = threading.Thread(target=main, args=(["--workers", "3"],), daemon=True)
+        runner.start()
+        try:
+            deadline = time.monotonic() + 5
+            workers = []
+            while len(workers) < 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+                workers = [t for t in threading.enumerate() if t.name.startswith("job-worker-")]
+
+            self.assertTrue(len(workers) == 3, workers)
+        finally:
+            job_queue.stop()
+            runner.join(timeout=10)
+        self.assertFalse(runner.is_alive())
@@ -0,0 +1,121 @@
+import json
+from unittest import TestCase
+
+from app import app
+from app.database import db_session, engine
+from app.models.all import Artist, Track, Album, ArtistToTrackAssociation, TrackToAlbumAssociation
+from app.orphans import collect_garbage
+
+
+class TestCascadingDeletes(TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.url_prefix = "/api/v1/resources"
+        self.created_uris = []
+
+    def tearDown(self):
+        app.config["DELETE_ORPHANS"] = False
+        for uri in self.created_uris:
+            self.app.delete(uri)
+        db_session.remove()
+
+    def post(self, resource, payload):
+        response = self.app.post("{}/{}/new".format(self.url_prefix, resource),
+                                 headers={"Content-Type": "application/json"}, data=json.dumps(payload))
+        self.assertTrue(response.status_code == 201)
+        created = response.get_json()
+        self.created_uris.append(created["uri"])
+        for track in created.get("tracks", [created]):
+            self.created_uris.append(track["uri"])
+            self.created_uris.extend(a["uri"] for a in track.get("artists", []))
+        return created
+
+    @staticmethod
+    def track(title, *artist_names):
+        return dict(title=title, version="Studio Edit", explicit=False, isrc="TEST000000666",
+                    audio_file="https://cdn.coolcompany.io/test.wav", artists=[dict(name=n) for n in artist_names])
+
+    def album(self, *tracks):
+        return self.post("albums", dict(title="Cascade Album", upc="00000000000666",
+                                        artwork_file="https://cdn.coolcompany.io/test.jpg",
+                                        release_date="2021-01-01", stores=["spotify"], tracks=list(tracks)))
+
+    @staticmethod
+    def exists(model, id_column, resource_id):
+        db_session.remove()
+        return model.query.filter(id_column == resource_id).count() == 1
+
+    def test_delete_album_deletes_its_orphans(self):
+        app.config["DELETE_ORPHANS"] = True
+        album = self.album(self.track("Cascade Track 1", "Cascade Solo", "Cascade Shared"),
+                           self.track("Cascade Track 2", "Cascade Shared"))
+        artists = {a["name"]: a for a in album["tracks"][0]["artists"]}
+        solo, shared = artists["Cascade Solo"], artists["Cascade Shared"]
+        # The shared artist is credited on a track of no album as well
+        single = self.post("tracks", self.track("Cascade Single", "Cascade Shared"))
+        self.assertTrue(single["artists"][0]["artist_id"] == shared["artist_id"])
+
+        self.assertTrue(self.app.delete(album["uri"]).status_code == 204)
+
+        for track in album["tracks"]:
+            self.assertFalse(self.exists(Track, Track.track_id, track["track_id"]))
+        self.assertFalse(self.exists(Artist, Artist.artist_id, solo["artist_id"]))
+        self.assertTrue(self.exists(Artist, Artist.artist_id, shared["artist_id"]))
+        self.assertFalse(TrackToAlbumAssociation.query.filter_by(album_id=album["album_id"]).count())
+
+    def test_delete_track_removes_it_from_its_album(self):
+        app.config["DELETE_ORPHANS"] = True
+        album = self.album(self.track("Cascade Track 1", "Cascade Artist 1"),
+                           self.track("Cascade Track 2", "Cascade Artist 2"))
+        # Cache the album with both tracks
+        self.app.get(album["uri"])
+
+        self.app.delete(album["tracks"][0]["uri"])
+
+        tracks = self.app.get(album["uri"]).get_json()["tracks"]
+        self.assertTrue([t["title"] for t in tracks] == ["Cascade Track 2"])
+        self.assertFalse(TrackToAlbumAssociation.query.filter_by(track_id=album["tracks"][0]["track_id"]).count())
+        self.assertFalse(self.exists(Artist, Artist.artist_id, album["tracks"][0]["artists"][0]["artist_id"]))
+
+    def test_delete_artist(self):
+        app.config["DELETE_ORPHANS"] = True
+        single = self.post("tracks", self.track("Cascade Single", "Cascade Artist"))
+        album = self.album(self.track("Cascade Track", "Cascade Artist"))
+
+        self.app.delete(single["artists"][0]["uri"])
+
+        # Left with no artist and on no album, the single is gone, the album keeps its track
+        self.assertFalse(self.exists(Track, Track.track_id, single["track_id"]))
+        self.assertTrue(self.exists(Track, Track.track_id, album["tracks"][0]["track_id"]))
+        self.assertTrue(self.exists(Album, Album.album_id, album["album_id"]))
+
+    def test_delete_keeps_orphans_by_default(self):
+        artist = self.post("artists", dict(name="Cascade Standalone"))
+        single = self.post("tracks", self.track("Cascade Single", "Cascade Standalone"))
+        self.assertTrue(single["artists"][0]["artist_id"] == artist["artist_id"])
+
+        self.assertTrue(self.app.delete(single["uri"]).status_code == 204)
+
+        self.assertFalse(self.exists(Track, Track.track_id, single["track_id"]))
+        self.assertTrue(self.exists(Artist, Artist.artist_id, artist["artist_id"]))
+        self.assertFalse(ArtistToTrackAssociation.query.filter_by(track_id=single["track_id"]).count())
+
+    def test_collect_garbage(self):
+        album = self.album(self.track("Garbage Track 1", "Garbage Artist"),
+                           self.track("Garbage Track 2", "Garbage Artist"))
+        # Orphans left behind by the deletes of earlier versions
+        with engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            try:
+                connection.exec_driver_sql("DELETE FROM tracks WHERE track_id IN ({}, {})".format(
+                    *[t["track_id"] for t in album["tracks"]]))
+            finally:
+                connection.exec_driver_sql("PRAGMA foreign_keys=ON")
+
+        counts = collect_garbage(chunk_size=1)
+
+        self.assertTrue(counts["assoc_artist_to_track"] >= 2)
+        self.assertTrue(counts["assoc_track_to_album"] >= 2)
+        self.assertFalse(ArtistToTrackAssociation.query.filter(
+            ArtistToTrackAssociation.track_id.in_([t["track_id"] for t in album["tracks"]])).count())
+        self.assertTrue(collect_garbage()["assoc_track_to_album"] == 0)
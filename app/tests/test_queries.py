@@ -0,0 +1,153 @@
+import json
+from contextlib import contextmanager
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from app import app
+from app.database import db_session, engine
+
+
+@contextmanager
+def count_statements():
+    """
+    Collect the SQL statements run on the engine inside the block.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+class TestQueries(TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.url_prefix = "/api/v1/resources"
+        self.created_uris = []
+
+    def tearDown(self):
+        # The test database is shared with the route tests, so remove everything created here
+        for uri in self.created_uris:
+            self.app.delete(uri)
+        db_session.remove()
+
+    def test_get_one_album_statement_count(self):
+        album_uri = self.create_album_with_tracks(50)
+
+        # Start from an empty identity map so that nothing is served from the session
+        db_session.remove()
+        with count_statements() as statements:
+            response = self.app.get(album_uri)
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(len(response.get_json()["tracks"]) == 50)
+        # The changes to drop from the cache, the album version for the ETag, the album, then its tracks,
+        # the tracks' artists and its stores
+        self.assertTrue(len(statements) <= 6, statements)
+        # Association tables are never joined in as a nested join, which SQLite runs as a full scan
+        self.assertFalse([s for s in statements if "JOIN (" in s], statements)
+
+    def test_get_one_album_sparse_statements(self):
+        album_uri = self.create_album_with_tracks(5)
+
+        db_session.remove()
+        with count_statements() as statements:
+            response = self.app.get("{}?fields=album_id,title".format(album_uri))
+
+        self.assertTrue(response.status_code == 200)
+        # The changes to drop from the cache, the album version for the ETag, then only the selected
+        # album columns
+        self.assertTrue(len(statements) == 3, statements)
+        self.assertNotIn("albums.upc", statements[-1])
+        self.assertNotIn("tracks", statements[-1])
+
+    def test_get_all_albums_statement_count(self):
+        self.create_album_with_tracks(50)
+        self.create_album_with_tracks(50)
+
+        db_session.remove()
+        with count_statements() as statements:
+            response = self.app.get('{}/albums/all?limit=2'.format(self.url_prefix))
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(len(response.get_json()) == 2)
+        # The changes to drop from the cache, then albums, stores, tracks and the tracks' artists,
+        # regardless of the number of albums and tracks
+        self.assertTrue(len(statements) <= 5, statements)
+
+    def test_get_all_albums_does_not_lazy_load_tracks(self):
+        threshold = app.config["N_PLUS_ONE_THRESHOLD"]
+        for i in range(threshold + 1):
+            self.create_album_with_tracks(1)
+
+        db_session.remove()
+        # N_PLUS_ONE_RAISE is on for the tests, loading the tracks album by album raises NPlusOneError
+        response = self.app.get('{}/albums/all?limit={}'.format(self.url_prefix, threshold + 1))
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(all(a["tracks"] for a in response.get_json()))
+
+    def test_create_album_does_not_look_up_stores(self):
+        # Stores are resolved from the store cache once it is filled
+        self.create_album_with_tracks(1)
+        with count_statements() as statements:
+            self.create_album_with_tracks(1)
+
+        self.assertFalse([s for s in statements if "FROM stores" in s or "INTO stores" in s], statements)
+
+    def test_create_album_looks_up_artists_once(self):
+        with count_statements() as statements:
+            album_uri = self.create_album_with_tracks(50)
+
+        # One lookup, one INSERT of the missing artists and one read back
+        self.assertTrue(len([s for s in statements if "FROM artists" in s]) == 2, statements)
+        self.assertTrue(len([s for s in statements if "INTO artists" in s]) == 1, statements)
+
+        # The artist credited on every track is only created once
+        response = self.app.get(album_uri)
+        artist_ids = {a["artist_id"] for t in response.get_json()["tracks"] for a in t["artists"]}
+        self.assertTrue(len(artist_ids) == 51)
+
+    def test_lookups_use_indexes(self):
+        for statement in ("SELECT * FROM tracks WHERE isrc = 'TEST000000001'",
+                          "SELECT * FROM albums WHERE upc = '00000000000111'",
+                          "SELECT * FROM artists WHERE name = 'Pink'",
+                          "SELECT * FROM assoc_artist_to_track WHERE track_id = 1",
+                          "SELECT * FROM assoc_track_to_album WHERE album_id = 1",
+                          "SELECT * FROM assoc_album_to_stores WHERE store_id = 1"):
+            with engine.connect() as connection:
+                plan = " ".join(row[-1] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement))
+            self.assertIn("USING", plan, statement)
+            self.assertNotIn("SCAN", plan, statement)
+
+    def create_album_with_tracks(self, track_count):
+        payload = json.dumps(dict(
+            title="Statement Count Album",
+            upc="00000000000222",
+            artwork_file="https://cdn.coolcompany.io/test.jpg",
+            release_date="2021-01-01",
+            stores=["spotify", "apple"],
+            tracks=[dict(title="Statement Count Track {}".format(i),
+                         version="Studio Edit",
+                         explicit=False,
+                         isrc="TEST{:09d}".format(i),
+                         audio_file="https://cdn.coolcompany.io/test.wav",
+                         artists=[dict(name="Statement Count Artist"),
+                                  dict(name="Statement Count Artist {}".format(i))]) for i in range(track_count)],
+        ))
+        response = self.app.post("{}/albums/new".format(self.url_prefix),
+                                 headers={"Content-Type": "application/json"},
+                                 data=payload)
+        self.assertTrue(response.status_code == 201)
+        response_json = response.get_json()
+        self.created_uris.append(response_json["uri"])
+        for track in response_json["tracks"]:
+            self.created_uris.append(track["uri"])
+            self.created_uris.extend(a["uri"] for a in track["artists"] if a["uri"] not in self.created_uris)
+        return response_json["uri"]
@@ -0,0 +1,78 @@
+import json
+import os
+import sqlite3
+import tempfile
+from unittest import TestCase
+
+from app import app
+from app.database import db_session, engine, create_configured_engine
+from app.replicas import replica_router
+from config import app_config, config_name
+
+
+class TestReplicas(TestCase):
+    def setUp(self):
+        # A copy of the database standing in for a replica that has not caught up with what comes next
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp_dir.name, "replica.db")
+        primary = engine.raw_connection()
+        try:
+            replica = sqlite3.connect(path)
+            primary.connection.backup(replica)
+            replica.close()
+        finally:
+            primary.close()
+        self.replica = create_configured_engine(app_config[config_name], "sqlite:///{}".format(path))
+        replica_router.replicas.append(self.replica)
+
+        self.writer = app.test_client()
+        self.reader = app.test_client()
+        self.reader.environ_base["REMOTE_ADDR"] = "192.0.2.1"
+        self.created_uris = []
+
+    def tearDown(self):
+        replica_router.replicas.remove(self.replica)
+        for uri in self.created_uris:
+            self.writer.delete(uri)
+        db_session.remove()
+        self.replica.dispose()
+        self.tmp_dir.cleanup()
+
+    def create_artist(self, name):
+        response = self.writer.post("/api/v1/resources/artists/new", headers={"Content-Type": "application/json"},
+                                    data=json.dumps(dict(name=name)))
+        self.assertTrue(response.status_code == 201)
+        artist = response.get_json()
+        self.created_uris.append(artist["uri"])
+        return artist
+
+    def find(self, client, name):
+        response = client.get("/api/v1/resources/artists/all?name={}".format(name))
+        self.assertTrue(response.status_code == 200)
+        return [a["name"] for a in response.get_json()]
+
+    def test_reads_go_to_the_replica(self):
+        self.create_artist("Replica Artist")
+
+        # The replica was copied before the artist was created
+        self.assertTrue(self.find(self.reader, "Replica Artist") == [])
+
+    def test_writer_reads_its_writes(self):
+        self.create_artist("Sticky Artist")
+
+        self.assertTrue(self.find(self.writer, "Sticky Artist") == ["Sticky Artist"])
+
+    def test_replica_reads_are_not_cached(self):
+        self.create_artist("Uncached Artist")
+
+        self.assertTrue(self.find(self.reader, "Uncached Artist") == [])
+        self.assertTrue(self.find(self.writer, "Uncached Artist") == ["Uncached Artist"])
+
+    def test_without_replicas_reads_stay_on_the_primary(self):
+        replica_router.replicas.remove(self.replica)
+        try:
+            self.create_artist("Primary Artist")
+
+            self.assertTrue(self.find(self.reader, "Primary Artist") == ["Primary Artist"])
+        finally:
+            replica_router.replicas.append(self.replica)
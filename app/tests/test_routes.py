@@ -3,7 +3,7 @@ from unittest import TestCase
 
 from app import app
 from app.database import db_session
-from app.models.all import Store, StoreEnum
+from app.models.all import Store, StoreEnum, Track
 
 
 class TestRoutes(TestCase):
@@ -18,8 +18,9 @@ class TestRoutes(TestCase):
     # Artists #
     ###########
     def test_create_artist(self):
-        response = self.create_artist("Pink")
+        response = self.create_artist("Test Create Artist")
         response_json = response.get_json()
+        self.app.delete(response_json["uri"])
 
         self.assertTrue(response.status_code == 201)
         self.assertTrue(response.is_json)
@@ -32,6 +33,32 @@ class TestRoutes(TestCase):
         self.assertIsNone(response_json["status"])
         self.assertIsNone(response_json["error"])
 
+    def test_create_existing_artist(self):
+        created = self.create_artist("Test Existing Artist")
+        response = self.create_artist("Test Existing Artist")
+        self.app.delete(created.get_json()["uri"])
+
+        # Artists are unique by name, the existing one is returned
+        self.assertTrue(created.status_code == 201)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.get_json()["artist_id"] == created.get_json()["artist_id"])
+
+    def test_rename_artist_to_existing_name(self):
+        first = self.create_artist("Test Renamed Artist 1").get_json()
+        second = self.create_artist("Test Renamed Artist 2").get_json()
+        response = self.app.put(second["uri"], headers={"Content-Type": "application/json"},
+                                data=json.dumps(dict(name="Test Renamed Artist 1")))
+        self.app.delete(first["uri"])
+        self.app.delete(second["uri"])
+
+        self.assertTrue(response.status_code == 409)
+
+    def test_create_artist_without_name(self):
+        response = self.app.post("{}/artists/new".format(self.url_prefix),
+                                 headers={"Content-Type": "application/json"}, data=json.dumps(dict()))
+
+        self.assertTrue(response.status_code == 400)
+
     def test_get_one_artist(self):
         artist_name = "Test Get 1 Artist"
         response = self.create_artist(artist_name)
@@ -57,6 +84,16 @@ class TestRoutes(TestCase):
         self.assertTrue(response.is_json)
         self.assertTrue(type(response_json) == list)
 
+    def test_lookup_artists_by_name(self):
+        self.create_artist("Test Lookup Artist")
+
+        response = self.app.get('{}/artists?name=Test Lookup Artist'.format(self.url_prefix))
+        response_json = response.get_json()
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(len(response_json))
+        self.assertTrue(all(a["name"] == "Test Lookup Artist" for a in response_json))
+
     def test_update_artists(self):
         response = self.app.get('{}/artists/all'.format(self.url_prefix))
         response_json = response.get_json()
@@ -87,11 +124,8 @@ class TestRoutes(TestCase):
         self.assertTrue(response.status_code == 201)
         self.assertTrue(response.is_json)
 
-        response = self.app.get('{}/artists/all'.format(self.url_prefix))
-        response_json = response.get_json()
-
-        # Delete artists one by one
-        for a in response_json:
+        # Delete artists one by one, from every page
+        for a in self.get_all("artists"):
             self.pp(a)
             response = self.app.delete(a['uri'])
             self.assertTrue(response.status_code == 204)
@@ -123,6 +157,13 @@ class TestRoutes(TestCase):
         self.assertIsNone(response_json["status"])
         self.assertIsNone(response_json["error"])
 
+    def test_create_track_with_nameless_artist(self):
+        response = self.create_track("Cover Me In Sunshine", "Studio Edit", False, "TEST000000001",
+                                     "https://cdn.coolcompany.io/test.wav", [dict(name="Pink"), dict()])
+
+        self.assertTrue(response.status_code == 400)
+        self.assertTrue(response.get_json()["message"] == "Artists need a name")
+
     def test_get_one_track(self):
         new_track = dict(title="Cover Me In Sunshine", version="Studio Edit", explicit=False, isrc="TEST000000001",
                          audio_file="https://cdn.coolcompany.io/test.wav", artists=[dict(name="Pink")])
@@ -159,6 +200,81 @@ class TestRoutes(TestCase):
         self.assertTrue(response.is_json)
         self.assertTrue(type(response_json) == list)
 
+    def test_create_tracks_reuses_artists(self):
+        artists = [dict(name="Test Reused Artist")]
+        first = self.create_track("Reused Artist Track 1", "Studio Edit", False, "TEST000000001",
+                                  "https://cdn.coolcompany.io/test.wav", artists).get_json()
+        second = self.create_track("Reused Artist Track 2", "Studio Edit", False, "TEST000000002",
+                                   "https://cdn.coolcompany.io/test.wav", artists).get_json()
+
+        self.assertTrue(first["artists"][0]["artist_id"] == second["artists"][0]["artist_id"])
+
+    def test_export_tracks(self):
+        self.create_track("Exported Track", "Studio Edit", False, "TEST000000001",
+                          "https://cdn.coolcompany.io/test.wav", [dict(name="Pink")])
+
+        response = self.app.get('/api/v1/export/tracks')
+        response_json = response.get_json()
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.is_json)
+        self.assertTrue(type(response_json) == list)
+        self.assertTrue(len(response_json))
+        # Exports are in catalog order
+        track_ids = [t["track_id"] for t in response_json]
+        self.assertTrue(track_ids == sorted(track_ids))
+
+        response = self.app.get('/api/v1/export/tracks?format=ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.mimetype == "application/x-ndjson")
+        self.assertTrue([json.loads(line) for line in lines] == response_json)
+
+    def test_export_unknown_resource(self):
+        response = self.app.get('/api/v1/export/unknown')
+
+        self.assertTrue(response.status_code == 404)
+        self.assertIn("Unknown resource 'unknown'", response.get_json()["message"])
+
+    def test_get_all_tracks_paginated(self):
+        # Create at least three tracks so that there is more than one page
+        for i in range(3):
+            self.create_track("Paginated Track {}".format(i), "Studio Edit", False, "TEST00000000{}".format(i),
+                              "https://cdn.coolcompany.io/test.wav", [dict(name="Pink")])
+
+        response = self.app.get('{}/tracks/all?limit=2'.format(self.url_prefix))
+        first_page = response.get_json()
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(len(first_page) == 2)
+        self.assertIn("X-Next-Cursor", response.headers)
+        self.assertIn('rel="next"', response.headers["Link"])
+        next_cursor = int(response.headers["X-Next-Cursor"])
+        self.assertTrue(next_cursor == first_page[-1]["track_id"])
+
+        # Follow the cursor and check that the next page continues where the first one ended
+        response = self.app.get('{}/tracks/all?limit=2&after={}'.format(self.url_prefix, next_cursor))
+        second_page = response.get_json()
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(len(second_page))
+        self.assertTrue(all(t["track_id"] < next_cursor for t in second_page))
+
+    def test_lookup_tracks_by_isrc(self):
+        self.create_track("Lookup Track", "Studio Edit", False, "TESTLOOKUP01",
+                          "https://cdn.coolcompany.io/test.wav", [dict(name="Pink")])
+
+        response = self.app.get('{}/tracks?isrc=TESTLOOKUP01'.format(self.url_prefix))
+        response_json = response.get_json()
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(len(response_json))
+        self.assertTrue(all(t["isrc"] == "TESTLOOKUP01" for t in response_json))
+
+        response = self.app.get('{}/tracks?isrc=NOSUCHISRC'.format(self.url_prefix))
+        self.assertTrue(response.get_json() == [])
+
     def test_update_tracks(self):
         # Create at least one new track first
         response = self.create_track("Cover Me In Sunshine TEST", "Studio Edit", False, "TEST000000001",
@@ -194,11 +310,8 @@ class TestRoutes(TestCase):
         self.assertTrue(response.status_code == 201)
         self.assertTrue(response.is_json)
 
-        response = self.app.get('{}/tracks/all'.format(self.url_prefix))
-        response_json = response.get_json()
-
-        # Delete tracks one by one
-        for a in response_json:
+        # Delete tracks one by one, from every page
+        for a in self.get_all("tracks"):
             self.pp(a)
             response = self.app.delete(a['uri'])
             self.assertTrue(response.status_code == 204)
@@ -254,6 +367,13 @@ class TestRoutes(TestCase):
         self.assertIsNone(response_json["status"])
         self.assertIsNone(response_json["error"])
 
+    def test_create_album_with_unknown_store(self):
+        response = self.create_album("Sample Album", "00000000000111", "https://cdn.coolcompany.io/test.jpg",
+                                     "2021-01-01", ["apple", "unknown"], [])
+
+        self.assertTrue(response.status_code == 400)
+        self.assertTrue(response.get_json()["message"] == "Unknown store 'unknown'")
+
     def test_get_one_album(self):
         new_album = dict(title="Cover Me In Sunshine",
                          upc="00000000000111",
@@ -303,6 +423,41 @@ class TestRoutes(TestCase):
         self.assertTrue(response.is_json)
         self.assertTrue(response_json == new_album)
 
+    def test_get_one_album_sparse(self):
+        response = self.create_album("Sparse Album", "00000000000111", "https://cdn.coolcompany.io/test.jpg",
+                                     "2021-01-01", ["spotify"],
+                                     [dict(title="Sparse Track", version="Studio Edit", explicit=False,
+                                           isrc="TEST000000001", audio_file="https://cdn.coolcompany.io/test.wav",
+                                           artists=[dict(name="Pink")])])
+        album_uri = response.get_json()["uri"]
+
+        response = self.app.get("{}?fields=title,tracks.title,tracks.artists.name".format(album_uri))
+        response_json = response.get_json()
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response_json == dict(title="Sparse Album",
+                                              tracks=[dict(title="Sparse Track", artists=[dict(name="Pink")])]))
+
+        # Relationships that are not expanded are left out
+        response = self.app.get("{}?expand=stores".format(album_uri))
+        response_json = response.get_json()
+
+        self.assertTrue(response.status_code == 200)
+        self.assertIn("stores", response_json)
+        self.assertIn("upc", response_json)
+        self.assertNotIn("tracks", response_json)
+
+        response = self.app.get("{}?fields=title,tracks&expand=tracks".format(album_uri))
+        response_json = response.get_json()
+        self.assertTrue(list(response_json) == ["title", "tracks"])
+        self.assertNotIn("artists", response_json["tracks"][0])
+
+    def test_get_missing_album_sparse(self):
+        for query_string in ("", "?fields=title", "?expand=stores"):
+            response = self.app.get("{}/albums/999999999{}".format(self.url_prefix, query_string))
+
+            self.assertIn("not found", response.get_json()["error"], query_string)
+
     def test_get_all_albums(self):
         response = self.app.get('{}/albums/all'.format(self.url_prefix))
         response_json = response.get_json()
@@ -313,6 +468,17 @@ class TestRoutes(TestCase):
         self.assertTrue(response.is_json)
         self.assertTrue(type(response_json) == list)
 
+    def test_lookup_albums_by_upc(self):
+        self.create_album("Lookup Album", "00000000000333", "https://cdn.coolcompany.io/test.jpg", "2021-01-01",
+                          ["spotify"], [])
+
+        response = self.app.get('{}/albums?upc=00000000000333'.format(self.url_prefix))
+        response_json = response.get_json()
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(len(response_json))
+        self.assertTrue(all(a["upc"] == "00000000000333" for a in response_json))
+
     def test_update_albums(self):
         # Create at least one new album first
         new_album = dict(title="Cover Me In Sunshine",
@@ -398,11 +564,8 @@ class TestRoutes(TestCase):
         self.assertTrue(response.status_code == 201)
         self.assertTrue(response.is_json)
 
-        response = self.app.get('{}/albums/all'.format(self.url_prefix))
-        response_json = response.get_json()
-
-        # Delete albums one by one
-        for a in response_json:
+        # Delete albums one by one, from every page
+        for a in self.get_all("albums"):
             self.pp(a)
             response = self.app.delete(a['uri'])
             self.assertTrue(response.status_code == 204)
@@ -412,6 +575,88 @@ class TestRoutes(TestCase):
         response_json = response.get_json()
         self.assertFalse(len(response_json))
 
+    ########
+    # Bulk #
+    ########
+    def test_bulk_create(self):
+        track = dict(title="Bulk Track", version="Studio Edit", explicit=False, isrc="TEST000000001",
+                     audio_file="https://cdn.coolcompany.io/test.wav", artists=[dict(name="Pink")])
+        album = dict(title="Bulk Album", upc="00000000000111", artwork_file="https://cdn.coolcompany.io/test.jpg",
+                     release_date="2021-01-01", stores=["spotify", "apple"], tracks=[track, track])
+        payload = json.dumps(dict(
+            artists=[dict(name="Bulk Artist 1"), dict(name="Bulk Artist 2")],
+            tracks=[track],
+            albums=[album, dict(album, release_date="not a date"), dict(album, stores=["unknown"]), album],
+        ))
+        response = self.app.post("{}/bulk?chunk_size=2".format(self.url_prefix),
+                                 headers={"Content-Type": "application/json"},
+                                 data=payload)
+        response_json = response.get_json()
+        self.pp(response_json)
+
+        # Invalid albums fail on their own, everything else is created
+        self.assertTrue(response.status_code == 207)
+        self.assertTrue([a["status"] for a in response_json["artists"]] == ["created", "created"])
+        self.assertTrue([t["status"] for t in response_json["tracks"]] == ["created"])
+        self.assertTrue([a["status"] for a in response_json["albums"]] ==
+                        ["created", "failed", "failed", "created"])
+        self.assertTrue([a["index"] for a in response_json["albums"]] == [0, 1, 2, 3])
+        self.assertIsNotNone(response_json["albums"][1]["error"])
+        self.assertTrue(response_json["albums"][2]["error"] == "ValueError: Unknown store 'unknown'")
+
+        # Check the created album made it to the database with its stores and tracks
+        response = self.app.get(response_json["albums"][0]["uri"])
+        response_json = response.get_json()
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response_json["title"] == "Bulk Album")
+        self.assertTrue(sorted(response_json["stores"]) == ["apple", "spotify"])
+        self.assertTrue(len(response_json["tracks"]) == 2)
+
+    def test_bulk_create_invalid_payload(self):
+        for payload in ([], None, dict(albums={}), dict(artists="Bulk Artist")):
+            for query_string in ("", "?async=true"):
+                response = self.app.post("{}/bulk{}".format(self.url_prefix, query_string),
+                                         headers={"Content-Type": "application/json"}, data=json.dumps(payload))
+
+                self.assertTrue(response.status_code == 400, (payload, query_string))
+                self.assertTrue(response.get_json()["message"] == "Expected lists of artists, tracks, albums")
+
+    def test_bulk_create_failed_item_leaves_nothing(self):
+        track = dict(title="Rejected Bulk Track", version="Studio Edit", explicit=False, isrc="TEST000000001",
+                     audio_file="https://cdn.coolcompany.io/test.wav",
+                     artists=[dict(name="Pink"), dict(name="Rejected Bulk Artist")])
+        album = dict(title="Rejected Bulk Album", upc="00000000000111", release_date="not a date",
+                     artwork_file="https://cdn.coolcompany.io/test.jpg", stores=["spotify"], tracks=[track])
+        kept = dict(album, title="Kept Bulk Album", release_date="2021-01-01",
+                    tracks=[dict(track, title="Kept Bulk Track", artists=[dict(name="Kept Bulk Artist")])])
+        response = self.app.post("{}/bulk".format(self.url_prefix), headers={"Content-Type": "application/json"},
+                                 data=json.dumps(dict(albums=[album, kept, album])))
+        results = response.get_json()["albums"]
+        kept_album = self.app.get(results[1]["uri"]).get_json()
+        self.app.delete(results[1]["uri"])
+        self.app.delete(kept_album["tracks"][0]["uri"])
+        self.app.delete(kept_album["tracks"][0]["artists"][0]["uri"])
+
+        self.assertTrue([r["status"] for r in results] == ["failed", "created", "failed"])
+        # Neither the new artist nor the track of the rejected albums were created, the others were
+        self.assertFalse(self.app.get("{}/artists?name=Rejected Bulk Artist".format(self.url_prefix)).get_json())
+        self.assertFalse(Track.query.filter_by(title="Rejected Bulk Track").count())
+        self.assertTrue(kept_album["tracks"][0]["artists"][0]["name"] == "Kept Bulk Artist")
+
+    def get_all(self, resource):
+        """
+        Every item of the /all listing of ``resource``, following X-Next-Cursor through its pages.
+        """
+        items = []
+        url = '{}/{}/all'.format(self.url_prefix, resource)
+        while True:
+            response = self.app.get(url)
+            items.extend(response.get_json())
+            if "X-Next-Cursor" not in response.headers:
+                return items
+            url = '{}/{}/all?after={}'.format(self.url_prefix, resource, response.headers["X-Next-Cursor"])
+
     @staticmethod
     def pp(json_to_print):
         print(json.dumps(json_to_print, indent=4))
@@ -450,6 +695,8 @@ class TestRoutes(TestCase):
 
     @staticmethod
     def create_stores():
+        existing = {s.name for s in Store.query.all()}
         for store in StoreEnum:
-            db_session.add(Store(store))
+            if store not in existing:
+                db_session.add(Store(store))
         db_session.commit()
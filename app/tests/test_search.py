@@ -0,0 +1,85 @@
+import json
+from unittest import TestCase
+
+from app import app
+from app.database import db_session
+from app.search import match_expression
+
+
+class TestSearch(TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.url_prefix = "/api/v1/resources"
+        payload = json.dumps(dict(title="Quixotic Sunrise",
+                                  upc="00000000000555",
+                                  artwork_file="https://cdn.coolcompany.io/test.jpg",
+                                  release_date="2021-01-01",
+                                  stores=["spotify"],
+                                  tracks=[dict(title="Quixotic Sunset",
+                                               version="Quixotic Radio Edit",
+                                               explicit=False,
+                                               isrc="TEST000000555",
+                                               audio_file="https://cdn.coolcompany.io/test.wav",
+                                               artists=[dict(name="Quixotic Quartet")])]))
+        self.album = self.app.post("{}/albums/new".format(self.url_prefix),
+                                   headers={"Content-Type": "application/json"},
+                                   data=payload).get_json()
+        self.track = self.album["tracks"][0]
+        self.artist = self.track["artists"][0]
+
+    def tearDown(self):
+        for uri in (self.album["uri"], self.track["uri"], self.artist["uri"]):
+            self.app.delete(uri)
+        db_session.remove()
+
+    def search(self, query_string):
+        response = self.app.get("/api/v1/search?{}".format(query_string))
+        self.assertTrue(response.status_code == 200)
+        return response.get_json()
+
+    def test_prefix_search(self):
+        uris = [hit["uri"] for hit in self.search("q=quixo")]
+
+        self.assertTrue(sorted(uris) == sorted([self.album["uri"], self.track["uri"], self.artist["uri"]]))
+
+    def test_every_word_must_match(self):
+        hits = self.search("q=quixotic sunse")
+
+        self.assertTrue([hit["uri"] for hit in hits] == [self.track["uri"]])
+        self.assertTrue(hits[0]["type"] == "track")
+        self.assertTrue(hits[0]["version"] == "Quixotic Radio Edit")
+
+    def test_ranking(self):
+        # The track matches in its title and its version
+        self.assertTrue(self.search("q=quixotic&type=track,album")[0]["uri"] == self.track["uri"])
+
+    def test_type_filter(self):
+        hits = self.search("q=quixotic&type=artist")
+
+        self.assertTrue([hit["uri"] for hit in hits] == [self.artist["uri"]])
+        self.assertTrue(hits[0]["name"] == "Quixotic Quartet")
+        self.assertTrue(self.app.get("/api/v1/search?q=quixotic&type=playlist").status_code == 400)
+
+    def test_pagination(self):
+        response = self.app.get("/api/v1/search?q=quixotic&limit=2")
+        next_page = response.headers["Link"].split(";")[0].strip("<>")
+
+        self.assertTrue(len(response.get_json()) == 2)
+        self.assertTrue(response.headers["X-Next-Cursor"] == "2")
+        self.assertTrue(len(self.app.get(next_page).get_json()) == 1)
+
+    def test_index_follows_updates_and_deletes(self):
+        self.app.put(self.track["uri"], headers={"Content-Type": "application/json"},
+                     data=json.dumps(dict(title="Quixotic Moonrise")))
+
+        self.assertTrue([hit["uri"] for hit in self.search("q=moonri")] == [self.track["uri"]])
+        self.assertFalse(self.search("q=quixotic sunset"))
+
+        self.app.delete(self.album["uri"])
+
+        self.assertNotIn(self.album["uri"], [hit["uri"] for hit in self.search("q=quixotic")])
+
+    def test_query_syntax_is_searched_as_text(self):
+        self.assertTrue(match_expression('sun* OR "NEAR(') == '"sun"* "OR"* "NEAR"*')
+        self.assertIsNone(match_expression('"*'))
+        self.assertFalse(self.search("q=%22*"))
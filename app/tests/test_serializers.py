@@ -0,0 +1,69 @@
+import json
+from unittest import TestCase
+
+from flask_restful import fields, marshal
+
+from app import app
+from app.api_v1 import artist_fields, track_fields, album_fields
+from app.fieldsets import prune_fields
+from app.models.all import Album, Artist, Store, StoreEnum, Track
+from app.serializers import compile_fields
+
+
+class TestSerializers(TestCase):
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def assertSameOutput(self, data, field_map):
+        expected = json.dumps(marshal(data, field_map), indent=4)
+        actual = json.dumps(compile_fields(field_map)(data), indent=4)
+        self.assertTrue(actual == expected, "\n{}\n!=\n{}".format(actual, expected))
+
+    @staticmethod
+    def make_album(album_id):
+        album = Album(title="Serialized Album {}".format(album_id), upc="00000000000111",
+                      artwork_file="https://cdn.coolcompany.io/test.jpg", release_date="2021-01-01")
+        album.album_id = album_id
+        album.stores = [Store(name=StoreEnum.spotify), Store(name=StoreEnum.apple)]
+        album.tracks = [Track(title="Serialized Track {}".format(i), version=None, explicit=i % 2 == 0,
+                              isrc="TEST00000000{}".format(i), audio_file="https://cdn.coolcompany.io/test.wav",
+                              artists=[dict(name="Pink"), dict(name=None)])
+                        for i in range(3)]
+        for i, track in enumerate(album.tracks):
+            track.track_id = album_id * 10 + i
+            for j, artist in enumerate(track.artists):
+                artist.artist_id = album_id * 100 + i * 10 + j
+        return album
+
+    def test_artist(self):
+        artist = Artist(name="Pink")
+        artist.artist_id = 1
+
+        self.assertSameOutput(artist, artist_fields)
+        self.assertSameOutput([artist, artist], artist_fields)
+
+    def test_track(self):
+        self.assertSameOutput(self.make_album(1).tracks[0], track_fields)
+        self.assertSameOutput(self.make_album(1).tracks, track_fields)
+
+    def test_album(self):
+        self.assertSameOutput(self.make_album(1), album_fields)
+        self.assertSameOutput([self.make_album(1), self.make_album(2)], album_fields)
+
+    def test_empty_album(self):
+        album = Album(title=None, upc=None, artwork_file=None, release_date="2021-01-01")
+        album.album_id = 3
+
+        self.assertSameOutput(album, album_fields)
+
+    def test_error(self):
+        self.assertSameOutput({"error": "not found", "status": 404}, {'error': fields.String, 'status': fields.Integer})
+
+    def test_pruned_fields(self):
+        field_map = prune_fields(Album, album_fields, {"title", "tracks.title", "tracks.uri"}, None)
+
+        self.assertSameOutput(self.make_album(1), field_map)
@@ -0,0 +1,106 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from unittest import TestCase
+
+from app import app
+from app.cache import response_cache
+from app.database import db_session
+from app.server import main, warm_up
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestWarmUp(TestCase):
+    def tearDown(self):
+        db_session.remove()
+
+    def test_warm_up_leaves_the_response_cache_empty(self):
+        app.test_client().get("/api/v1/resources/artists/all?limit=1")
+        warm_up(app)
+
+        self.assertTrue(len(response_cache.backend._entries) == 0)
+
+    def test_main_needs_prefork(self):
+        # The tests import the app without PREFORK, as `python -m app.server` would
+        with self.assertRaises(SystemExit) as raised:
+            main(["--no-warm-up"])
+
+        self.assertTrue(raised.exception.code == 2)
+
+
+class TestServer(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        env = dict(os.environ, DATABASE_URL="sqlite:///" + os.path.join(self.directory.name, "server.db"))
+        self.server = subprocess.Popen([sys.executable, "server.py", "--bind", "127.0.0.1:{}".format(self.port),
+                                        "--workers", "2", "--threads", "2"],
+                                       cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.wait_for_port()
+
+    def tearDown(self):
+        if self.server.poll() is None:
+            # Killing the master would leave its workers running
+            self.server.terminate()
+            try:
+                self.server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.server.kill()
+                self.server.wait()
+        self.directory.cleanup()
+
+    def wait_for_port(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.assertTrue(self.server.poll() is None)
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        self.fail("The server did not start listening")
+
+    def open(self, path, data=None):
+        request = urllib.request.Request("http://127.0.0.1:{}{}".format(self.port, path),
+                                         data=json.dumps(data).encode() if data else None,
+                                         headers={"Content-Type": "application/json"})
+        return urllib.request.urlopen(request, timeout=10)
+
+    def test_workers_serve_requests(self):
+        created = self.open("/api/v1/resources/artists/new", dict(name="Prefork artist"))
+        self.assertTrue(created.status == 201)
+
+        for _ in range(4):
+            response = self.open("/api/v1/resources/artists/all?name=Prefork%20artist")
+            self.assertTrue(response.status == 200)
+            self.assertTrue(len(json.loads(response.read())) == 1)
+
+    def test_workers_see_each_others_writes(self):
+        created = json.loads(self.open("/api/v1/resources/artists/new", dict(name="Prefork cached")).read())
+        # Spread over new connections, the GETs cache the artist in both workers
+        for _ in range(8):
+            self.open(created["uri"]).read()
+
+        request = urllib.request.Request("http://127.0.0.1:{}{}".format(self.port, created["uri"]), method="PUT",
+                                         data=json.dumps(dict(name="Prefork cached UPDATED")).encode(),
+                                         headers={"Content-Type": "application/json"})
+        self.assertTrue(urllib.request.urlopen(request, timeout=10).status == 201)
+
+        for _ in range(8):
+            self.assertTrue(json.loads(self.open(created["uri"]).read())["name"] == "Prefork cached UPDATED")
+
+    def test_sigterm_stops_the_workers(self):
+        self.server.send_signal(signal.SIGTERM)
+
+        self.assertTrue(self.server.wait(timeout=10) == 0)
+        with self.assertRaises(OSError):
+            socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
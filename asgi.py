@@ -0,0 +1,3 @@
+from app.asgi import application
+
+# Serve with an ASGI server, e.g. uvicorn asgi:application
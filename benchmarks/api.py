@@ -0,0 +1,323 @@
+"""
+Benchmark the REST API against a seeded synthetic catalog.
+
+    python -m benchmarks.api [--tracks 10000] [--requests 200] [--output results.json]
+    python -m benchmarks.api --tracks 100000 --compare results.json
+
+The catalog is written to its own SQLite file (--database), never to the database of the app or
+the tests, and is reused by later runs of the same scale. Every endpoint is driven through the
+Flask test client; for each one the p50/p99 latency, throughput, SQL statements per request and
+the peak RSS of the process so far are reported. Results are printed and written as JSON, with the
+git commit they were measured at, so that runs can be compared between commits with --compare.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_DATABASE = os.path.join(tempfile.gettempdir(), "music_service_api_benchmark_{tracks}.db")
+
+# Titles are made of words of a 4000 word vocabulary, so that each word is in about 0.1% of them
+_SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "da", "fe", "go", "hu", "ji", "pa", "qu"]
+VOCABULARY = ["".join(_SYLLABLES[(i >> shift) % 16] for shift in (0, 4, 8)) + _SYLLABLES[i % 15]
+              for i in range(4000)]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=10000, help="catalog size in tracks")
+    parser.add_argument("--tracks-per-album", type=int, default=12)
+    parser.add_argument("--tracks-per-artist", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--database", help="SQLite file to seed, default {}".format(DEFAULT_DATABASE))
+    parser.add_argument("--reseed", action="store_true", help="seed the catalog again even if it exists")
+    parser.add_argument("--no-cache", action="store_true", help="disable the response cache")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare the results with those in this JSON file")
+    parser.add_argument("--endpoints",
+                        help="only benchmark the endpoints whose name matches this regular expression")
+    return parser.parse_args(argv)
+
+
+def configure(args):
+    """
+    Point the app at the benchmark database. Must run before the app is imported.
+    """
+    database = args.database or DEFAULT_DATABASE.format(tracks=args.tracks)
+    if args.reseed and os.path.exists(database):
+        os.remove(database)
+    os.environ["DATABASE_URL"] = "sqlite:///{}".format(database)
+    os.environ.setdefault("FLASK_CONFIG", "production")
+    os.environ["SQLALCHEMY_ECHO"] = "false"
+    if args.no_cache:
+        os.environ["RESPONSE_CACHE_SIZE"] = "0"
+    return database
+
+
+def seed(args, chunk_size=10000):
+    """
+    Insert a synthetic catalog of ``args.tracks`` tracks, unless the database already holds one.
+    Artist popularity is skewed, so that a few artists are credited on many tracks, and about a
+    third of the tracks have a featured artist as well.
+    """
+    from app.database import engine
+    from app.models.all import Album, AlbumToStoresAssociation, Artist, ArtistRole, ArtistToTrackAssociation, \
+        Track, TrackToAlbumAssociation
+    from app.stores import store_cache
+
+    with engine.connect() as connection:
+        if connection.exec_driver_sql("SELECT count(*) FROM tracks").scalar():
+            return False
+
+    rng = random.Random(args.seed)
+    now = datetime.datetime.utcnow()
+    artist_count = max(1, args.tracks // args.tracks_per_artist)
+    album_count = max(1, args.tracks // args.tracks_per_album)
+    store_ids = list(store_cache.load().values())
+
+    def title(i):
+        return " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(1, 4))).title()
+
+    def rows(table, count, make_row):
+        with engine.begin() as connection:
+            for start in range(0, count, chunk_size):
+                ids = range(start + 1, min(start + chunk_size, count) + 1)
+                connection.execute(table.insert(), [make_row(i) for i in ids])
+
+    def artist_credits(track_id):
+        primary = int(artist_count * rng.random() ** 3) + 1
+        credits = [dict(artist_id=primary, track_id=track_id, role=ArtistRole.primary_artist)]
+        if rng.random() < 0.3:
+            featured = rng.randint(1, artist_count)
+            if featured != primary:
+                credits.append(dict(artist_id=featured, track_id=track_id, role=ArtistRole.secondary_artist))
+        return credits
+
+    rows(Artist.__table__, artist_count,
+         lambda i: dict(artist_id=i, name="Benchmark Artist {}".format(i), updated_at=now))
+    rows(Track.__table__, args.tracks,
+         lambda i: dict(track_id=i, title=title(i),
+                        version=rng.choice(["Studio Edit", "Radio Edit", "Live", None]),
+                        explicit=rng.random() < 0.2, isrc="BNCH{:08d}".format(i),
+                        audio_file="https://cdn.coolcompany.io/{}.wav".format(i), updated_at=now))
+    with engine.begin() as connection:
+        for start in range(1, args.tracks + 1, chunk_size):
+            track_ids = range(start, min(start + chunk_size, args.tracks + 1))
+            connection.execute(ArtistToTrackAssociation.__table__.insert(),
+                               [c for i in track_ids for c in artist_credits(i)])
+    rows(Album.__table__, album_count,
+         lambda i: dict(album_id=i, title=title(i), upc="{:014d}".format(i),
+                        artwork_file="https://cdn.coolcompany.io/{}.jpg".format(i),
+                        release_date=datetime.date(2000, 1, 1) + datetime.timedelta(days=rng.randint(0, 9000)),
+                        updated_at=now))
+    # Tracks go to albums in order, the last album takes the remainder
+    rows(TrackToAlbumAssociation.__table__, args.tracks,
+         lambda i: dict(track_id=i, album_id=min((i - 1) // args.tracks_per_album + 1, album_count)))
+    with engine.begin() as connection:
+        connection.execute(AlbumToStoresAssociation.__table__.insert(),
+                           [dict(album_id=a, store_id=s) for a in range(1, album_count + 1)
+                            for s in rng.sample(store_ids, rng.randint(1, len(store_ids)))])
+    return True
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def measure(client, requests, make_request, statements):
+    """
+    Send ``requests`` requests built by ``make_request(client, i)`` and summarise them.
+    """
+    from app.database import db_session
+
+    latencies = []
+    statement_counts = []
+    started = time.perf_counter()
+    for i in range(requests):
+        del statements[:]
+        request_started = time.perf_counter()
+        response = make_request(client, i)
+        response.get_data()
+        latencies.append(time.perf_counter() - request_started)
+        statement_counts.append(len(statements))
+        # What the teardown in app.py does for the real server
+        db_session.remove()
+        if response.status_code >= 400:
+            raise RuntimeError("{} answered {}".format(response.request.path, response.status_code))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return dict(requests=requests,
+                p50_ms=round(percentile(latencies, 0.5) * 1000, 3),
+                p99_ms=round(percentile(latencies, 0.99) * 1000, 3),
+                mean_ms=round(sum(latencies) / requests * 1000, 3),
+                throughput_rps=round(requests / elapsed, 1),
+                statements_per_request=round(sum(statement_counts) / requests, 2),
+                peak_rss_mb=peak_rss_mb())
+
+
+def endpoints(args, rng):
+    """
+    (name, number of requests, make_request) for every endpoint, in the order they are run.
+    Writes come last and only touch rows they create themselves.
+    """
+    prefix = "/api/v1/resources"
+    artist_count = max(1, args.tracks // args.tracks_per_artist)
+    album_count = max(1, args.tracks // args.tracks_per_album)
+    n = args.requests
+    track = lambda i: dict(title="Benchmark New Track {}".format(i), version="Studio Edit", explicit=False,
+                           isrc="BNEW{:08d}".format(i), audio_file="https://cdn.coolcompany.io/new.wav",
+                           artists=[dict(name="Benchmark Artist {}".format(rng.randint(1, artist_count)))])
+    album = lambda i: dict(title="Benchmark New Album {}".format(i), upc="{:014d}".format(10 ** 13 + i),
+                           artwork_file="https://cdn.coolcompany.io/new.jpg", release_date="2021-01-01",
+                           stores=["spotify", "apple"],
+                           tracks=[track(i * 100 + j) for j in range(args.tracks_per_album)])
+    post = lambda client, url, payload: client.post(url, headers={"Content-Type": "application/json"},
+                                                    data=json.dumps(payload))
+    created = {}
+
+    def create_and_remember(kind, client, i, payload):
+        response = post(client, "{}/{}/new".format(prefix, kind), payload)
+        created.setdefault(kind, []).append(response.get_json()["uri"])
+        return response
+
+    def conditional_album(client, i):
+        uri = "{}/albums/{}".format(prefix, rng.randint(1, album_count))
+        etag = client.get(uri).headers.get("ETag", "")
+        return client.get(uri, headers={"If-None-Match": etag})
+
+    def put_track(client, i):
+        uris = created["tracks"]
+        return client.put(uris[i % len(uris)], headers={"Content-Type": "application/json"},
+                          data=json.dumps(dict(title="Benchmark Updated Track {}".format(i))))
+
+    return [
+        ("GET artists/all", n, lambda c, i: c.get("{}/artists/all".format(prefix))),
+        ("GET tracks/all", n, lambda c, i: c.get("{}/tracks/all".format(prefix))),
+        ("GET albums/all", n, lambda c, i: c.get("{}/albums/all".format(prefix))),
+        ("GET albums/all deep page", n,
+         lambda c, i: c.get("{}/albums/all?after={}".format(prefix, rng.randint(101, album_count + 101)))),
+        ("GET albums/all sparse", n, lambda c, i: c.get("{}/albums/all?fields=album_id,title".format(prefix))),
+        ("GET artist", n, lambda c, i: c.get("{}/artists/{}".format(prefix, rng.randint(1, artist_count)))),
+        ("GET track", n, lambda c, i: c.get("{}/tracks/{}".format(prefix, rng.randint(1, args.tracks)))),
+        ("GET album", n, lambda c, i: c.get("{}/albums/{}".format(prefix, rng.randint(1, album_count)))),
+        ("GET album sparse", n, lambda c, i: c.get(
+            "{}/albums/{}?fields=title,tracks.title&expand=tracks".format(prefix, rng.randint(1, album_count)))),
+        ("GET album conditional", n, conditional_album),
+        ("GET artists?name=", n, lambda c, i: c.get(
+            "{}/artists?name=Benchmark Artist {}".format(prefix, rng.randint(1, artist_count)))),
+        ("GET tracks?isrc=", n, lambda c, i: c.get(
+            "{}/tracks?isrc=BNCH{:08d}".format(prefix, rng.randint(1, args.tracks)))),
+        ("GET albums?upc=", n, lambda c, i: c.get(
+            "{}/albums?upc={:014d}".format(prefix, rng.randint(1, album_count)))),
+        ("GET tracks?explicit=", n, lambda c, i: c.get(
+            "{}/tracks?explicit={}&after={}".format(prefix, "true" if i % 2 else "false",
+                                                    rng.randint(2, args.tracks)))),
+        ("GET tracks?artist_id=", n, lambda c, i: c.get(
+            "{}/tracks?artist_id={}".format(prefix, rng.randint(1, artist_count)))),
+        ("GET albums?store=", n, lambda c, i: c.get(
+            "{}/albums?store={}&after={}".format(prefix, rng.choice(["spotify", "apple", "youtube"]),
+                                                 rng.randint(2, album_count)))),
+        ("GET albums?release_date>=", n, lambda c, i: c.get("{}/albums?release_date>={}".format(
+            prefix, datetime.date(2000, 1, 1) + datetime.timedelta(days=rng.randint(0, 9000))))),
+        ("GET search", n, lambda c, i: c.get("/api/v1/search?q={} {}".format(
+            rng.choice(VOCABULARY), rng.choice(VOCABULARY)[:3]))),
+        ("GET search one word", n, lambda c, i: c.get("/api/v1/search?q={}".format(rng.choice(VOCABULARY)))),
+        ("GET search artists", n, lambda c, i: c.get(
+            "/api/v1/search?q=artist {}&type=artist".format(rng.randint(1, artist_count)))),
+        ("GET export/tracks", 3, lambda c, i: c.get("/api/v1/export/tracks?format=ndjson")),
+        ("POST track", n, lambda c, i: create_and_remember("tracks", c, i, track(i))),
+        ("POST album", n, lambda c, i: create_and_remember("albums", c, i, album(i))),
+        ("POST bulk", max(1, n // 20), lambda c, i: post(
+            c, "{}/bulk".format(prefix), dict(albums=[album(10 ** 4 * (i + 1) + j) for j in range(20)]))),
+        ("PUT track", n, put_track),
+        ("DELETE album", n, lambda c, i: c.delete(created["albums"][i % len(created["albums"])])),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    database = configure(args)
+
+    from sqlalchemy import event
+
+    import sqlalchemy
+    from app import app
+    from app.database import engine
+
+    seeding_started = time.perf_counter()
+    seeded = seed(args)
+    seeding_seconds = time.perf_counter() - seeding_started
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *a: statements.append(a[2]))
+
+    rng = random.Random(args.seed)
+    results = dict(
+        meta=dict(commit=git_commit(),
+                  date=datetime.datetime.utcnow().isoformat(),
+                  python=platform.python_version(),
+                  sqlalchemy=sqlalchemy.__version__,
+                  database=database,
+                  tracks=args.tracks,
+                  tracks_per_album=args.tracks_per_album,
+                  tracks_per_artist=args.tracks_per_artist,
+                  response_cache=not args.no_cache,
+                  seeded_seconds=round(seeding_seconds, 1) if seeded else None),
+        endpoints={})
+    client = app.test_client()
+    for name, requests, make_request in endpoints(args, rng):
+        if args.endpoints and not re.search(args.endpoints, name):
+            continue
+        results["endpoints"][name] = measure(client, requests, make_request, statements)
+        print("{:28} {}".format(name, json.dumps(results["endpoints"][name])), file=sys.stderr)
+    return results
+
+
+def compare(results, baseline):
+    """
+    Lines comparing the latency and statement counts of ``results`` with ``baseline``.
+    """
+    lines = ["{:28} {:>12} {:>12} {:>8} {:>14}".format("endpoint", "p50 before", "p50 after", "change",
+                                                       "statements")]
+    for name, after in results["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if before is None:
+            continue
+        change = (after["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100 if before["p50_ms"] else 0
+        lines.append("{:28} {:>10.3f}ms {:>10.3f}ms {:>+7.1f}% {:>6} -> {:<6}".format(
+            name, before["p50_ms"], after["p50_ms"], change,
+            before["statements_per_request"], after["statements_per_request"]))
+    return lines
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = run(args)
+    print(json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(results, json.load(f))))
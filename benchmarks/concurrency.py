@@ -0,0 +1,213 @@
+"""
+Compare how far concurrency scales per process in the threaded WSGI mode and the ASGI mode.
+
+    python -m benchmarks.concurrency [--tracks 10000] [--concurrency 1,8,32,128] [--threads 16]
+    python -m benchmarks.concurrency --db-latency 5 --output results.json
+
+Each mode is served by one process on a local port, the threaded WSGI app by a worker of app.server
+with a pool of --threads threads, the ASGI app by uvicorn on one event loop. Every request is for a
+random artist, track or album of the catalog seeded by benchmarks.api, with the response cache off
+so that each one reaches the database. For every number of concurrent clients the throughput and
+p50/p99 latencies are reported. SQLite answers these in microseconds from the page cache; --db-latency
+adds that many milliseconds to every statement to stand in for a database across the network, which is
+where waiting on the database without holding a thread pays off.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.api import configure, percentile, seed
+
+MODES = ("wsgi", "asgi")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=10000, help="catalog size in tracks")
+    parser.add_argument("--tracks-per-album", type=int, default=12)
+    parser.add_argument("--tracks-per-artist", type=int, default=8)
+    parser.add_argument("--database", help="SQLite file to seed, shared with benchmarks.api")
+    parser.add_argument("--reseed", action="store_true", help="seed the catalog again even if it exists")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--concurrency", default="1,8,32,128",
+                        help="comma separated numbers of concurrent clients")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per number of clients")
+    parser.add_argument("--threads", type=int, default=16, help="worker threads of the WSGI server")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="milliseconds added to every statement")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma separated modes to benchmark")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    # Internal: run the server of one mode
+    parser.add_argument("--serve", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    # Every request should reach the database
+    parser.set_defaults(no_cache=True)
+    return parser.parse_args(argv)
+
+
+def add_db_latency(sync_engine, seconds, asynchronous):
+    """
+    Make every statement of ``sync_engine`` wait ``seconds`` first: blocking the thread in WSGI
+    mode, awaiting on the event loop in ASGI mode.
+    """
+    from sqlalchemy import event
+    from sqlalchemy.util import await_only
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def wait(conn, cursor, statement, parameters, context, executemany):
+        if asynchronous:
+            await_only(asyncio.sleep(seconds))
+        else:
+            time.sleep(seconds)
+
+
+def serve(args):
+    """
+    Serve the app in ``args.serve`` mode on ``args.port`` until killed.
+    """
+    if args.serve == "wsgi":
+        from app import app
+        from app.database import engine
+        from app.server import listen, make_server
+
+        if args.db_latency:
+            add_db_latency(engine, args.db_latency / 1000, asynchronous=False)
+        make_server(app, listen("127.0.0.1:{}".format(args.port), 1024), args.threads).serve_forever()
+    else:
+        import uvicorn
+
+        from app.asgi import application, async_engine
+
+        if args.db_latency:
+            add_db_latency(async_engine.sync_engine, args.db_latency / 1000, asynchronous=True)
+        uvicorn.run(application, host="127.0.0.1", port=args.port, log_level="warning", backlog=1024)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The server exited with {}".format(process.returncode))
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("The server did not start listening on port {}".format(port))
+
+
+async def fetch(port, path):
+    """
+    GET ``path`` on a new connection and return the status code.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write("GET {} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".format(path).encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b" ", 2)[1])
+
+
+async def load(port, paths, clients):
+    """
+    Send ``paths`` from ``clients`` concurrent clients and summarise the responses.
+    """
+    latencies = []
+    errors = 0
+    queue = list(reversed(paths))
+
+    async def client():
+        nonlocal errors
+        while queue:
+            path = queue.pop()
+            started = time.perf_counter()
+            if await fetch(port, path) >= 400:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return dict(clients=clients,
+                requests=len(latencies),
+                errors=errors,
+                throughput_rps=round(len(latencies) / elapsed, 1),
+                p50_ms=round(percentile(latencies, 0.5) * 1000, 3),
+                p99_ms=round(percentile(latencies, 0.99) * 1000, 3))
+
+
+def request_paths(args, count, rng):
+    prefix = "/api/v1/resources"
+    artist_count = max(1, args.tracks // args.tracks_per_artist)
+    album_count = max(1, args.tracks // args.tracks_per_album)
+    kinds = [("artists", artist_count), ("tracks", args.tracks), ("albums", album_count)]
+    return ["{}/{}/{}".format(prefix, kind, rng.randint(1, n))
+            for kind, n in (rng.choice(kinds) for _ in range(count))]
+
+
+def run(args):
+    database = configure(args)
+    seed(args)
+
+    rng = random.Random(args.seed)
+    levels = [int(c) for c in args.concurrency.split(",")]
+    results = dict(meta=dict(database=database, tracks=args.tracks, threads=args.threads,
+                             db_latency_ms=args.db_latency, requests=args.requests),
+                   modes={})
+    for mode in args.modes.split(","):
+        port = free_port()
+        command = [sys.executable, "-m", "benchmarks.concurrency", "--serve", mode, "--port", str(port),
+                   "--threads", str(args.threads), "--db-latency", str(args.db_latency)]
+        server = subprocess.Popen(command, env=os.environ.copy())
+        try:
+            wait_for_port(port, server)
+            # Warm up the connection pool and the statement caches
+            asyncio.run(load(port, request_paths(args, 100, rng), 8))
+            results["modes"][mode] = []
+            for clients in levels:
+                result = asyncio.run(load(port, request_paths(args, args.requests, rng), clients))
+                results["modes"][mode].append(result)
+                print("{:5} {}".format(mode, json.dumps(result)), file=sys.stderr)
+        finally:
+            server.terminate()
+            server.wait()
+    return results
+
+
+def table(results):
+    """
+    Lines comparing the throughput and p99 latency of the modes per number of clients.
+    """
+    modes = list(results["modes"])
+    lines = ["{:>8} ".format("clients") + "".join("{:>14} {:>10}".format(m + " rps", "p99") for m in modes)]
+    for i, clients in enumerate(r["clients"] for r in results["modes"][modes[0]]):
+        lines.append("{:>8} ".format(clients) + "".join(
+            "{:>14} {:>8.1f}ms".format(results["modes"][m][i]["throughput_rps"], results["modes"][m][i]["p99_ms"])
+            for m in modes))
+    return lines
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.serve:
+        configure(args)
+        serve(args)
+    else:
+        results = run(args)
+        print(json.dumps(results, indent=4))
+        print("\n".join(table(results)))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=4)
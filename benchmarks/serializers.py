@@ -0,0 +1,72 @@
+"""
+Compare flask_restful's marshal with the precompiled serialisers of app.serializers.
+
+    python -m benchmarks.serializers [--objects 10000] [--albums 100] [--repeat 3]
+
+Albums embed 10 tracks each. marshal() is very slow on them, because fields.Url hands every
+loaded attribute, nested collections included, to url_for, so they are benchmarked separately.
+"""
+import argparse
+import json
+import timeit
+
+from flask_restful import marshal
+
+from app import app
+from app.api_v1 import album_fields, track_fields
+from app.models.all import Album, Store, StoreEnum, Track
+from app.serializers import compile_fields
+
+
+def make_tracks(count):
+    tracks = []
+    for i in range(count):
+        track = Track(title="Track {}".format(i), version="Studio Edit", explicit=i % 2 == 0,
+                      isrc="TEST{:09d}".format(i), audio_file="https://cdn.coolcompany.io/test.wav",
+                      artists=[dict(name="Artist {}".format(i % 100)), dict(name="Featured {}".format(i % 7))])
+        track.track_id = i + 1
+        for j, artist in enumerate(track.artists):
+            artist.artist_id = i * 2 + j + 1
+        tracks.append(track)
+    return tracks
+
+
+def make_albums(count, tracks_per_album=10):
+    tracks = make_tracks(count * tracks_per_album)
+    stores = [Store(name=s) for s in StoreEnum]
+    for i, store in enumerate(stores):
+        store.store_id = i + 1
+    albums = []
+    for i in range(count):
+        album = Album(title="Album {}".format(i), upc="{:014d}".format(i),
+                      artwork_file="https://cdn.coolcompany.io/test.jpg", release_date="2021-01-01")
+        album.album_id = i + 1
+        album.stores = stores
+        album.tracks = tracks[i * tracks_per_album:(i + 1) * tracks_per_album]
+        albums.append(album)
+    return albums
+
+
+def run(objects, albums, repeat):
+    results = {}
+    with app.test_request_context():
+        for name, data, field_map in (("tracks", make_tracks(objects), track_fields),
+                                      ("albums", make_albums(albums), album_fields)):
+            serialize = compile_fields(field_map)
+            assert json.dumps(serialize(data)) == json.dumps(marshal(data, field_map))
+            marshal_time = min(timeit.repeat(lambda: marshal(data, field_map), number=1, repeat=repeat))
+            compiled_time = min(timeit.repeat(lambda: serialize(data), number=1, repeat=repeat))
+            results[name] = dict(objects=len(data),
+                                 marshal_seconds=round(marshal_time, 4),
+                                 compiled_seconds=round(compiled_time, 4),
+                                 speedup=round(marshal_time / compiled_time, 1))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--objects", type=int, default=10000)
+    parser.add_argument("--albums", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(run(args.objects, args.albums, args.repeat), indent=4))
@@ -1,9 +1,71 @@
+import os
+
+
 class Config(object):
     """
     Common configurations
     """
 
     # Configurations that are common across all environments
+    SQLALCHEMY_ECHO = False
+
+    # Database engine, each setting can be overridden with an environment variable of the same name
+    DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:////tmp/music_service_api.db')
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+    DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE', 3600))
+    DATABASE_POOL_PRE_PING = os.environ.get('DATABASE_POOL_PRE_PING', 'true').lower() == 'true'
+
+    # URL of the database for app.asgi, by default DATABASE_URL with the async driver of its backend
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+
+    # Comma-separated URLs of read-only copies of the database to serve GET requests from, and seconds
+    # for which the clients that wrote something keep reading from the primary database
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                             if url.strip()]
+    REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
+    # SQLite tuning applied to every new connection
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))  # milliseconds
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))  # bytes
+    # Enforce foreign keys, so that association rows cannot point at deleted artists, tracks and albums
+    SQLITE_FOREIGN_KEYS = os.environ.get('SQLITE_FOREIGN_KEYS', 'true').lower() == 'true'
+
+    # In-process cache of GET responses, a size of 0 disables it
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 10000))
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 60))  # seconds
+
+    # Write JSON responses with orjson if it is installed (same JSON, compact whitespace)
+    FAST_JSON = os.environ.get('FAST_JSON', 'false').lower() == 'true'
+
+    # Time every request (Server-Timing header) and serve the aggregated timings at /metrics
+    INSTRUMENTATION = os.environ.get('INSTRUMENTATION', 'false').lower() == 'true'
+
+    # Log statements slower than SLOW_QUERY_MS milliseconds, and requests running the same SELECT more
+    # than N_PLUS_ONE_THRESHOLD times (raising NPlusOneError too if N_PLUS_ONE_RAISE is on)
+    SLOW_QUERY_MS = float(os.environ['SLOW_QUERY_MS']) if os.environ.get('SLOW_QUERY_MS') else None
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 0))
+    N_PLUS_ONE_RAISE = os.environ.get('N_PLUS_ONE_RAISE', 'false').lower() == 'true'
+
+    # Background jobs: worker threads per process (0 to leave the jobs to `python -m app.jobs`), seconds
+    # between looks for jobs queued by other processes (0 to only wait for this process' own jobs), and
+    # seconds without progress after which a running job is considered lost and run again
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 5))
+    JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER', 300))
+    # Set by server.py: the app is imported by a master process that forks the workers, which
+    # start their own job worker threads
+    PREFORK = os.environ.get('PREFORK', 'false').lower() == 'true'
+
+    # Seconds for which the response to a POST with an Idempotency-Key header is returned to its retries
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 3600))
+
+    # Deleting albums also deletes the tracks they leave on no album, and deleting tracks the artists
+    # they leave on no track. Off by default, artists and tracks may well be created on their own:
+    # `python -m app.orphans --tracks --artists` collects them explicitly
+    DELETE_ORPHANS = os.environ.get('DELETE_ORPHANS', 'false').lower() == 'true'
 
 
 class DevelopmentConfig(Config):
@@ -12,7 +74,9 @@ class DevelopmentConfig(Config):
     """
 
     DEBUG = True
-    SQLALCHEMY_ECHO = True
+    SQLALCHEMY_ECHO = os.environ.get('SQLALCHEMY_ECHO', 'false').lower() == 'true'
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))
 
 
 class ProductionConfig(Config):
@@ -21,9 +85,16 @@ class ProductionConfig(Config):
     """
 
     DEBUG = False
+    # Answer 400 rather than read whole tables for filtered or sorted listings
+    REFUSE_FULL_SCANS = os.environ.get('REFUSE_FULL_SCANS', 'true').lower() == 'true'
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 20))
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 20))
 
 
 app_config = {
     'development': DevelopmentConfig,
     'production': ProductionConfig
 }
+
+# Pick the configuration with the FLASK_CONFIG environment variable
+config_name = os.environ.get('FLASK_CONFIG', 'development')
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Set before the app is imported: the workers start their job threads after they are forked
+os.environ["PREFORK"] = "true"
+
+from app.server import main
+
+if __name__ == '__main__':
+    sys.exit(main())